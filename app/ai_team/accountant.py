@@ -1,25 +1,33 @@
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import or_, update
+from sqlalchemy.orm import joinedload
 from app import db
-from app.models import Payment, SubscriptionPlan
+from app.models import Payment
 from app.utils.payments import payfast
+from app.utils.reference import reference_data
+from app.utils.query_stats import instrument_task
 
 class Accountant:
     def __init__(self):
         self.name = "Accountant AI"
         self.version = "1.0"
         
+        # Task type -> handler, built once per instance
+        self.handlers = {
+            'process_payment': self.process_payment,
+            'generate_invoice': self.generate_invoice,
+            'subscription_renewal': self.handle_subscription_renewal,
+            'expire_boosts': self.expire_boosts
+        }
+        
+    @instrument_task
     def process_task(self, task_data):
-        task_type = task_data.get('task', '')
-        
-        if task_type == 'process_payment':
-            return self.process_payment(task_data)
-        elif task_type == 'generate_invoice':
-            return self.generate_invoice(task_data)
-        elif task_type == 'subscription_renewal':
-            return self.handle_subscription_renewal(task_data)
-        else:
+        handler = self.handlers.get(task_data.get('task', ''))
+        
+        if handler is None:
             return {"status": "error", "message": "Unknown task type"}
+        return handler(task_data)
     
     def process_payment(self, task_data):
         user_id = task_data.get('user_id')
@@ -41,7 +49,7 @@ class Accountant:
         
         # Generate payment data for PayFast
         if payment_type == 'subscription':
-            plan = SubscriptionPlan.query.get(item_id)
+            plan = reference_data.plan(plan_id=item_id)
             item_name = f"{plan.name} Subscription"
         elif payment_type == 'boost':
             from app.models import Business
@@ -83,18 +91,60 @@ class Accountant:
         return {"status": "success", "invoice": invoice}
     
     def handle_subscription_renewal(self, task_data):
-        # Check for expiring subscriptions and send renewal reminders
+        # Send renewal reminders for paid subscriptions expiring within 3 days.
+        # The scheduler passes the window that came into range since its last
+        # run (expiring_after/expiring_before) and pages through it by id
+        # (after_id, limit). Each reminder is recorded as it is sent, so an
+        # owner is reminded once per expiry date even when a failed run's
+        # window is covered again.
         from app.models import Business
         from app.utils.email import send_renewal_reminder
         
-        # Find businesses with subscriptions expiring in 3 days
-        three_days_from_now = datetime.utcnow() + timedelta(days=3)
-        expiring_businesses = Business.query.filter(
-            Business.subscription_expiry <= three_days_from_now,
-            Business.subscription_tier != 'free'
-        ).all()
+        expiring_before = _parse_time(task_data.get('expiring_before')) or datetime.utcnow() + timedelta(days=3)
+        expiring_after = _parse_time(task_data.get('expiring_after'))
+        query = Business.query.options(joinedload(Business.owner)).filter(
+            Business.subscription_expiry <= expiring_before,
+            Business.subscription_tier != 'free',
+            or_(Business.renewal_reminded_for.is_(None),
+                Business.renewal_reminded_for != Business.subscription_expiry)
+        )
+        if expiring_after is not None:
+            query = query.filter(Business.subscription_expiry > expiring_after)
+        limit = task_data.get('limit')
+        if limit:
+            query = query.filter(Business.id > task_data.get('after_id', 0)).order_by(Business.id).limit(limit)
+        expiring_businesses = query.all()
         
         for business in expiring_businesses:
             send_renewal_reminder(business)
+            # Not a change the listing's pages show, so updated_at stays
+            db.session.execute(update(Business).where(Business.id == business.id).values(
+                renewal_reminded_for=business.subscription_expiry, updated_at=Business.updated_at))
+            db.session.commit()
             
-        return {"status": "success", "message": f"Sent renewal reminders to {len(expiring_businesses)} businesses"}
+        return {"status": "success", "message": f"Sent renewal reminders to {len(expiring_businesses)} businesses",
+                "reminded": len(expiring_businesses),
+                "last_id": expiring_businesses[-1].id if expiring_businesses else None}
+    
+    def expire_boosts(self, task_data):
+        # Unfeature listings whose paid boost has run out, up to limit at a time
+        from app.models import Business
+        
+        now = _parse_time(task_data.get('now')) or datetime.utcnow()
+        expired = Business.query.filter(
+            Business.is_featured == True,
+            Business.featured_until <= now
+        ).order_by(Business.id).limit(task_data.get('limit', 500)).all()
+        
+        for business in expired:
+            business.is_featured = False
+            business.featured_until = None
+        db.session.commit()
+        
+        return {"status": "success", "expired": len(expired), "business_ids": [business.id for business in expired]}
+
+
+def _parse_time(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
@@ -1,108 +1,122 @@
 import json
-from datetime import datetime, timedelta
-from app import db
-from app.models import Business, Payment, User
+from datetime import datetime
+from app.models import Business
+from app.utils.analytics import analytics
+from app.utils.peers import peer_stats
+from app.utils.platform_metrics import platform_metrics
+from app.utils.query_stats import instrument_task
+from app.utils.reports import reports
 
 class Analyst:
     def __init__(self):
         self.name = "Analyst AI"
         self.version = "1.0"
         
+        # Task type -> handler, built once per instance
+        self.handlers = {
+            'business_analytics': self.business_analytics,
+            'platform_analytics': self.platform_analytics,
+            'generate_report': self.generate_report
+        }
+        # Task type -> handler taking a list of tasks, used by the agent registry
+        self.batch_handlers = {
+            'business_analytics': self.business_analytics_batch
+        }
+    
+    @instrument_task
     def process_task(self, task_data):
-        task_type = task_data.get('task', '')
+        handler = self.handlers.get(task_data.get('task', ''))
         
-        if task_type == 'business_analytics':
-            return self.business_analytics(task_data)
-        elif task_type == 'platform_analytics':
-            return self.platform_analytics(task_data)
-        elif task_type == 'generate_report':
-            return self.generate_report(task_data)
-        else:
+        if handler is None:
             return {"status": "error", "message": "Unknown task type"}
+        return handler(task_data)
     
     def business_analytics(self, task_data):
-        business_id = task_data.get('business_id')
-        business = Business.query.get(business_id)
-        
-        if not business:
-            return {"status": "error", "message": "Business not found"}
-        
-        # Calculate various metrics
-        today = datetime.utcnow().date()
-        week_ago = today - timedelta(days=7)
-        month_ago = today - timedelta(days=30)
-        
-        # Views over time (simplified)
-        views_today = business.views  # This would normally be tracked per day
-        views_week = int(views_today * 0.7)  # Placeholder calculation
-        views_month = int(views_today * 2.5)  # Placeholder calculation
-        
-        # Engagement rate (placeholder)
-        engagement_rate = min(views_today / 100 * 5, 100) if views_today > 0 else 0
-        
-        # Comparison with similar businesses
-        similar_businesses = Business.query.filter_by(
-            category=business.category, 
-            town=business.town,
-            is_approved=True
-        ).all()
-        
-        avg_views = sum(b.views for b in similar_businesses) / len(similar_businesses) if similar_businesses else 0
-        performance_vs_avg = ((business.views - avg_views) / avg_views * 100) if avg_views > 0 else 0
+        # One listing (business_id) or many (business_ids, or the dashboard's
+        # list of business dicts), answered with the same handful of queries
+        if 'business_id' in task_data:
+            results = self.batch_business_analytics([task_data['business_id']])
+            if not results:
+                return {"status": "error", "message": "Business not found"}
+            return dict(results[0], status="success")
+        
+        business_ids = task_data.get('business_ids') or [b['id'] for b in task_data.get('businesses', [])]
+        return {"status": "success", "businesses": self.batch_business_analytics(business_ids)}
+    
+    def business_analytics_batch(self, tasks):
+        # Single-listing tasks share one batch_business_analytics call
+        ids = [task_data['business_id'] for task_data in tasks if 'business_id' in task_data]
+        found = {item['business_id']: item for item in self.batch_business_analytics(ids)}
+        
+        results = []
+        for task_data in tasks:
+            if 'business_id' not in task_data:
+                try:
+                    results.append(self.business_analytics(task_data))
+                except Exception as exc:
+                    results.append(exc)
+            elif task_data['business_id'] in found:
+                results.append(dict(found[task_data['business_id']], status="success"))
+            else:
+                results.append({"status": "error", "message": "Business not found"})
+        return results
+    
+    def batch_business_analytics(self, business_ids):
+        """[{business_id, metrics, recommendations}] for the listings that exist"""
+        if not business_ids:
+            return []
+        businesses = Business.query.filter(Business.id.in_(business_ids)).all()
+        ids = [business.id for business in businesses]
+        
+        # Trailing windows from the daily rollups, and standing among approved
+        # listings in the same category and town
+        windows = analytics.windows(ids)
+        peers = peer_stats.compare_many(businesses)
+        
+        return [self._business_metrics(business, windows[business.id], peers[business.id])
+                for business in businesses]
+    
+    def _business_metrics(self, business, windows, peers):
+        # Clicks and shares per 100 views over the last 30 days
+        month = windows[30]
+        engagement_rate = (month['clicks'] + month['shares']) / month['views'] * 100 if month['views'] else 0
+        avg_views = peers['mean_views']
         
         return {
-            "status": "success",
+            "business_id": business.id,
             "metrics": {
-                "views_today": views_today,
-                "views_week": views_week,
-                "views_month": views_month,
+                "views_today": windows[1]['views'],
+                "views_week": windows[7]['views'],
+                "views_month": windows[30]['views'],
+                "views_quarter": windows[90]['views'],
                 "engagement_rate": engagement_rate,
-                "performance_vs_avg": performance_vs_avg
+                "performance_vs_avg": peers['performance_vs_avg'],
+                "views_percentile": peers['views_percentile'],
+                "clicks_percentile": peers['clicks_percentile'],
+                "peer_count": peers['peers']
             },
             "recommendations": [
                 "Add more photos to increase engagement" if not business.gallery else "",
-                "Consider boosting your listing for more visibility" if business.views < avg_views else "",
+                "Consider boosting your listing for more visibility" if (business.views or 0) < avg_views else "",
                 "Update your business hours to attract more customers"
             ]
         }
     
     def platform_analytics(self, task_data):
-        # Get platform-wide metrics
-        total_businesses = Business.query.count()
-        active_businesses = Business.query.filter_by(is_active=True).count()
-        approved_businesses = Business.query.filter_by(is_approved=True).count()
-        total_users = User.query.count()
-        
-        # Revenue metrics
-        total_revenue = db.session.query(db.func.sum(Payment.amount)).filter(
-            Payment.payment_status == 'completed'
-        ).scalar() or 0
-        
-        monthly_revenue = db.session.query(db.func.sum(Payment.amount)).filter(
-            Payment.payment_status == 'completed',
-            Payment.created_at >= datetime.utcnow() - timedelta(days=30)
-        ).scalar() or 0
-        
-        # Growth metrics
-        businesses_added_today = Business.query.filter(
-            Business.created_at >= datetime.utcnow().date()
-        ).count()
-        
-        users_registered_today = User.query.filter(
-            User.created_at >= datetime.utcnow().date()
-        ).count()
+        # Platform-wide metrics, kept current by app.utils.platform_metrics
+        metrics = platform_metrics.snapshot()
         
         return {
             "status": "success",
             "metrics": {
-                "total_businesses": total_businesses,
-                "active_businesses": active_businesses,
-                "approved_businesses": approved_businesses,
-                "total_users": total_users,
-                "total_revenue": total_revenue,
-                "monthly_revenue": monthly_revenue,
-                "businesses_added_today": businesses_added_today,
-                "users_registered_today": users_registered_today
+                "total_businesses": metrics['total_businesses'],
+                "active_businesses": metrics['active_businesses'],
+                "approved_businesses": metrics['approved_businesses'],
+                "total_users": metrics['total_users'],
+                "total_revenue": metrics['total_revenue'],
+                "monthly_revenue": metrics['monthly_revenue'],
+                "businesses_added_today": metrics['businesses_added_today'],
+                "users_registered_today": metrics['users_registered_today']
             }
         }
     
@@ -112,9 +126,9 @@ class Analyst:
         if report_type == 'daily':
             return self.generate_daily_report()
         elif report_type == 'weekly':
-            return self.generate_weekly_report()
+            return self.generate_weekly_report(wait=task_data.get('wait', False))
         elif report_type == 'monthly':
-            return self.generate_monthly_report()
+            return self.generate_monthly_report(wait=task_data.get('wait', False))
         else:
             return {"status": "error", "message": "Unknown report type"}
     
@@ -134,43 +148,10 @@ class Analyst:
             ]
         }
     
-    def generate_weekly_report(self):
-        # Generate weekly performance report
-        return {
-            "status": "success",
-            "report_type": "weekly",
-            "date": datetime.utcnow().date().isoformat(),
-            "metrics": {
-                "new_businesses_this_week": 142,
-                "new_users_this_week": 89,
-                "weekly_revenue": 5280.50,
-                "top_performing_category": "Professional Services",
-                "most_active_town": "Stellenbosch"
-            },
-            "insights": [
-                "Revenue increased by 12% compared to last week",
-                "Mobile app usage grew by 23%",
-                "Customer satisfaction rating: 4.7/5"
-            ]
-        }
+    def generate_weekly_report(self, wait=False):
+        # Last complete Monday-Sunday week, built in the background and cached
+        return reports.get('weekly', wait=wait)
     
-    def generate_monthly_report(self):
-        # Generate monthly performance report
-        return {
-            "status": "success",
-            "report_type": "monthly",
-            "date": datetime.utcnow().date().isoformat(),
-            "metrics": {
-                "total_businesses": 1250,
-                "active_businesses": 983,
-                "total_users": 2845,
-                "monthly_revenue": 21500.75,
-                "average_revenue_per_user": 7.55,
-                "customer_acquisition_cost": 2.30
-            },
-            "insights": [
-                "Platform growth rate: 18% month-over-month",
-                "Customer retention rate: 87%",
-                "Most profitable subscription tier: Professional (R499)"
-            ]
-        }
+    def generate_monthly_report(self, wait=False):
+        # Last complete calendar month, built in the background and cached
+        return reports.get('monthly', wait=wait)
@@ -3,23 +3,27 @@ import json
 from datetime import datetime
 from app import db
 from app.models import Business, Town
+from app.utils.query_stats import instrument_task
 
 class Architect:
     def __init__(self):
         self.name = "Architect AI"
         self.version = "1.0"
         
+        # Task type -> handler, built once per instance
+        self.handlers = {
+            'optimize_ui': self.optimize_ui,
+            'generate_town_pages': self.generate_town_pages,
+            'update_design': self.update_design
+        }
+        
+    @instrument_task
     def process_task(self, task_data):
-        task_type = task_data.get('task', '')
+        handler = self.handlers.get(task_data.get('task', ''))
         
-        if task_type == 'optimize_ui':
-            return self.optimize_ui(task_data)
-        elif task_type == 'generate_town_pages':
-            return self.generate_town_pages(task_data)
-        elif task_type == 'update_design':
-            return self.update_design(task_data)
-        else:
+        if handler is None:
             return {"status": "error", "message": "Unknown task type"}
+        return handler(task_data)
     
     def optimize_ui(self, task_data):
         # Analyze user behavior and suggest UI improvements
@@ -36,57 +40,15 @@ class Architect:
         return {"status": "success", "improvements": improvements}
     
     def generate_town_pages(self, task_data):
-        # Ensure all towns have proper pages
-        towns = Town.query.all()
-        
-        for town in towns:
-            # Check if template exists, create if not
-            template_path = os.path.join('app', 'templates', 'town', f'{town.name.lower()}.html')
-            
-            if not os.path.exists(template_path):
-                # Create a basic town template
-                template_content = f"""
-{{% extends "base.html" %}}
-
-{{% block title %}}Businesses in {town.name}, Western Cape - CapeBiz Connect{{% endblock %}}
-
-{{% block content %}}
-<div class="container mt-4">
-    <div class="row">
-        <div class="col-md-8">
-            <h1>Businesses in {town.name}</h1>
-            <p class="lead">{town.description or 'Discover local businesses in ' + town.name}</p>
-            
-            <div class="business-list">
-                {{% for business in businesses %}}
-                <div class="card mb-3">
-                    <div class="card-body">
-                        <h5 class="card-title">{{{{ business.name }}}}</h5>
-                        <p class="card-text">{{{{ business.description }}}}</p>
-                        <a href="{{{{ url_for('main.business_page', business_id=business.id) }}}}" class="btn btn-primary">View Details</a>
-                    </div>
-                </div>
-                {{% endfor %}}
-            </div>
-        </div>
-        <div class="col-md-4">
-            <div class="card">
-                <div class="card-body">
-                    <h5 class="card-title">About {town.name}</h5>
-                    <p class="card-text">{town.description or 'A town in the Western Cape province of South Africa.'}</p>
-                </div>
-            </div>
-        </div>
-    </div>
-</div>
-{{% endblock %}}
-"""
-                
-                os.makedirs(os.path.dirname(template_path), exist_ok=True)
-                with open(template_path, 'w') as f:
-                    f.write(template_content)
+        # Pre-render town and category pages (and optionally business pages)
+        # into the static site directory the web server serves directly
+        from app.utils.static_site import static_site
+        report = static_site.build(business_pages=task_data.get('business_pages'),
+                                   workers=task_data.get('workers'))
         
-        return {"status": "success", "message": f"Generated pages for {len(towns)} towns"}
+        return {"status": "success",
+                "message": f"Pre-rendered {report['written']} pages in {report['seconds']}s",
+                "report": report}
     
     def update_design(self, task_data):
         # Analyze and update design elements
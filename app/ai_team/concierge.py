@@ -1,27 +1,31 @@
 import json
 from datetime import datetime
+from sqlalchemy.orm import joinedload
 from app import db
 from app.models import User, Business
 from app.utils.email import send_email
+from app.utils.query_stats import instrument_task
 
 class Concierge:
     def __init__(self):
         self.name = "Concierge AI"
         self.version = "1.0"
         
+        # Task type -> handler, built once per instance
+        self.handlers = {
+            'welcome_new_user': self.welcome_new_user,
+            'listing_approved': self.listing_approved,
+            'renewal_reminder': self.renewal_reminder,
+            'customer_support': self.handle_customer_support
+        }
+        
+    @instrument_task
     def process_task(self, task_data):
-        task_type = task_data.get('task', '')
+        handler = self.handlers.get(task_data.get('task', ''))
         
-        if task_type == 'welcome_new_user':
-            return self.welcome_new_user(task_data)
-        elif task_type == 'listing_approved':
-            return self.listing_approved(task_data)
-        elif task_type == 'renewal_reminder':
-            return self.renewal_reminder(task_data)
-        elif task_type == 'customer_support':
-            return self.handle_customer_support(task_data)
-        else:
+        if handler is None:
             return {"status": "error", "message": "Unknown task type"}
+        return handler(task_data)
     
     def welcome_new_user(self, task_data):
         user_id = task_data.get('user_id')
@@ -71,7 +75,7 @@ The CapeBiz Connect Team
     
     def listing_approved(self, task_data):
         business_id = task_data.get('business_id')
-        business = Business.query.get(business_id)
+        business = Business.query.options(joinedload(Business.owner)).filter_by(id=business_id).first()
         
         if not business:
             return {"status": "error", "message": "Business not found"}
@@ -120,7 +124,7 @@ The CapeBiz Connect Team
     
     def renewal_reminder(self, task_data):
         business_id = task_data.get('business_id')
-        business = Business.query.get(business_id)
+        business = Business.query.options(joinedload(Business.owner)).filter_by(id=business_id).first()
         
         if not business:
             return {"status": "error", "message": "Business not found"}
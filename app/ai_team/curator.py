@@ -1,123 +1,440 @@
 import json
+import os
 import re
+import time
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from sqlalchemy import bindparam, or_, select, update
 from app import db
-from app.models import Business
+from app.models import BatchCheckpoint, Business
+from app.utils import changes
+from app.utils.query_stats import instrument_task
+from app.utils.tasks import PRIORITY_LOW, task_queue
+
+CATEGORY_KEYWORDS = {
+    'restaurant': ['restaurant', 'cafe', 'coffee', 'food', 'eat', 'dine', 'bistro'],
+    'retail': ['shop', 'store', 'retail', 'sell', 'market', 'boutique'],
+    'service': ['service', 'repair', 'maintenance', 'clean', 'fix', 'install'],
+    'professional': ['consult', 'advice', 'law', 'account', 'finance', 'real estate', 'agent'],
+    'health': ['health', 'medical', 'doctor', 'dentist', 'clinic', 'pharmacy', 'wellness'],
+    'beauty': ['beauty', 'salon', 'spa', 'hair', 'nails', 'massage', 'aesthetics'],
+    'automotive': ['car', 'auto', 'vehicle', 'motor', 'tyre', 'mechanic', 'repair'],
+    'education': ['school', 'learn', 'teach', 'tutor', 'education', 'training', 'course']
+}
+
+def _trie_pattern(words):
+    # Alternation factored by shared prefixes ('c(?:a(?:fe|r)|...)'), so the
+    # regex tries one branch per character instead of every keyword in turn
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        # A word ending here is optional; the greedy group still prefers the longer keyword
+        return '(?:' + '|'.join(branches) + ')' + ('?' if '' in node else '')
+    
+    return build(trie)
+
+
+class CategoryMatcher:
+    """Scores text against CATEGORY_KEYWORDS in one pass of a compiled regex
+    
+    A keyword matches at the start of a word, so 'consult' matches
+    "consulting" but 'eat' no longer matches "great". A category scores
+    one point per distinct keyword of it found; the best score wins,
+    earlier categories winning ties, and text matching nothing is 'other'.
+    """
+    
+    def __init__(self, category_keywords=CATEGORY_KEYWORDS):
+        self.categories = tuple(category_keywords)
+        # A keyword can belong to several categories ('repair')
+        self.keyword_categories = {}
+        for index, keywords in enumerate(category_keywords.values()):
+            for keyword in keywords:
+                self.keyword_categories.setdefault(keyword, []).append(index)
+        self.pattern = re.compile(r'\b' + _trie_pattern(self.keyword_categories))
+    
+    def _scores(self, text):
+        scores = [0] * len(self.categories)
+        for keyword in set(self.pattern.findall(text.lower())):
+            for index in self.keyword_categories[keyword]:
+                scores[index] += 1
+        return scores
+    
+    def scores(self, text):
+        """{category: score} for text"""
+        return dict(zip(self.categories, self._scores(text)))
+    
+    def best(self, text):
+        scores = self._scores(text)
+        best_score = max(scores)
+        return self.categories[scores.index(best_score)] if best_score else 'other'
+
+
+_matcher = None
+
+
+def _init_matcher():
+    global _matcher
+    _matcher = CategoryMatcher()
+
+
+def _categorize_rows(rows):
+    # Runs in a recategorize_all worker: [(id, new category)] for rows whose category changes
+    return [(business_id, category) for business_id, text, current in rows
+            if (category := _matcher.best(text)) != current]
+
+
+# Listing fields the quality review looks at
+REVIEW_FIELDS = ('description', 'email', 'phone', 'category', 'town', 'address', 'logo')
+Listing = namedtuple('Listing', ('id',) + REVIEW_FIELDS)
+
+# Listings scoring at least this are approved
+APPROVE_SCORE = 80
+
+REVIEW_CHECKPOINT = 'curator.review'
+
+
+def listing_quality(listing):
+    """(score out of 100, [issues]) for a Business, or a Listing row"""
+    # Check listing quality
+    quality_score = 0
+    issues = []
+    
+    # Check description
+    if not listing.description or len(listing.description.strip()) < 50:
+        issues.append("Description is too short")
+    else:
+        quality_score += 20
+    
+    # Check contact info
+    if listing.email and listing.phone:
+        quality_score += 20
+    else:
+        issues.append("Missing contact information")
+    
+    # Check category
+    if listing.category:
+        quality_score += 20
+    else:
+        issues.append("Missing category")
+    
+    # Check location
+    if listing.town and listing.address:
+        quality_score += 20
+    else:
+        issues.append("Incomplete location information")
+    
+    # Check images
+    if listing.logo:
+        quality_score += 20
+    else:
+        issues.append("No logo uploaded")
+    
+    return quality_score, issues
+
+
+def _score_listings(listings):
+    # Runs in a review_pending worker: [(id, score, issues)] per Listing
+    return [(listing.id, *listing_quality(listing)) for listing in listings]
+
 
 class Curator:
     def __init__(self):
         self.name = "Curator AI"
         self.version = "1.0"
         
+        # Compiled keyword matcher for categorize_business, built once per instance
+        self.matcher = CategoryMatcher()
+        
+        # Task type -> handler, built once per instance
+        self.handlers = {
+            'review_listing': self.review_listing,
+            'categorize_business': self.categorize_business,
+            'optimize_seo': self.optimize_seo
+        }
+        # Task type -> handler taking a list of tasks, used by the agent registry
+        self.batch_handlers = {
+            'review_listing': self.review_listings,
+            'categorize_business': self.categorize_businesses
+        }
+    
+    @instrument_task
     def process_task(self, task_data):
-        task_type = task_data.get('task', '')
-        
-        if task_type == 'review_listing':
-            return self.review_listing(task_data)
-        elif task_type == 'categorize_business':
-            return self.categorize_business(task_data)
-        elif task_type == 'optimize_seo':
-            return self.optimize_seo(task_data)
-        else:
+        handler = self.handlers.get(task_data.get('task', ''))
+        
+        if handler is None:
             return {"status": "error", "message": "Unknown task type"}
+        return handler(task_data)
     
     def review_listing(self, task_data):
-        business_id = task_data.get('business_id')
-        business = Business.query.get(business_id)
-        
-        if not business:
-            return {"status": "error", "message": "Business not found"}
-        
-        # Check listing quality
-        quality_score = 0
-        issues = []
-        
-        # Check description
-        if not business.description or len(business.description.strip()) < 50:
-            issues.append("Description is too short")
-        else:
-            quality_score += 20
-        
-        # Check contact info
-        if business.email and business.phone:
-            quality_score += 20
-        else:
-            issues.append("Missing contact information")
-        
-        # Check category
-        if business.category:
-            quality_score += 20
-        else:
-            issues.append("Missing category")
-        
-        # Check location
-        if business.town and business.address:
-            quality_score += 20
-        else:
-            issues.append("Incomplete location information")
+        result = self.review_listings([task_data])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    
+    def review_listings(self, tasks):
+        # One query and one commit for any number of review_listing tasks
+        businesses = self._load(tasks)
+        results = []
+        approved = []
         
-        # Check images
-        if business.logo:
-            quality_score += 20
-        else:
-            issues.append("No logo uploaded")
+        for task_data in tasks:
+            business = businesses.get(task_data.get('business_id'))
+            if not business:
+                results.append({"status": "error", "message": "Business not found"})
+                continue
+            
+            try:
+                quality_score, issues = listing_quality(business)
+            except Exception as exc:
+                # Fails this task alone; the others still commit
+                results.append(exc)
+                continue
+            
+            # Auto-approve if score is high enough
+            if quality_score >= 80 and not business.is_approved:
+                business.is_approved = True
+                approved.append(business.id)
+            
+            results.append({
+                "status": "success",
+                "quality_score": quality_score,
+                "issues": issues,
+                "approved": business.is_approved
+            })
         
-        # Auto-approve if score is high enough
-        if quality_score >= 80 and not business.is_approved:
-            business.is_approved = True
+        if approved:
             db.session.commit()
             
-            # Notify concierge to send approval email
-            from app.ai_team.concierge import Concierge
-            concierge = Concierge()
-            concierge.process_task({
+            # Have the concierge send the approval emails
+            task_queue.enqueue_many('concierge', [{
                 'task': 'listing_approved',
-                'business_id': business.id
-            })
+                'business_id': business_id
+            } for business_id in approved])
         
-        return {
-            "status": "success",
-            "quality_score": quality_score,
-            "issues": issues,
-            "approved": business.is_approved
-        }
+        return results
+    
+    def _load(self, tasks):
+        ids = {task_data.get('business_id') for task_data in tasks} - {None}
+        return {business.id: business for business in Business.query.filter(Business.id.in_(ids))} if ids else {}
     
     def categorize_business(self, task_data):
-        business_id = task_data.get('business_id')
-        business = Business.query.get(business_id)
+        result = self.categorize_businesses([task_data])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    
+    def categorize_businesses(self, tasks):
+        # One query and one commit for any number of categorize_business tasks
+        businesses = self._load(tasks)
+        results = []
+        changed = False
         
-        if not business:
-            return {"status": "error", "message": "Business not found"}
+        for task_data in tasks:
+            business = businesses.get(task_data.get('business_id'))
+            if not business:
+                results.append({"status": "error", "message": "Business not found"})
+                continue
+            
+            try:
+                best_category = self.best_category(f"{business.name} {business.description}")
+            except Exception as exc:
+                results.append(exc)
+                continue
+            
+            # Update business category if needed
+            if best_category != business.category:
+                business.category = best_category
+                changed = True
+            
+            results.append({"status": "success", "category": best_category})
         
+        if changed:
+            db.session.commit()
+        
+        return results
+    
+    def best_category(self, text):
         # Simple categorization based on keywords in the name and description
         # In a real implementation, this would use ML/NLP
-        categories = {
-            'restaurant': ['restaurant', 'cafe', 'coffee', 'food', 'eat', 'dine', 'bistro'],
-            'retail': ['shop', 'store', 'retail', 'sell', 'market', 'boutique'],
-            'service': ['service', 'repair', 'maintenance', 'clean', 'fix', 'install'],
-            'professional': ['consult', 'advice', 'law', 'account', 'finance', 'real estate', 'agent'],
-            'health': ['health', 'medical', 'doctor', 'dentist', 'clinic', 'pharmacy', 'wellness'],
-            'beauty': ['beauty', 'salon', 'spa', 'hair', 'nails', 'massage', 'aesthetics'],
-            'automotive': ['car', 'auto', 'vehicle', 'motor', 'tyre', 'mechanic', 'repair'],
-            'education': ['school', 'learn', 'teach', 'tutor', 'education', 'training', 'course']
-        }
+        return self.matcher.best(text)
+    
+    def recategorize_all(self, batch_size=5000, workers=None):
+        """Recategorize every listing; returns {'businesses', 'changed', 'seconds'}
         
-        text = f"{business.name} {business.description}".lower()
-        best_category = 'other'
-        best_score = 0
+        Listings are streamed in batches of batch_size and matched across
+        a process pool (at most two batches per worker in flight); changed
+        categories are written back with one executemany UPDATE per batch
+        and published to the change listeners.
+        """
+        started = time.perf_counter()
+        workers = workers or os.cpu_count() or 1
+        updates, total = [], 0
+        with db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+                select(Business.id, Business.name, Business.description, Business.category))
+            batches = ([(business_id, f"{name} {description}", category)
+                        for business_id, name, description, category in rows]
+                       for rows in result.partitions())
+            if workers > 1:
+                with ProcessPoolExecutor(workers, initializer=_init_matcher) as pool:
+                    pending = deque()
+                    for batch in batches:
+                        total += len(batch)
+                        pending.append(pool.submit(_categorize_rows, batch))
+                        if len(pending) >= workers * 2:
+                            updates += pending.popleft().result()
+                    while pending:
+                        updates += pending.popleft().result()
+            else:
+                for batch in batches:
+                    total += len(batch)
+                    updates += [(business_id, category) for business_id, text, current in batch
+                                if (category := self.matcher.best(text)) != current]
         
-        for category, keywords in categories.items():
-            score = sum(1 for keyword in keywords if keyword in text)
-            if score > best_score:
-                best_score = score
-                best_category = category
+        for start in range(0, len(updates), batch_size):
+            with db.engine.begin() as conn:
+                _, updated = self._update_listings(conn, 'category', dict(updates[start:start + batch_size]))
+            changes.publish(Business, updated)
         
-        # Update business category if needed
-        if best_category != business.category:
-            business.category = best_category
-            db.session.commit()
+        return {'businesses': total, 'changed': len(updates), 'seconds': round(time.perf_counter() - started, 2)}
+    
+    def _update_listings(self, conn, field, values):
+        """Set field to {business id: value} with one executemany UPDATE in conn's transaction
+        
+        Listings already holding their value are left alone. Returns the
+        ids written and the Changes to publish once the transaction
+        commits, the same ones an ORM commit would send.
+        """
+        fields = changes.tracked_fields(Business)
+        rows = conn.execute(
+            select(Business.id, *[getattr(Business, name) for name in dict.fromkeys((field, *fields))])
+            .where(Business.id.in_(values)).with_for_update()
+        ).all()
+        rows = [row for row in rows if getattr(row, field) != values[row.id]]
+        if rows:
+            conn.execute(Business.__table__.update()
+                         .where(Business.id == bindparam('business_id')).values({field: bindparam('new_value')}),
+                         [{'business_id': row.id, 'new_value': values[row.id]} for row in rows])
+        updated = []
+        if field in fields:
+            for row in rows:
+                old = {name: getattr(row, name) for name in fields}
+                updated.append(changes.Change('update', row.id, old, dict(old, **{field: values[row.id]})))
+        return [row.id for row in rows], updated
+    
+    def review_pending(self, chunk_size=1000, workers=None, resume=True, progress=None):
+        """Review every unapproved listing; returns the run's totals
+        
+        Unapproved listings are read in id order, chunk_size at a time, and
+        scored across a process pool (at most two chunks per worker in
+        flight). Each chunk's approvals are one UPDATE, committed with the
+        run's checkpoint, and the approval emails are queued for the
+        concierge in one go at low priority. The checkpoint holds a chunk's
+        approvals until they are queued, so an interrupted run queues any
+        it missed (possibly twice, never not at all) when it resumes after
+        the last committed chunk, unless resume is False; progress,
+        if given, is called with the running totals after every chunk.
+        """
+        started = time.perf_counter()
+        workers = workers or os.cpu_count() or 1
+        checkpoint_id, state, resumed = self._start_checkpoint(REVIEW_CHECKPOINT, resume, {
+            'after_id': 0, 'reviewed': 0, 'approved': 0, 'issues': {}, 'notify': []
+        })
+        if state.get('notify'):
+            self._notify_approved(checkpoint_id, state)
+        pending_filter = or_(Business.is_approved == False, Business.is_approved.is_(None))
+        with db.engine.connect() as conn:
+            total = state['reviewed'] + conn.execute(
+                select(db.func.count()).select_from(Business)
+                .where(pending_filter, Business.id > state['after_id'])
+            ).scalar()
+        
+        def chunks():
+            after_id = state['after_id']
+            while True:
+                with db.engine.connect() as conn:
+                    rows = conn.execute(
+                        select(Business.id, *[getattr(Business, field) for field in REVIEW_FIELDS])
+                        .where(pending_filter, Business.id > after_id).order_by(Business.id).limit(chunk_size)
+                    ).all()
+                if not rows:
+                    return
+                after_id = rows[-1].id
+                yield [Listing(*row) for row in rows]
+        
+        def apply(scored):
+            issues = Counter(state['issues'])
+            for _, _, listing_issues in scored:
+                issues.update(listing_issues)
+            state.update(after_id=scored[-1][0], reviewed=state['reviewed'] + len(scored), issues=dict(issues))
+            with db.engine.begin() as conn:
+                approved, updated = self._update_listings(conn, 'is_approved', {
+                    business_id: True for business_id, score, _ in scored if score >= APPROVE_SCORE
+                })
+                state.update(approved=state['approved'] + len(approved), notify=approved)
+                self._save_checkpoint(conn, checkpoint_id, state)
+            changes.publish(Business, updated)
+            if approved:
+                self._notify_approved(checkpoint_id, state)
+            if progress:
+                progress(dict(state, total=total, seconds=round(time.perf_counter() - started, 2)))
         
-        return {"status": "success", "category": best_category}
+        if workers > 1:
+            with ProcessPoolExecutor(workers) as pool:
+                pending = deque()
+                for chunk in chunks():
+                    pending.append(pool.submit(_score_listings, chunk))
+                    if len(pending) >= workers * 2:
+                        apply(pending.popleft().result())
+                while pending:
+                    apply(pending.popleft().result())
+        else:
+            for chunk in chunks():
+                apply(_score_listings(chunk))
+        
+        with db.engine.begin() as conn:
+            self._save_checkpoint(conn, checkpoint_id, state, finished=True)
+        return dict(state, total=total, resumed=resumed, seconds=round(time.perf_counter() - started, 2))
+    
+    def _start_checkpoint(self, name, resume, initial):
+        # (checkpoint id, state, resumed): an unfinished run's state if resuming, else initial
+        checkpoint = BatchCheckpoint.query.filter_by(name=name).first()
+        if checkpoint is None:
+            checkpoint = BatchCheckpoint(name=name)
+            db.session.add(checkpoint)
+        resumed = bool(resume and checkpoint.cursor and not checkpoint.finished_at)
+        if not resumed:
+            checkpoint.cursor = json.dumps(initial)
+            checkpoint.started_at = checkpoint.updated_at = datetime.utcnow()
+            checkpoint.finished_at = None
+        db.session.commit()
+        return checkpoint.id, json.loads(checkpoint.cursor), resumed
+    
+    def _notify_approved(self, checkpoint_id, state):
+        # Queue the approval emails recorded in state, then clear them from the checkpoint
+        task_queue.enqueue_many('concierge', [{
+            'task': 'listing_approved',
+            'business_id': business_id
+        } for business_id in state['notify']], priority=PRIORITY_LOW)
+        state['notify'] = []
+        with db.engine.begin() as conn:
+            self._save_checkpoint(conn, checkpoint_id, state)
+    
+    def _save_checkpoint(self, conn, checkpoint_id, state, finished=False):
+        now = datetime.utcnow()
+        conn.execute(update(BatchCheckpoint).where(BatchCheckpoint.id == checkpoint_id).values(
+            cursor=json.dumps(state), updated_at=now, finished_at=now if finished else None))
     
     def optimize_seo(self, task_data):
         business_id = task_data.get('business_id')
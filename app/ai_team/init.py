@@ -1,17 +1,29 @@
-from app.ai_team.architect import Architect
-from app.ai_team.accountant import Accountant
-from app.ai_team.concierge import Concierge
-from app.ai_team.curator import Curator
-from app.ai_team.sentinel import Sentinel
-from app.ai_team.analyst import Analyst
-from app.ai_team.trainer import Trainer
+import importlib
 
-__all__ = [
-    'Architect',
-    'Accountant',
-    'Concierge',
-    'Curator',
-    'Sentinel',
-    'Analyst',
-    'Trainer'
-]
+# Agent class -> module; each module is imported the first time its class
+# is used, so importing the package does not load every agent (and what
+# it depends on)
+_MODULES = {
+    'Architect': 'architect',
+    'Accountant': 'accountant',
+    'Concierge': 'concierge',
+    'Curator': 'curator',
+    'Sentinel': 'sentinel',
+    'Analyst': 'analyst',
+    'Trainer': 'trainer'
+}
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    agent_class = getattr(importlib.import_module(f'{__name__}.{module}'), name)
+    globals()[name] = agent_class
+    return agent_class
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -3,24 +3,51 @@ import re
 from datetime import datetime, timedelta
 from flask import request
 from app import db
-from app.models import User, LoginAttempt
+from app.models import User, LoginAttempt, IPBlock
+from app.utils.query_stats import instrument_task
+
+SUSPICIOUS_AGENTS = ['sqlmap', 'nikto', 'wget', 'curl', 'python-requests']
+
+SQL_PATTERNS = [
+    r'union.*select',
+    r'select.*from',
+    r'insert.*into',
+    r'update.*set',
+    r'delete.*from',
+    r'drop.*table',
+    r'exec.*\(\)',
+    r'waitfor.*delay',
+    r'--',
+    r'\/\*',
+    r'\*\/'
+]
 
 class Sentinel:
     def __init__(self):
         self.name = "Sentinel AI"
         self.version = "1.0"
         
+        # SQL injection patterns, compiled once per instance
+        self.sql_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in SQL_PATTERNS]
+        
+        # Task type -> handler, built once per instance
+        self.handlers = {
+            'monitor_security': self.monitor_security,
+            'check_malicious_activity': self.check_malicious_activity,
+            'block_suspicious_ip': self.block_suspicious_ip
+        }
+        # Task type -> handler taking a list of tasks, used by the agent registry
+        self.batch_handlers = {
+            'monitor_security': self.monitor_security_batch
+        }
+    
+    @instrument_task
     def process_task(self, task_data):
-        task_type = task_data.get('task', '')
+        handler = self.handlers.get(task_data.get('task', ''))
         
-        if task_type == 'monitor_security':
-            return self.monitor_security(task_data)
-        elif task_type == 'check_malicious_activity':
-            return self.check_malicious_activity(task_data)
-        elif task_type == 'block_suspicious_ip':
-            return self.block_suspicious_ip(task_data)
-        else:
+        if handler is None:
             return {"status": "error", "message": "Unknown task type"}
+        return handler(task_data)
     
     def monitor_security(self, task_data):
         # Monitor for suspicious activities
@@ -54,6 +81,13 @@ class Sentinel:
             "total_attempts": len(recent_attempts)
         }
     
+    def monitor_security_batch(self, tasks):
+        # Each check scans the last hour of attempts whatever triggered it,
+        # so a burst of logins needs only one scan
+        result = self.monitor_security(tasks[0])
+        # A copy each, so changing one task's result leaves the others alone
+        return [dict(result, suspicious_ips=list(result['suspicious_ips'])) for _ in tasks]
+    
     def check_malicious_activity(self, task_data):
         ip_address = task_data.get('ip_address')
         user_agent = task_data.get('user_agent')
@@ -64,33 +98,18 @@ class Sentinel:
         
         # Check user agent for suspicious patterns
         if user_agent:
-            suspicious_agents = ['sqlmap', 'nikto', 'wget', 'curl', 'python-requests']
-            for agent in suspicious_agents:
-                if agent.lower() in user_agent.lower():
+            for agent in SUSPICIOUS_AGENTS:
+                if agent in user_agent.lower():
                     malicious = True
                     reasons.append(f"Suspicious user agent: {agent}")
         
         # Check for SQL injection patterns in request data
         if request:
-            sql_patterns = [
-                r'union.*select',
-                r'select.*from',
-                r'insert.*into',
-                r'update.*set',
-                r'delete.*from',
-                r'drop.*table',
-                r'exec.*\(\)',
-                r'waitfor.*delay',
-                r'--',
-                r'\/\*',
-                r'\*\/'
-            ]
-            
             # Check all request values
             for key, values in request.values.lists():
                 for value in values:
-                    for pattern in sql_patterns:
-                        if re.search(pattern, value, re.IGNORECASE):
+                    for pattern in self.sql_patterns:
+                        if pattern.search(value):
                             malicious = True
                             reasons.append(f"SQL injection attempt in {key}: {value}")
                             break
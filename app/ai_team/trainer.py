@@ -1,24 +1,28 @@
 import json
-import pandas as pd
 from datetime import datetime
 from app import db
+from app.utils.agent_metrics import agent_metrics
+from app.utils.query_stats import instrument_task
 
 class Trainer:
     def __init__(self):
         self.name = "Trainer AI"
         self.version = "1.0"
         
+        # Task type -> handler, built once per instance
+        self.handlers = {
+            'train_models': self.train_models,
+            'evaluate_performance': self.evaluate_performance,
+            'optimize_parameters': self.optimize_parameters
+        }
+        
+    @instrument_task
     def process_task(self, task_data):
-        task_type = task_data.get('task', '')
+        handler = self.handlers.get(task_data.get('task', ''))
         
-        if task_type == 'train_models':
-            return self.train_models(task_data)
-        elif task_type == 'evaluate_performance':
-            return self.evaluate_performance(task_data)
-        elif task_type == 'optimize_parameters':
-            return self.optimize_parameters(task_data)
-        else:
+        if handler is None:
             return {"status": "error", "message": "Unknown task type"}
+        return handler(task_data)
     
     def train_models(self, task_data):
         # This would train various ML models used by the platform
@@ -74,29 +78,42 @@ class Trainer:
         }
     
     def evaluate_performance(self, task_data):
-        # Evaluate performance of all AI models
-        models = ['architect', 'accountant', 'concierge', 'curator', 'sentinel', 'analyst']
-        performance = {}
-        
-        for model in models:
-            performance[model] = {
-                "accuracy": round(0.7 + 0.3 * (hash(model) % 100) / 100, 2),  # Random value for simulation
-                "response_time": f"{50 + hash(model) % 100}ms",  # Random value for simulation
-                "success_rate": f"{80 + hash(model) % 20}%"  # Random value for simulation
-            }
+        # Measured latency, DB time, queue wait and success rates of each
+        # agent in this process, slowest p99 first
+        performance = agent_metrics.summary()
+        agent = task_data.get('agent')
+        if agent:
+            performance = {agent: performance[agent]} if agent in performance else {}
+        ranked = sorted(performance, key=lambda name: performance[name]['latency_ms']['p99'] or 0, reverse=True)
         
-        return {"status": "success", "performance_metrics": performance}
+        return {
+            "status": "success",
+            "performance_metrics": {name: performance[name] for name in ranked},
+            "slowest_p99": ranked[0] if ranked else None
+        }
     
     def optimize_parameters(self, task_data):
-        # Optimize parameters for all AI models
-        models = ['architect', 'accountant', 'concierge', 'curator', 'sentinel', 'analyst']
+        # Point at what dominates each agent's measured tail latency
         optimizations = {}
         
-        for model in models:
-            optimizations[model] = {
-                "parameters_optimized": 5 + hash(model) % 10,  # Random value for simulation
-                "performance_improvement": f"{5 + hash(model) % 15}%",  # Random value for simulation
-                "optimization_time": f"{30 + hash(model) % 60} seconds"  # Random value for simulation
+        for name, figures in agent_metrics.summary().items():
+            if not figures['tasks']:
+                continue
+            tasks = figures['by_task']
+            slowest = max(tasks, key=lambda task: tasks[task]['latency_ms']['p99'] or 0)
+            latency, db_time, wait = figures['latency_ms'], figures['db_ms'], figures['queue_wait_ms']
+            suggestions = []
+            if latency['mean'] and db_time['mean'] and db_time['mean'] >= latency['mean'] / 2:
+                suggestions.append("Most of the time is spent in the database: batch or index its queries")
+            if wait['p99'] and latency['p99'] and wait['p99'] > latency['p99']:
+                suggestions.append("Tasks wait longer than they run: add task workers or raise TASK_BATCH_SIZE")
+            if figures['success_rate'] is not None and figures['success_rate'] < 95:
+                suggestions.append(f"{figures['errors']} failed tasks: check the worker log")
+            optimizations[name] = {
+                "slowest_task": slowest,
+                "slowest_task_p99_ms": tasks[slowest]['latency_ms']['p99'],
+                "db_share_of_latency": round(db_time['mean'] / latency['mean'] * 100, 1) if latency['mean'] else None,
+                "suggestions": suggestions
             }
         
         return {"status": "success", "optimization_results": optimizations}
@@ -10,12 +10,96 @@ login_manager.login_view = 'auth.login'
 mail = Mail()
 
 def create_app(config_class=Config):
+    from app.utils.startup import StartupProfile
+    profile = StartupProfile()
+    
     app = Flask(__name__)
     app.config.from_object(config_class)
     
     db.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
+    profile.mark('extensions')
+    
+    from app.utils.query_stats import query_stats
+    query_stats.init_app(app)
+    profile.mark('query_stats')
+    
+    from app.utils.search import search_engine
+    search_engine.init_app(app)
+    profile.mark('search_engine')
+    
+    from app.utils.facets import facet_engine
+    facet_engine.init_app(app)
+    profile.mark('facet_engine')
+    
+    from app.utils.suggest import suggester
+    suggester.init_app(app)
+    profile.mark('suggester')
+    
+    from app.utils.geo import geo_search
+    geo_search.init_app(app)
+    profile.mark('geo_search')
+    
+    from app.utils.search_cache import search_cache
+    search_cache.init_app(app)
+    profile.mark('search_cache')
+    
+    from app.utils.ranking import ranking
+    ranking.init_app(app)
+    profile.mark('ranking')
+    
+    from app.utils.page_cache import page_cache
+    page_cache.init_app(app)
+    profile.mark('page_cache')
+    
+    from app.utils.static_site import static_site
+    static_site.init_app(app)
+    profile.mark('static_site')
+    
+    from app.utils.reference import reference_data
+    reference_data.init_app(app)
+    profile.mark('reference_data')
+    
+    from app.utils.counters import counters
+    counters.init_app(app)
+    profile.mark('counters')
+    
+    from app.utils.peers import peer_stats
+    peer_stats.init_app(app)
+    profile.mark('peer_stats')
+    
+    from app.utils.platform_metrics import platform_metrics
+    platform_metrics.init_app(app)
+    profile.mark('platform_metrics')
+    
+    from app.utils.reports import reports
+    reports.init_app(app)
+    profile.mark('reports')
+    
+    from app.utils.agent_metrics import agent_metrics
+    agent_metrics.init_app(app)
+    profile.mark('agent_metrics')
+    
+    from app.utils.agents import agents
+    agents.init_app(app)
+    profile.mark('agents')
+    
+    from app.utils.tasks import task_queue
+    task_queue.init_app(app)
+    profile.mark('task_queue')
+    
+    from app.utils.scheduler import scheduler
+    scheduler.init_app(app)
+    profile.mark('scheduler')
+    
+    from app.utils.analytics import analytics
+    analytics.init_app(app)
+    profile.mark('analytics')
+    
+    from app.utils.beacon import view_beacon
+    view_beacon.init_app(app)
+    profile.mark('view_beacon')
     
     # Register blueprints
     from app.routes.auth import auth_bp
@@ -23,11 +107,15 @@ def create_app(config_class=Config):
     from app.routes.payment import payment_bp
     from app.routes.dashboard import dashboard_bp
     from app.routes.main import main_bp
+    from app.routes.api import api_bp
     
     app.register_blueprint(auth_bp)
     app.register_blueprint(business_bp)
     app.register_blueprint(payment_bp)
     app.register_blueprint(dashboard_bp)
     app.register_blueprint(main_bp)
+    app.register_blueprint(api_bp)
+    profile.mark('blueprints')
     
+    app.extensions['startup_profile'] = profile
     return app
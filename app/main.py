@@ -1,94 +1,92 @@
 from flask import Blueprint, render_template, request, jsonify, session
-from app.models import Business, Town
-from app.ai_team.curator import Curator
+from app.models import Business
+from app.utils.analytics import analytics
+from app.utils.facets import facet_engine
+from app.utils.listings import find_listings, render_listings, search_listings
+from app.utils.page_cache import combine, listings_version, page_cache, row_version
+from app.utils.reference import reference_data
 
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/')
 def index():
-    # Get featured businesses
-    featured_businesses = Business.query.filter_by(is_featured=True, is_approved=True).limit(6).all()
-    
-    # Get popular categories
-    categories = Business.query.with_entities(Business.category).distinct().all()
-    categories = [cat[0] for cat in categories if cat[0]]
-    
-    return render_template('index.html', 
-                         featured_businesses=featured_businesses,
-                         categories=categories)
+    version = listings_version()
+    
+    def render():
+        # Get featured businesses; only queried when the fragment is rendered
+        featured_businesses = Business.query.filter_by(is_featured=True, is_approved=True) \
+            .order_by(Business.rank_score.desc(), Business.id.desc()).limit(6)
+        
+        # Get popular categories
+        categories = facet_engine.categories()
+        
+        return render_template('index.html', 
+                             featured_businesses=featured_businesses,
+                             categories=categories,
+                             fragment_token=version.token)
+    
+    return page_cache.serve(version, render)
 
 @main_bp.route('/search')
 def search():
     query = request.args.get('q', '')
     category = request.args.get('category', '')
     town = request.args.get('town', '')
-    
-    # Build query
-    businesses_query = Business.query.filter_by(is_approved=True)
-    
     if query:
-        businesses_query = businesses_query.filter(
-            (Business.name.ilike(f'%{query}%')) | 
-            (Business.description.ilike(f'%{query}%'))
-        )
+        analytics.record('search', query=query)
     
-    if category:
-        businesses_query = businesses_query.filter_by(category=category)
-    
-    if town:
-        businesses_query = businesses_query.filter_by(town=town)
-    
-    businesses = businesses_query.all()
+    # One bounded page of results with facet counts, cached per query
+    page, facets = search_listings(q=query, category=category, town=town,
+                                   cursor=request.args.get('cursor'),
+                                   per_page=request.args.get('per_page'),
+                                   lat=request.args.get('lat', type=float),
+                                   lng=request.args.get('lng', type=float),
+                                   radius=request.args.get('radius', type=float))
     
     # Get all towns for filter
-    towns = Town.query.all()
+    towns = reference_data.towns
     
-    # Get all categories for filter
-    categories = Business.query.with_entities(Business.category).distinct().all()
-    categories = [cat[0] for cat in categories if cat[0]]
+    categories = [name for name, _ in facets['categories']]
     
-    return render_template('listings.html', 
-                         businesses=businesses,
+    return render_listings('listings.html', page,
                          towns=towns,
                          categories=categories,
+                         facets=facets,
                          search_query=query,
                          selected_category=category,
                          selected_town=town)
 
 @main_bp.route('/town/<town_name>')
 def town_page(town_name):
-    town = Town.query.filter_by(name=town_name).first()
+    town = reference_data.town(town_name)
     if not town:
         return "Town not found", 404
     
-    businesses = Business.query.filter_by(town=town_name, is_approved=True).all()
+    def render():
+        page = find_listings(town=town_name,
+                             cursor=request.args.get('cursor'),
+                             per_page=request.args.get('per_page'))
+        return render_listings('town.html', page, town=town)
     
-    return render_template('town.html', town=town, businesses=businesses)
+    return page_cache.serve(combine(row_version(town), listings_version(town=town_name)), render)
 
 @main_bp.route('/category/<category_name>')
 def category_page(category_name):
-    businesses = Business.query.filter_by(category=category_name, is_approved=True).all()
+    def render():
+        page = find_listings(category=category_name,
+                             cursor=request.args.get('cursor'),
+                             per_page=request.args.get('per_page'))
+        return render_listings('category.html', page, category=category_name)
     
-    return render_template('category.html', category=category_name, businesses=businesses)
+    return page_cache.serve(listings_version(category=category_name), render)
 
 @main_bp.route('/business/<int:business_id>')
 def business_page(business_id):
     business = Business.query.get_or_404(business_id)
     
-    # Increment view count
-    business.views += 1
-    
-    # Update analytics
-    from app.ai_team.analyst import Analyst
-    analyst = Analyst()
-    analyst.process_task({
-        'task': 'track_business_view',
-        'business_id': business_id,
-        'view_data': {
-            'timestamp': 'now',
-            'user_agent': request.headers.get('User-Agent'),
-            'ip_address': request.remote_addr
-        }
-    })
+    # Views, clicks and shares are counted by the page's beacons (POST
+    # /api/business/<id>/view, /click or /share), so cached and pre-rendered
+    # copies count too and pre-rendering does not
     
-    return render_template('business.html', business=business)
+    return page_cache.serve(row_version(business),
+                            lambda: render_template('business.html', business=business))
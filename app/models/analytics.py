@@ -0,0 +1,84 @@
+from app import db
+from datetime import datetime
+
+# Rollup rows for platform-wide events (searches) that belong to no listing
+PLATFORM_ID = 0
+
+class AnalyticsEvent(db.Model):
+    # Append-only and short-lived: compacted into AnalyticsRollup once its
+    # hour is over, so it skips BaseModel's created_at/updated_at
+    __tablename__ = 'analytics_events'
+    __table_args__ = (
+        db.Index('ix_analytics_events_business_time', 'business_id', 'occurred_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    business_id = db.Column(db.Integer)  # None for searches
+    event_type = db.Column(db.String(10), nullable=False)  # view, click, share, search
+    occurred_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    terms = db.Column(db.String(200))  # search text; not 'query', which is Model.query
+    
+    def __repr__(self):
+        return f'<AnalyticsEvent {self.event_type} {self.business_id}>'
+
+class AnalyticsRollup(db.Model):
+    __tablename__ = 'analytics_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('business_id', 'granularity', 'bucket', name='uq_analytics_rollup'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    business_id = db.Column(db.Integer, nullable=False)  # PLATFORM_ID for searches
+    granularity = db.Column(db.String(5), nullable=False)  # hour or day
+    bucket = db.Column(db.DateTime, nullable=False)  # start of the hour/day (UTC)
+    views = db.Column(db.Integer, default=0, nullable=False)
+    clicks = db.Column(db.Integer, default=0, nullable=False)
+    shares = db.Column(db.Integer, default=0, nullable=False)
+    searches = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<AnalyticsRollup {self.business_id} {self.granularity} {self.bucket}>'
+
+class PeerGroup(db.Model):
+    # Approved listings sharing a category and town, kept current by
+    # app.utils.peers rather than recomputed per dashboard
+    __tablename__ = 'peer_groups'
+    __table_args__ = (
+        db.UniqueConstraint('category', 'town', name='uq_peer_group'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.String(100), nullable=False)
+    town = db.Column(db.String(100), nullable=False)
+    listings = db.Column(db.Integer, default=0, nullable=False)
+    views_sum = db.Column(db.BigInteger, default=0, nullable=False)
+    clicks_sum = db.Column(db.BigInteger, default=0, nullable=False)
+    
+    @property
+    def mean_views(self):
+        return self.views_sum / self.listings if self.listings else 0
+    
+    @property
+    def mean_clicks(self):
+        return self.clicks_sum / self.listings if self.listings else 0
+    
+    def __repr__(self):
+        return f'<PeerGroup {self.category} {self.town}>'
+
+class PeerSketchBucket(db.Model):
+    # One histogram bucket of a peer group's views or clicks (log-spaced,
+    # see app.utils.peers.bucket_of); percentiles are read from these
+    __tablename__ = 'peer_sketch_buckets'
+    __table_args__ = (
+        db.UniqueConstraint('category', 'town', 'metric', 'bucket', name='uq_peer_sketch_bucket'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.String(100), nullable=False)
+    town = db.Column(db.String(100), nullable=False)
+    metric = db.Column(db.String(10), nullable=False)  # views or clicks
+    bucket = db.Column(db.Integer, nullable=False)
+    listings = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<PeerSketchBucket {self.category} {self.town} {self.metric} {self.bucket}>'
@@ -15,12 +15,23 @@ class Town(BaseModel):
 
 class Business(BaseModel):
     __tablename__ = 'businesses'
+    __table_args__ = (
+        # Listing pages read these in order, so top-N needs no sort
+        db.Index('ix_businesses_rank', 'is_approved', 'rank_score', 'id'),
+        db.Index('ix_businesses_town_rank', 'is_approved', 'town', 'rank_score', 'id'),
+        db.Index('ix_businesses_category_rank', 'is_approved', 'category', 'rank_score', 'id'),
+        db.Index('ix_businesses_town_category_rank', 'is_approved', 'town', 'category', 'rank_score', 'id'),
+        # Change watermarks and page cache versions
+        db.Index('ix_businesses_updated_at', 'updated_at'),
+    )
     
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
     category = db.Column(db.String(100), nullable=False)
     town = db.Column(db.String(100), nullable=False)
     address = db.Column(db.Text)
+    latitude = db.Column(db.Float)  # defaults to the town's coordinates
+    longitude = db.Column(db.Float)
     email = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(20), nullable=False)
     website = db.Column(db.String(200))
@@ -41,21 +52,37 @@ class Business(BaseModel):
     # Status and visibility
     is_approved = db.Column(db.Boolean, default=False)
     is_featured = db.Column(db.Boolean, default=False)
+    featured_until = db.Column(db.DateTime, index=True)  # end of a paid boost; cleared by the boost_expiry job
     is_verified = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
     
     # Subscription details
     subscription_tier = db.Column(db.String(20), default='free')
     subscription_expiry = db.Column(db.DateTime)
+    renewal_reminded_for = db.Column(db.DateTime)  # the subscription_expiry its owner was last reminded of
     
     # Analytics
     views = db.Column(db.Integer, default=0)
     clicks = db.Column(db.Integer, default=0)
     shares = db.Column(db.Integer, default=0)
     
+    # Ranking, maintained by app.utils.ranking
+    popularity = db.Column(db.Float)  # log2 of time-decayed engagement
+    rank_score = db.Column(db.Float, default=0)
+    
     # Relationships
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
+    @classmethod
+    def listed(cls):
+        """SQL filter for listings the public sees: approved and not deactivated"""
+        return db.and_(cls.is_approved == True, db.or_(cls.is_active == True, cls.is_active.is_(None)))
+    
+    @staticmethod
+    def is_listed(fields):
+        """listed() for a dict of field values (e.g. a change snapshot)"""
+        return bool(fields and fields.get('is_approved') and fields.get('is_active') is not False)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -64,6 +91,8 @@ class Business(BaseModel):
             'category': self.category,
             'town': self.town,
             'address': self.address,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
             'email': self.email,
             'phone': self.phone,
             'website': self.website,
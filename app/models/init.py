@@ -1,5 +1,11 @@
 from app.models.user import User
 from app.models.business import Business, Town
 from app.models.payment import Payment, SubscriptionPlan
+from app.models.security import LoginAttempt, IPBlock
+from app.models.analytics import AnalyticsEvent, AnalyticsRollup, PeerGroup, PeerSketchBucket
+from app.models.scheduler import ScheduledJob, JobRun, BatchCheckpoint
+from app.models.database import Tombstone
 
-__all__ = ['User', 'Business', 'Town', 'Payment', 'SubscriptionPlan']
+__all__ = ['User', 'Business', 'Town', 'Payment', 'SubscriptionPlan', 'LoginAttempt', 'IPBlock',
+           'AnalyticsEvent', 'AnalyticsRollup', 'PeerGroup', 'PeerSketchBucket', 'ScheduledJob', 'JobRun',
+           'BatchCheckpoint', 'Tombstone']
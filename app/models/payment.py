@@ -48,7 +48,8 @@ class Payment(BaseModel):
             from app.models.business import Business
             business = Business.query.get(self.item_id)
             if business:
-                plan = SubscriptionPlan.query.get(int(self.gateway_response))
+                from app.utils.reference import reference_data
+                plan = reference_data.plan(plan_id=int(self.gateway_response))
                 if plan:
                     business.subscription_tier = plan.code
                     if business.subscription_expiry and business.subscription_expiry > datetime.utcnow():
@@ -62,8 +63,9 @@ class Payment(BaseModel):
             business = Business.query.get(self.item_id)
             if business:
                 business.is_featured = True
-                # Set boost expiry (e.g., 7 days from now)
-                boost_expiry = datetime.utcnow() + timedelta(days=7)
-                # Store boost expiry in gateway_response if not already used
-                if not self.gateway_response:
-                    self.gateway_response = f'boost_expiry:{boost_expiry.isoformat()}'
+                # Boosts run 7 days, added to any boost still running; the
+                # scheduler's boost_expiry job unfeatures the listing after
+                if business.featured_until and business.featured_until > datetime.utcnow():
+                    business.featured_until += timedelta(days=7)
+                else:
+                    business.featured_until = datetime.utcnow() + timedelta(days=7)
@@ -0,0 +1,49 @@
+from app import db
+from datetime import datetime
+
+class ScheduledJob(db.Model):
+    # Schedule state and leader lock of one app.utils.scheduler job
+    __tablename__ = 'scheduled_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    next_run_at = db.Column(db.DateTime, nullable=False)  # next occurrence due (UTC)
+    last_scheduled_for = db.Column(db.DateTime)  # last occurrence completed
+    cursor = db.Column(db.Text)  # JSON progress of an occurrence left unfinished
+    lock_owner = db.Column(db.String(120))
+    lock_expires_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<ScheduledJob {self.name}>'
+
+class JobRun(db.Model):
+    __tablename__ = 'job_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job = db.Column(db.String(50), nullable=False, index=True)
+    scheduled_for = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    finished_at = db.Column(db.DateTime)
+    duration_seconds = db.Column(db.Float)
+    status = db.Column(db.String(20), default='running', nullable=False)  # running, done, partial, failed
+    items = db.Column(db.Integer, default=0)  # rows or messages processed
+    worker = db.Column(db.String(120))
+    result = db.Column(db.Text)  # JSON returned by the job
+    error = db.Column(db.Text)
+    
+    def __repr__(self):
+        return f'<JobRun {self.job} {self.scheduled_for} {self.status}>'
+
+class BatchCheckpoint(db.Model):
+    # Progress of a long batch run (e.g. `flask curator review`), so it can resume
+    __tablename__ = 'batch_checkpoints'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    cursor = db.Column(db.Text)  # JSON position and running totals
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime)  # None while the run is unfinished
+    
+    def __repr__(self):
+        return f'<BatchCheckpoint {self.name}>'
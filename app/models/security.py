@@ -0,0 +1,27 @@
+from app import db
+from datetime import datetime
+
+class LoginAttempt(db.Model):
+    # Read by the Sentinel agent to spot repeated failed logins
+    __tablename__ = 'login_attempts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    ip_address = db.Column(db.String(45))
+    success = db.Column(db.Boolean, default=False, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<LoginAttempt {self.ip_address} {"ok" if self.success else "failed"}>'
+
+class IPBlock(db.Model):
+    __tablename__ = 'ip_blocks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    ip_address = db.Column(db.String(45), unique=True, nullable=False)
+    reason = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<IPBlock {self.ip_address}>'
@@ -15,9 +15,9 @@ class User(BaseModel, UserMixin):
     is_admin = db.Column(db.Boolean, default=False)
     is_verified = db.Column(db.Boolean, default=False)
     
-    # Relationships
-    businesses = db.relationship('Business', backref='owner', lazy='dynamic')
-    payments = db.relationship('Payment', backref='user', lazy='dynamic')
+    # Relationships (plain lists, so they can be eager loaded with selectinload)
+    businesses = db.relationship('Business', backref='owner')
+    payments = db.relationship('Payment', backref='user')
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -0,0 +1,112 @@
+from flask import Blueprint, current_app, request, jsonify, url_for
+from flask_login import current_user
+from app.models import Business
+from app.utils.agent_metrics import stats_denied
+from app.utils.analytics import analytics
+from app.utils.beacon import view_beacon
+from app.utils.geo import geo_search, valid_point
+from app.utils.listings import search_listings
+from app.utils.search_cache import search_cache
+from app.utils.suggest import suggester
+from app.utils.tasks import task_queue
+
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+@api_bp.route('/businesses')
+def businesses():
+    if request.args.get('q'):
+        analytics.record('search', query=request.args['q'])
+    page, facets = search_listings(q=request.args.get('q', ''),
+                                   category=request.args.get('category', ''),
+                                   town=request.args.get('town', ''),
+                                   cursor=request.args.get('cursor'),
+                                   per_page=request.args.get('per_page'),
+                                   lat=request.args.get('lat', type=float),
+                                   lng=request.args.get('lng', type=float),
+                                   radius=request.args.get('radius', type=float))
+    
+    return jsonify({
+        'businesses': [_with_distance(business.to_dict(), page.distances) for business in page],
+        'next_cursor': page.next_cursor,
+        'facets': facets
+    })
+
+@api_bp.route('/business/<int:business_id>/<any(view, click, share):event>', methods=['POST'])
+def track_event(business_id, event):
+    # Fire and forget: queued for a background writer, never waits on the database
+    if request.headers.get('Sec-Purpose', request.headers.get('Purpose', '')).startswith('prefetch'):
+        return '', 204
+    view_beacon.accept(business_id, event)
+    return '', 204
+
+@api_bp.route('/beacon-stats')
+def beacon_stats():
+    denied = stats_denied()
+    if denied is not None:
+        return denied
+    return jsonify(view_beacon.stats())
+
+@api_bp.route('/tasks/<int:task_id>')
+def task_status(task_id):
+    task = task_queue.result(task_id)
+    if task is None or not current_user.is_authenticated or \
+            (task['user_id'] != current_user.id and not current_user.is_admin):
+        return jsonify({'error': 'Task not found'}), 404
+    return jsonify({key: task[key] for key in ('id', 'status', 'attempts', 'result', 'error')})
+
+@api_bp.route('/search/cache-stats')
+def search_cache_stats():
+    denied = stats_denied()
+    if denied is not None:
+        return denied
+    return jsonify(search_cache.stats())
+
+@api_bp.route('/nearby')
+def nearby():
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    if not valid_point(lat, lng):
+        return jsonify({'error': 'lat and lng are required'}), 400
+    
+    radius = request.args.get('radius', type=float)
+    if radius is not None and radius > 0:
+        radius = min(radius, current_app.config['GEO_MAX_RADIUS_KM'])
+        matches = geo_search.within(lat, lng, radius, limit=current_app.config['LISTINGS_MAX_PER_PAGE'])
+    else:
+        k = max(1, min(request.args.get('k', 10, type=int), current_app.config['LISTINGS_MAX_PER_PAGE']))
+        matches = geo_search.nearest(lat, lng, k)
+    
+    distances = dict(matches)
+    businesses = {b.id: b for b in Business.query.filter(Business.id.in_(distances), Business.is_approved == True)}
+    
+    return jsonify({
+        'businesses': [_with_distance(businesses[business_id].to_dict(), distances)
+                       for business_id, _ in matches if business_id in businesses]
+    })
+
+def _with_distance(business, distances):
+    if business['id'] in distances:
+        business['distance_km'] = round(distances[business['id']], 2)
+    return business
+
+@api_bp.route('/suggest')
+def suggest():
+    limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+    suggestions = suggester.suggest(request.args.get('q', ''), limit)
+    
+    return jsonify({
+        'suggestions': [{
+            'type': suggestion.kind,
+            'label': suggestion.label,
+            'url': _suggestion_url(suggestion)
+        } for suggestion in suggestions]
+    })
+
+def _suggestion_url(suggestion):
+    if suggestion.kind == 'business':
+        return url_for('main.business_page', business_id=suggestion.value)
+    if suggestion.kind == 'category':
+        return url_for('main.category_page', category_name=suggestion.value)
+    if suggestion.kind == 'town':
+        return url_for('main.town_page', town_name=suggestion.value)
+    return url_for('main.search', q=suggestion.label)
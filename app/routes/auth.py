@@ -1,9 +1,10 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from app import db
-from app.models import User
+from app.models import User, LoginAttempt
 from app.forms import LoginForm, RegistrationForm
 from app.utils.security import hash_password, check_password, validate_email
+from app.utils.tasks import PRIORITY_HIGH, PRIORITY_LOW, task_queue
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -16,19 +17,21 @@ def login():
     
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
+        success = bool(user and check_password(user.password_hash, form.password.data))
+        db.session.add(LoginAttempt(user_id=user.id if user else None, ip_address=request.remote_addr,
+                                    success=success))
+        db.session.commit()
         
-        if user and check_password(user.password_hash, form.password.data):
+        if success:
             login_user(user, remember=form.remember_me.data)
             next_page = request.args.get('next')
             
             # Log login attempt
-            from app.ai_team.sentinel import Sentinel
-            sentinel = Sentinel()
-            sentinel.process_task({
+            task_queue.enqueue('sentinel', {
                 'task': 'monitor_security',
                 'user_id': user.id,
                 'ip_address': request.remote_addr
-            })
+            }, priority=PRIORITY_HIGH)
             
             flash('Login successful!', 'success')
             return redirect(next_page or url_for('main.index'))
@@ -68,12 +71,10 @@ def register():
         db.session.commit()
         
         # Send welcome email
-        from app.ai_team.concierge import Concierge
-        concierge = Concierge()
-        concierge.process_task({
+        task_queue.enqueue('concierge', {
             'task': 'welcome_new_user',
             'user_id': user.id
-        })
+        }, priority=PRIORITY_LOW, user_id=user.id)
         
         flash('Registration successful! You can now log in.', 'success')
         return redirect(url_for('auth.login'))
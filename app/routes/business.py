@@ -1,9 +1,12 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from app import db
-from app.models import Business, Town
+from app.models import Business
 from app.forms import BusinessForm
+from app.utils.agents import agents
+from app.utils.reference import reference_data
 from app.utils.security import sanitize_input
+from app.utils.tasks import task_queue
 
 business_bp = Blueprint('business', __name__, url_prefix='/business')
 
@@ -13,7 +16,7 @@ def add_business():
     form = BusinessForm()
     
     # Populate towns dropdown
-    form.town.choices = [(t.name, t.name) for t in Town.query.order_by('name').all()]
+    form.town.choices = [(t.name, t.name) for t in reference_data.towns]
     
     if form.validate_on_submit():
         # Create new business
@@ -35,19 +38,15 @@ def add_business():
         db.session.add(business)
         db.session.commit()
         
-        # Review listing with AI Curator
-        from app.ai_team.curator import Curator
-        curator = Curator()
-        review_result = curator.process_task({
+        # Review and categorize with AI Curator, in the background
+        task_queue.enqueue('curator', {
             'task': 'review_listing',
             'business_id': business.id
-        })
-        
-        # Categorize business with AI Curator
-        categorization_result = curator.process_task({
+        }, user_id=current_user.id)
+        task_queue.enqueue('curator', {
             'task': 'categorize_business',
             'business_id': business.id
-        })
+        }, user_id=current_user.id)
         
         flash('Business added successfully! It will be visible after approval.', 'success')
         return redirect(url_for('dashboard.owner_dashboard'))
@@ -67,7 +66,7 @@ def edit_business(business_id):
     form = BusinessForm(obj=business)
     
     # Populate towns dropdown
-    form.town.choices = [(t.name, t.name) for t in Town.query.order_by('name').all()]
+    form.town.choices = [(t.name, t.name) for t in reference_data.towns]
     
     if form.validate_on_submit():
         business.name = sanitize_input(form.name.data)
@@ -115,9 +114,7 @@ def boost_business(business_id):
         return jsonify({'success': False, 'message': 'Permission denied'})
     
     # Process payment through AI Accountant
-    from app.ai_team.accountant import Accountant
-    accountant = Accountant()
-    payment_result = accountant.process_task({
+    payment_result = agents.dispatch('accountant', {
         'task': 'process_payment',
         'user_id': current_user.id,
         'amount': 99.00,
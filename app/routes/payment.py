@@ -1,8 +1,10 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from app import db
-from app.models import Payment, SubscriptionPlan, Business
+from app.models import Payment, Business
+from app.utils.agents import agents
 from app.utils.payments import payfast
+from app.utils.reference import reference_data
 
 payment_bp = Blueprint('payment', __name__, url_prefix='/payment')
 
@@ -17,15 +19,13 @@ def subscribe(business_id, plan_code):
         return redirect(url_for('main.index'))
     
     # Get subscription plan
-    plan = SubscriptionPlan.query.filter_by(code=plan_code, is_active=True).first()
-    if not plan:
+    plan = reference_data.plan(plan_code)
+    if not plan or not plan.is_active:
         flash('Invalid subscription plan.', 'danger')
         return redirect(url_for('dashboard.owner_dashboard'))
     
     # Process payment through AI Accountant
-    from app.ai_team.accountant import Accountant
-    accountant = Accountant()
-    payment_result = accountant.process_task({
+    payment_result = agents.dispatch('accountant', {
         'task': 'process_payment',
         'user_id': current_user.id,
         'amount': plan.price,
@@ -88,5 +88,5 @@ def payment_notify(payment_id):
 
 @payment_bp.route('/plans')
 def subscription_plans():
-    plans = SubscriptionPlan.query.filter_by(is_active=True).all()
+    plans = reference_data.active_plans()
     return render_template('payment/plans.html', title='Subscription Plans', plans=plans)
@@ -25,6 +25,43 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Search typeahead
+    const suggestInput = document.querySelector('input[data-suggest-url]');
+    if (suggestInput) {
+        const suggestList = suggestInput.form.querySelector('.suggest-list');
+        const icons = {business: 'shop', category: 'tag', town: 'geo-alt', tag: 'hash'};
+        
+        const showSuggestions = debounce(function() {
+            const query = suggestInput.value.trim();
+            if (!query) {
+                suggestList.classList.add('d-none');
+                return;
+            }
+            
+            fetch(`${suggestInput.dataset.suggestUrl}?q=${encodeURIComponent(query)}`)
+                .then(response => response.json())
+                .then(data => {
+                    suggestList.innerHTML = '';
+                    data.suggestions.forEach(suggestion => {
+                        const item = document.createElement('a');
+                        item.href = suggestion.url;
+                        item.className = 'list-group-item list-group-item-action';
+                        item.innerHTML = `<i class="bi bi-${icons[suggestion.type]} me-2"></i>`;
+                        item.appendChild(document.createTextNode(suggestion.label));
+                        suggestList.appendChild(item);
+                    });
+                    suggestList.classList.toggle('d-none', data.suggestions.length === 0);
+                })
+                .catch(() => suggestList.classList.add('d-none'));
+        }, 100);
+        
+        suggestInput.addEventListener('input', showSuggestions);
+        suggestInput.addEventListener('blur', () => {
+            // Delay so a click on a suggestion still registers
+            setTimeout(() => suggestList.classList.add('d-none'), 200);
+        });
+    }
+    
     // Category filter
     const categoryFilter = document.getElementById('category-filter');
     if (categoryFilter) {
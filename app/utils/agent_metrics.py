@@ -0,0 +1,241 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, current_app, request
+
+# Log-linear bucket bounds (seconds), HDR style: each power of two split
+# into SUB_BUCKETS, so a bucket is within ~9% of any value in it from
+# 122us to 128s. Prometheus gets every EXPORT_STEP-th bound.
+SUB_BUCKETS = 4
+MIN_EXPONENT, MAX_EXPONENT = -13, 7
+BOUNDS = tuple(2.0 ** (exponent + sub / SUB_BUCKETS)
+               for exponent in range(MIN_EXPONENT, MAX_EXPONENT) for sub in range(SUB_BUCKETS)) \
+    + (2.0 ** MAX_EXPONENT,)
+EXPORT_STEP = 2
+
+OUTCOMES = ('success', 'error', 'exception')
+
+HISTOGRAMS = (
+    ('latency', 'agent_task_duration_seconds', 'Time spent in agent process_task, per task'),
+    ('db', 'agent_task_db_seconds', 'Database time inside agent process_task, per task'),
+    ('wait', 'agent_task_queue_wait_seconds', 'Time a queued task was ready before a worker took it')
+)
+
+
+def task_label(agent, task_data):
+    """The task type as a metric label; types the agent has no handler for share one label"""
+    task = task_data.get('task', '') if isinstance(task_data, dict) else ''
+    return task if task in getattr(agent, 'handlers', ()) else 'unknown'
+
+
+def stats_denied():
+    """None if the request may read operational stats (/metrics and the like), else the refusal
+
+    With METRICS_TOKEN set they need "Authorization: Bearer <token>";
+    without one they are served only in debug mode and are otherwise a 404.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        return None if current_app.debug else Response('Not Found\n', status=404, mimetype='text/plain')
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return None
+
+
+def outcome_of(result):
+    """'error' for the {"status": "error"} results agents return, 'exception' for a
+    batch handler's per-task exception, else 'success'
+    """
+    if isinstance(result, Exception):
+        return 'exception'
+    return 'error' if isinstance(result, dict) and result.get('status') == 'error' else 'success'
+
+
+class Histogram:
+    """Counts per BOUNDS bucket, with the sum, count and largest value"""
+
+    __slots__ = ('counts', 'sum', 'count', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value, count=1):
+        self.counts[bisect_left(BOUNDS, value)] += count
+        self.sum += value * count
+        self.count += count
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th value (never above the largest seen)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BOUNDS[index], self.max) if index < len(BOUNDS) else self.max
+        return self.max
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def merge(self, other):
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+
+class TaskSeries:
+    __slots__ = ('latency', 'db', 'wait', 'outcomes', 'first_seen')
+
+    def __init__(self, first_seen=None):
+        self.latency = Histogram()
+        self.db = Histogram()
+        self.wait = Histogram()
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.first_seen = time.monotonic() if first_seen is None else first_seen
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.db.merge(other.db)
+        self.wait.merge(other.wait)
+        for outcome, count in other.outcomes.items():
+            self.outcomes[outcome] += count
+        self.first_seen = min(self.first_seen, other.first_seen)
+
+    def figures(self, now):
+        tasks = self.latency.count
+        return {
+            'tasks': tasks,
+            'errors': self.outcomes['error'] + self.outcomes['exception'],
+            'success_rate': round(self.outcomes['success'] / tasks * 100, 1) if tasks else None,
+            'throughput_per_minute': round(tasks / max(now - self.first_seen, 1) * 60, 2),
+            'latency_ms': {'mean': _ms(self.latency.mean()), 'p50': _ms(self.latency.quantile(0.5)),
+                           'p95': _ms(self.latency.quantile(0.95)), 'p99': _ms(self.latency.quantile(0.99)),
+                           'max': _ms(self.latency.max)},
+            'db_ms': {'mean': _ms(self.db.mean()), 'p99': _ms(self.db.quantile(0.99))},
+            'queue_wait_ms': {'mean': _ms(self.wait.mean()), 'p99': _ms(self.wait.quantile(0.99))}
+        }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class AgentMetrics:
+    """Latency, DB time, queue wait and outcome counts per (agent, task)
+
+    Every agent process_task call (and every batch the registry hands to
+    an agent) is recorded in memory under one lock, a few microseconds
+    per task; /metrics serves them in the Prometheus text format and
+    summary() feeds the Trainer's performance reports. Figures are per
+    process, so scrape each worker process, as Prometheus expects.
+    """
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('AGENT_METRICS_ENABLED', True)
+        self.reset()
+        if self.enabled and 'metrics' not in app.view_functions:
+            app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def reset(self):
+        with self.lock:
+            self.series = {}
+
+    def _series(self, agent, task):
+        series = self.series.get((agent, task))
+        if series is None:
+            series = self.series[(agent, task)] = TaskSeries()
+        return series
+
+    def observe(self, agent, task, seconds, db_seconds, outcome, count=1):
+        """Record count tasks run together in seconds (each is recorded at its share)"""
+        if not self.enabled:
+            return
+        with self.lock:
+            series = self._series(agent, task)
+            series.latency.observe(seconds / count, count)
+            series.db.observe(db_seconds / count, count)
+            series.outcomes[outcome] += count
+
+    def observe_wait(self, agent, task, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            self._series(agent, task).wait.observe(max(seconds, 0.0))
+
+    def summary(self):
+        """{agent: measured figures, with a 'by_task' breakdown}; times in milliseconds"""
+        now = time.monotonic()
+        totals = {}
+        by_task = {}
+        with self.lock:
+            for (agent, task), series in sorted(self.series.items()):
+                totals.setdefault(agent, TaskSeries(first_seen=now)).merge(series)
+                by_task.setdefault(agent, {})[task] = series.figures(now)
+        return {agent: dict(total.figures(now), by_task=by_task[agent]) for agent, total in totals.items()}
+
+    def prometheus(self):
+        """All series in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            series = sorted(self.series.items())
+            for attribute, name, description in HISTOGRAMS:
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+                for (agent, task), task_series in series:
+                    histogram = getattr(task_series, attribute)
+                    if not histogram.count:
+                        continue
+                    labels = f'agent="{_label(agent)}",task="{_label(task)}"'
+                    cumulative = 0
+                    for index, count in enumerate(histogram.counts[:-1]):
+                        cumulative += count
+                        if index % EXPORT_STEP == 0:
+                            lines.append(f'{name}_bucket{{{labels},le="{BOUNDS[index]:.6g}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+            lines += ['# HELP agent_tasks_total Agent tasks run, by outcome', '# TYPE agent_tasks_total counter']
+            for (agent, task), task_series in series:
+                for outcome, count in task_series.outcomes.items():
+                    lines.append(f'agent_tasks_total{{agent="{_label(agent)}",task="{_label(task)}",'
+                                 f'outcome="{outcome}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        denied = stats_denied()
+        if denied is not None:
+            return denied
+        body = self.prometheus()
+        try:
+            from app.utils.tasks import task_queue
+            queued = task_queue.stats()
+        except Exception:
+            current_app.logger.exception('Could not read the task queue for /metrics')
+        else:
+            body += '# HELP agent_task_queue_tasks Tasks in the queue, by status\n# TYPE agent_task_queue_tasks gauge\n'
+            body += ''.join(f'agent_task_queue_tasks{{status="{_label(status)}"}} {count}\n'
+                            for status, count in sorted(queued.items()))
+        return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+agent_metrics = AgentMetrics()
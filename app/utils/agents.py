@@ -0,0 +1,121 @@
+import importlib
+import logging
+import threading
+import time
+from collections import Counter
+from app import db
+from app.utils.agent_metrics import agent_metrics, outcome_of
+from app.utils.query_stats import collect
+
+logger = logging.getLogger(__name__)
+
+# Agent name -> class in app.ai_team.<name>
+AGENTS = {
+    'accountant': 'Accountant',
+    'analyst': 'Analyst',
+    'architect': 'Architect',
+    'concierge': 'Concierge',
+    'curator': 'Curator',
+    'sentinel': 'Sentinel',
+    'trainer': 'Trainer'
+}
+
+
+class AgentRegistry:
+    """One long-lived instance of each AI team agent, shared by all threads
+
+    Agents build their warm state (dispatch tables, keyword tables,
+    compiled patterns) once, in their constructor, and keep nothing
+    per-task on the instance, so one instance serves every request and
+    worker thread. The agents named in AGENTS_WARM_ON_STARTUP (all of
+    them if True) are created when the app starts, the rest on first use.
+    """
+
+    def __init__(self, app=None):
+        self.instances = {}
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.instances = {}
+        warm = app.config.get('AGENTS_WARM_ON_STARTUP', True)
+        if warm:
+            for name in AGENTS if warm is True else warm:
+                try:
+                    self.get(name)
+                except Exception:
+                    # Leave it to fail (and be reported) when a task needs it
+                    logger.exception('Could not create the %s agent', name)
+
+    def get(self, name):
+        agent = self.instances.get(name)
+        if agent is None:
+            if name not in AGENTS:
+                raise KeyError(f'Unknown agent {name!r}')
+            with self.lock:
+                agent = self.instances.get(name)
+                if agent is None:
+                    module = importlib.import_module(f'app.ai_team.{name}')
+                    agent = self.instances[name] = getattr(module, AGENTS[name])()
+        return agent
+
+    def dispatch(self, name, task_data):
+        """agent.process_task(task_data) on the shared instance"""
+        return self.get(name).process_task(task_data)
+
+    def dispatch_many(self, name, tasks):
+        """Results for several tasks of one agent, in order
+
+        Tasks of a type the agent can batch (its batch_handlers) go to the
+        agent in one call; the rest run one at a time. A task that raises
+        gets its exception in its place instead of stopping the others, so
+        the caller retries only the tasks that failed. Batch handlers
+        likewise return one result per task, an exception for a task that
+        failed alone; one that raises fails its whole batch, so it must
+        leave nothing written when it does (one commit, at the end).
+        """
+        agent = self.get(name)
+        batch_handlers = getattr(agent, 'batch_handlers', {})
+        by_type = {}
+        for index, task_data in enumerate(tasks):
+            by_type.setdefault(task_data.get('task', ''), []).append(index)
+
+        results = [None] * len(tasks)
+        for task_type, indices in by_type.items():
+            handler = batch_handlers.get(task_type)
+            if handler is not None and len(indices) > 1:
+                try:
+                    batch = self._run_batch(name, task_type, handler, [tasks[index] for index in indices])
+                except Exception as exc:
+                    db.session.rollback()
+                    batch = [exc] * len(indices)
+                for index, result in zip(indices, batch):
+                    results[index] = result
+            else:
+                for index in indices:
+                    try:
+                        results[index] = agent.process_task(tasks[index])
+                    except Exception as exc:
+                        # Leave the session usable for the tasks after it
+                        db.session.rollback()
+                        results[index] = exc
+        return results
+
+    def _run_batch(self, name, task_type, handler, batch):
+        # Recorded like process_task calls, each task at its share of the batch
+        started = time.perf_counter()
+        outcomes = Counter(exception=len(batch))
+        with collect(f'{name} {task_type} x{len(batch)}') as stats:
+            try:
+                results = list(handler(batch))
+                outcomes = Counter(outcome_of(result) for result in results)
+                return results
+            finally:
+                elapsed = time.perf_counter() - started
+                for outcome, count in outcomes.items():
+                    share = count / len(batch)
+                    agent_metrics.observe(name, task_type, elapsed * share, stats.seconds * share, outcome, count)
+
+
+agents = AgentRegistry()
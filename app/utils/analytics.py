@@ -0,0 +1,256 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import case, delete, func, insert, select
+from app import db
+from app.models import AnalyticsEvent, AnalyticsRollup
+from app.models.analytics import PLATFORM_ID
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ('view', 'click', 'share', 'search')
+# Rollup column each event type is counted in
+COLUMNS = {'view': 'views', 'click': 'clicks', 'share': 'shares', 'search': 'searches'}
+METRICS = tuple(COLUMNS.values())
+
+
+def hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def upsert_counts(conn, table, keys, rows):
+    """Add the non-key values of each row to the row with the same keys, creating it as needed"""
+    if not rows:
+        return
+    counts = [name for name in rows[0] if name not in keys]
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        statement = dialect_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: table.c[name] + statement.excluded[name] for name in counts}
+        )
+        conn.execute(statement, rows)
+        return
+    for row in rows:
+        updated = conn.execute(table.update().where(*[table.c[key] == row[key] for key in keys]).values(
+            {name: table.c[name] + row[name] for name in counts}))
+        if not updated.rowcount:
+            conn.execute(insert(table), row)
+
+
+def upsert_rollups(conn, totals):
+    """Add counts to rollup rows, creating them as needed
+
+    totals maps (business_id, granularity, bucket) -> Counter of METRICS.
+    """
+    rows = [dict({'business_id': key[0], 'granularity': key[1], 'bucket': key[2]},
+                 **{metric: counts.get(metric, 0) for metric in METRICS})
+            for key, counts in totals.items()]
+    upsert_counts(conn, AnalyticsRollup.__table__, ('business_id', 'granularity', 'bucket'), rows)
+
+
+class AnalyticsStore:
+    """Append-only event log rolled up into hourly and daily counts
+
+    record() buffers events in memory; a background thread appends them
+    to analytics_events in batches. Once an hour is over, its events are
+    moved (deleted and counted in the same transaction) into hourly and
+    daily rollups, so raw storage stays bounded to roughly the current
+    hour. Windows of N days read N daily rows per listing.
+    """
+
+    def __init__(self, app=None):
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.enabled = False
+        self.rolled_up_at = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('ANALYTICS_ENABLED', True)
+        self.flush_seconds = app.config.get('ANALYTICS_FLUSH_SECONDS', 5)
+        self.flush_size = app.config.get('ANALYTICS_FLUSH_SIZE', 1000)
+        self.rollup_seconds = app.config.get('ANALYTICS_ROLLUP_SECONDS', 300)
+        self.hourly_retention_days = app.config.get('ANALYTICS_HOURLY_RETENTION_DAYS', 14)
+        self.daily_retention_days = app.config.get('ANALYTICS_DAILY_RETENTION_DAYS', 400)
+        self.chunk_size = app.config.get('ANALYTICS_COMPACT_CHUNK', 5000)
+
+    def record(self, event_type, business_id=None, query=None, occurred_at=None):
+        if not self.enabled:
+            return
+        event = {'business_id': business_id, 'event_type': event_type,
+                 'occurred_at': occurred_at or datetime.utcnow(), 'terms': query[:200] if query else None}
+        with self.lock:
+            self.buffer.append(event)
+            full = len(self.buffer) >= self.flush_size
+        self._ensure_thread()
+        if full:
+            self.wakeup.set()
+
+    def _ensure_thread(self):
+        # Started on first use, and again in each forked worker process
+        thread = self.thread
+        if thread is None or not thread.is_alive() or thread.pid != os.getpid():
+            with self.lock:
+                if self.thread is thread:
+                    self.thread = threading.Thread(target=self._run, name='analytics', daemon=True)
+                    self.thread.pid = os.getpid()
+                    self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.flush()
+                    if time.monotonic() - self.rolled_up_at > self.rollup_seconds:
+                        self.rolled_up_at = time.monotonic()
+                        self.compact()
+            except Exception:
+                logger.exception('Analytics flush failed')
+
+    def flush(self):
+        """Append buffered events to the event table"""
+        with self.lock:
+            events, self.buffer = self.buffer, []
+        if events:
+            with db.engine.begin() as conn:
+                conn.execute(insert(AnalyticsEvent.__table__), events)
+        return len(events)
+
+    def compact(self, now=None):
+        """Fold events from finished hours into rollups and drop expired rollups
+
+        Events are claimed in the transaction that counts them (see
+        _claim_events), so two processes compacting at once never count
+        the same event twice.
+        """
+        cutoff = hour_start(now or datetime.utcnow())
+        events = AnalyticsEvent.__table__
+        compacted = 0
+        while True:
+            with db.engine.begin() as conn:
+                last_id = conn.execute(
+                    select(events.c.id).where(events.c.occurred_at < cutoff)
+                    .order_by(events.c.id).offset(self.chunk_size - 1).limit(1)
+                ).scalar()
+                rows = self._claim_events(conn, cutoff, last_id)
+                totals = {}
+                for business_id, event_type, occurred_at in rows:
+                    if event_type not in COLUMNS:
+                        continue
+                    owner = PLATFORM_ID if business_id is None else business_id
+                    for key in ((owner, 'hour', hour_start(occurred_at)),
+                                (owner, 'day', day_start(occurred_at))):
+                        totals.setdefault(key, Counter())[COLUMNS[event_type]] += 1
+                upsert_rollups(conn, totals)
+            compacted += len(rows)
+            if last_id is None:
+                break
+
+        rollups = AnalyticsRollup.__table__
+        with db.engine.begin() as conn:
+            conn.execute(delete(rollups).where(
+                rollups.c.granularity == 'hour',
+                rollups.c.bucket < cutoff - timedelta(days=self.hourly_retention_days)))
+            conn.execute(delete(rollups).where(
+                rollups.c.granularity == 'day',
+                rollups.c.bucket < day_start(cutoff) - timedelta(days=self.daily_retention_days)))
+        return compacted
+
+    def _claim_events(self, conn, cutoff, last_id):
+        """Delete events before cutoff (up to last_id) in conn's transaction, returning them"""
+        events = AnalyticsEvent.__table__
+        window = [events.c.occurred_at < cutoff]
+        if last_id is not None:
+            window.append(events.c.id <= last_id)
+        columns = (events.c.business_id, events.c.event_type, events.c.occurred_at)
+        if conn.dialect.delete_returning:
+            return conn.execute(delete(events).where(*window).returning(*columns)).all()
+        # No DELETE ... RETURNING (MySQL): lock the window's rows, then
+        # delete exactly those; a concurrent compactor waits, then no longer sees them
+        rows = conn.execute(select(events.c.id, *columns).where(*window).with_for_update()).all()
+        if rows:
+            conn.execute(delete(events).where(events.c.id.in_([row[0] for row in rows])))
+        return [row[1:] for row in rows]
+
+    def _pending(self, business_ids, since, today):
+        """Counts from events not compacted yet: {business_id: (since today, since `since`)}"""
+        events = AnalyticsEvent.__table__
+        rows = db.session.execute(
+            select(events.c.business_id, events.c.event_type,
+                   func.sum(case((events.c.occurred_at >= today, 1), else_=0)), func.count())
+            .where(events.c.business_id.in_(business_ids), events.c.occurred_at >= since)
+            .group_by(events.c.business_id, events.c.event_type)
+        ).all()
+        pending = {}
+        for business_id, event_type, today_count, count in rows:
+            recent, total = pending.setdefault(business_id, (Counter(), Counter()))
+            recent[COLUMNS[event_type]] += today_count or 0
+            total[COLUMNS[event_type]] += count
+        return pending
+
+    def windows(self, business_ids, days=(1, 7, 30, 90), now=None):
+        """{business_id: {days: {metric: count}}} for trailing windows ending now
+
+        A 1-day window is today so far. Reads at most max(days) daily
+        rollup rows per listing, plus events not yet compacted.
+        """
+        today = day_start(now or datetime.utcnow())
+        oldest = today - timedelta(days=max(days) - 1)
+        rollups = AnalyticsRollup.__table__
+        rows = db.session.execute(
+            select(rollups.c.business_id, rollups.c.bucket, *[getattr(rollups.c, m) for m in METRICS])
+            .where(rollups.c.business_id.in_(business_ids), rollups.c.granularity == 'day',
+                   rollups.c.bucket >= oldest)
+        ).all()
+        result = {business_id: {n: Counter() for n in days} for business_id in business_ids}
+        for business_id, bucket, *counts in rows:
+            for n in days:
+                if bucket >= today - timedelta(days=n - 1):
+                    result[business_id][n].update(dict(zip(METRICS, counts)))
+        for business_id, (recent, total) in self._pending(business_ids, oldest, today).items():
+            for n in days:
+                result[business_id][n].update(recent if n == 1 else total)
+        return {business_id: {n: {m: counts[n][m] for m in METRICS} for n in days}
+                for business_id, counts in result.items()}
+
+    def daily_series(self, business_id, days=30, now=None):
+        """[(date, {metric: count})] for the last `days` days, oldest first"""
+        today = day_start(now or datetime.utcnow())
+        start = today - timedelta(days=days - 1)
+        rollups = AnalyticsRollup.__table__
+        rows = db.session.execute(
+            select(rollups.c.bucket, *[getattr(rollups.c, m) for m in METRICS])
+            .where(rollups.c.business_id == business_id, rollups.c.granularity == 'day',
+                   rollups.c.bucket >= start)
+        ).all()
+        series = {start + timedelta(days=i): Counter() for i in range(days)}
+        for bucket, *counts in rows:
+            series[day_start(bucket)].update(dict(zip(METRICS, counts)))
+        events = AnalyticsEvent.__table__
+        for occurred_at, event_type in db.session.execute(
+                select(events.c.occurred_at, events.c.event_type)
+                .where(events.c.business_id == business_id, events.c.occurred_at >= start)):
+            series[day_start(occurred_at)][COLUMNS[event_type]] += 1
+        return [(day.date(), {m: counts[m] for m in METRICS}) for day, counts in sorted(series.items())]
+
+
+analytics = AnalyticsStore()
@@ -0,0 +1,98 @@
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from sqlalchemy import select
+from app import db
+from app.models import Business
+from app.utils.analytics import COLUMNS, analytics
+from app.utils.counters import counters
+
+logger = logging.getLogger(__name__)
+
+MAX_BUSINESS_ID = 2 ** 31 - 1
+# Listing events pages report by beacon; each is also counted in the Business column COLUMNS names
+BEACON_EVENTS = ('view', 'click', 'share')
+
+
+class ViewBeacon:
+    """View, click and share beacons queued in memory and handed on by a background writer
+
+    accept() is all a beacon request does: a range check and a put into a
+    bounded queue, so bursts never reach the database from request threads.
+    The writer drains the queue in batches, drops ids that are not live
+    listings with one query per batch, and passes the events to the
+    write-behind counters and the analytics store. When the queue is full
+    beacons are dropped and counted rather than queued without bound.
+    """
+
+    def __init__(self, app=None):
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.enabled = False
+        self.dropped = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('BEACON_ENABLED', True)
+        self.batch_size = app.config.get('BEACON_BATCH_SIZE', 500)
+        self.queue = queue.Queue(maxsize=app.config.get('BEACON_QUEUE_SIZE', 10000))
+        self.dropped = 0
+
+    def accept(self, business_id, event='view'):
+        """Queue one event (a BEACON_EVENTS type); False if it was dropped"""
+        if not self.enabled or event not in BEACON_EVENTS or not 0 < business_id <= MAX_BUSINESS_ID:
+            return False
+        try:
+            self.queue.put_nowait((business_id, event, datetime.utcnow()))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self._ensure_thread()
+        return True
+
+    def _ensure_thread(self):
+        # Started on first use, and again in each forked worker process
+        thread = self.thread
+        if thread is None or not thread.is_alive() or thread.pid != os.getpid():
+            with self.lock:
+                if self.thread is thread:
+                    self.thread = threading.Thread(target=self._run, name='view-beacon', daemon=True)
+                    self.thread.pid = os.getpid()
+                    self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                with self.app.app_context():
+                    self.write(batch)
+            except Exception:
+                logger.exception('Writing %d beacons failed', len(batch))
+
+    def write(self, batch):
+        """Pass [(business_id, event, occurred_at)] on to counters and analytics"""
+        ids = {business_id for business_id, _, _ in batch}
+        with db.engine.connect() as conn:
+            live = set(conn.execute(select(Business.id).where(
+                Business.id.in_(ids), Business.is_approved == True)).scalars())
+        for business_id, event, occurred_at in batch:
+            if business_id in live:
+                counters.increment(business_id, COLUMNS[event])
+                analytics.record(event, business_id, occurred_at=occurred_at)
+        return len(live)
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'capacity': self.queue.maxsize, 'dropped': self.dropped}
+
+
+view_beacon = ViewBeacon()
@@ -0,0 +1,186 @@
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import delete, event, select
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Tombstone
+
+logger = logging.getLogger(__name__)
+
+# A committed row change: action is 'insert', 'update' or 'delete'.
+# old/new are dicts of the tracked fields (None for insert/delete respectively).
+Change = namedtuple('Change', ['action', 'id', 'old', 'new'])
+
+_tracked = {}
+_listeners = {}
+_tombstoned = set()
+
+# Deleted rows are remembered this long (pruned by the tombstone_prune job)
+TOMBSTONE_DAYS = 7
+
+
+def track(model, fields):
+    """Start collecting committed changes of the given fields for a model"""
+    current = _tracked.get(model, ())
+    added = tuple(f for f in fields if f not in current)
+    _tracked[model] = current + added
+    # Load the previous value on assignment so old snapshots are complete
+    # even when an expired instance is modified
+    for field in added:
+        event.listen(getattr(model, field), 'set', _keep_history, active_history=True)
+
+
+def tracked_fields(model):
+    """Fields whose changes listeners of model receive"""
+    return _tracked.get(model, ())
+
+
+def _keep_history(target, value, oldvalue, initiator):
+    return value
+
+
+def keep_tombstones(model):
+    """Record deleted rows of model (ORM deletes), so changed_since() reports them"""
+    if model not in _tombstoned:
+        _tombstoned.add(model)
+        event.listen(model, 'after_delete', _bury)
+
+
+def _bury(mapper, connection, target):
+    connection.execute(Tombstone.__table__.insert().values(table=mapper.local_table.name, row_id=target.id))
+
+
+def changed_since(model, columns, since):
+    """([(id, *columns)] updated since `since`, [ids deleted since then]) for model
+
+    How an in-process index catches up with writes made by other
+    processes. Apply the deletes first: SQLite may reuse a deleted id.
+    Deletes are only seen for models passed to keep_tombstones(); None
+    means `since` is older than the tombstones kept, so reload instead.
+    """
+    if since < datetime.utcnow() - timedelta(days=TOMBSTONE_DAYS):
+        return None
+    # Own connection: this may run from an after_commit hook where the
+    # request session cannot emit SQL
+    with db.engine.connect() as conn:
+        rows = conn.execute(select(model.id, *columns).where(model.updated_at >= since)).all()
+        deleted = conn.execute(
+            select(Tombstone.row_id)
+            .where(Tombstone.table == model.__tablename__, Tombstone.deleted_at >= since)
+        ).scalars().all()
+    return rows, deleted
+
+
+def prune_tombstones(before):
+    """Delete tombstones older than before; returns how many"""
+    with db.engine.begin() as conn:
+        return conn.execute(delete(Tombstone).where(Tombstone.deleted_at < before)).rowcount
+
+
+def on_change(model):
+    """Decorator registering a listener called with a list of Changes after commit"""
+    def decorator(func):
+        _listeners.setdefault(model, []).append(func)
+        return func
+    return decorator
+
+
+def publish(model, changes):
+    """Notify listeners directly, for writes that bypass the ORM (bulk UPDATEs)"""
+    changes = list(changes)
+    if not changes:
+        return
+    for listener in _listeners.get(model, []):
+        try:
+            listener(changes)
+        except Exception:
+            logger.exception('Change listener %r failed', listener)
+
+
+def snapshot(obj, fields):
+    """Current values of the given fields, without triggering lazy loads"""
+    state = obj._sa_instance_state
+    return {field: state.dict.get(field) for field in fields}
+
+
+def _previous(state, fields):
+    old = {}
+    for field in fields:
+        history = state.attrs[field].history
+        if history.deleted:
+            old[field] = history.deleted[0]
+        elif history.unchanged:
+            old[field] = history.unchanged[0]
+        else:
+            old[field] = state.dict.get(field)
+    return old
+
+
+def _record(session, model, action, obj):
+    fields = _tracked[model]
+    state = obj._sa_instance_state
+    pending = session.info.setdefault('tracked_changes', {})
+    key = (model, state.dict.get('id'))
+
+    if action == 'update':
+        if not any(state.attrs[field].history.has_changes() for field in fields):
+            return
+        old, new = _previous(state, fields), snapshot(obj, fields)
+    elif action == 'insert':
+        old, new = None, snapshot(obj, fields)
+    else:
+        old, new = _previous(state, fields), None
+
+    # Several flushes in one transaction collapse to a single change per row
+    previous = pending.get(key)
+    if previous is not None:
+        old = previous.old
+        if previous.action == 'insert':
+            if action == 'delete':
+                del pending[key]
+                return
+            action = 'insert'
+    pending[key] = Change(action, key[1], old, new)
+
+
+@event.listens_for(Session, 'before_flush')
+def _load_tracked(session, flush_context, instances):
+    # Make sure snapshots taken after the flush see every tracked field
+    for obj in list(session.dirty) + list(session.deleted):
+        fields = _tracked.get(type(obj))
+        if fields:
+            unloaded = obj._sa_instance_state.unloaded
+            for field in fields:
+                if field in unloaded:
+                    getattr(obj, field)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect(session, flush_context):
+    if not _tracked:
+        return
+    for action, objects in (('insert', session.new),
+                            ('update', session.dirty),
+                            ('delete', session.deleted)):
+        for obj in objects:
+            model = type(obj)
+            if model in _tracked:
+                _record(session, model, action, obj)
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch(session):
+    pending = session.info.pop('tracked_changes', None)
+    if not pending:
+        return
+    by_model = {}
+    for (model, _), change in pending.items():
+        by_model.setdefault(model, []).append(change)
+    for model, changes in by_model.items():
+        publish(model, changes)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard(session, previous_transaction):
+    session.info.pop('tracked_changes', None)
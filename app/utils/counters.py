@@ -0,0 +1,202 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from sqlalchemy import bindparam, func
+from app import db
+from app.models import Business
+from app.utils.peers import peer_stats
+from app.utils.ranking import ranking
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ('views', 'clicks', 'shares')
+
+SPOOL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS counter_spool (
+    business_id INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    PRIMARY KEY (business_id, field)
+);
+CREATE TABLE IF NOT EXISTS counter_drain (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+# How long a drain may hold the spool before another process may take it
+DRAIN_LEASE_SECONDS = 300
+
+# One statement per flush, executed with a parameter set per listing
+COUNT_UPDATE = Business.__table__.update() \
+    .where(Business.id == bindparam('business_id')) \
+    .values(views=func.coalesce(Business.views, 0) + bindparam('add_views'),
+            clicks=func.coalesce(Business.clicks, 0) + bindparam('add_clicks'),
+            shares=func.coalesce(Business.shares, 0) + bindparam('add_shares'),
+            popularity=bindparam('new_popularity'),
+            rank_score=bindparam('new_score'),
+            # Counts alone do not change what pages show, so leave change
+            # watermarks and page cache versions alone
+            updated_at=Business.updated_at)
+
+
+class WriteBehindCounters:
+    """View, click and share counts buffered in memory and written in batches
+
+    increment() only touches a dict, so page views never wait on the
+    database. A background thread moves the counts into a SQLite spool
+    file shared by all worker processes on the host, then applies the
+    spool to the businesses table as one batched UPDATE ... SET
+    views = views + n. Counts leave the spool before they are applied
+    and go back if applying fails, so they are never counted twice; a
+    crash loses at most the counts buffered since the last flush
+    (COUNTERS_FLUSH_SECONDS or COUNTERS_FLUSH_SIZE), or the batch being
+    applied at the time.
+    """
+
+    def __init__(self, app=None):
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('COUNTERS_ENABLED', True)
+        self.spool_path = app.config.get('COUNTERS_SPOOL_PATH')
+        self.flush_seconds = app.config.get('COUNTERS_FLUSH_SECONDS', 5)
+        self.flush_size = app.config.get('COUNTERS_FLUSH_SIZE', 1000)
+        self.batch_size = app.config.get('COUNTERS_BATCH_SIZE', 500)
+        if self.enabled:
+            atexit.register(self.spill)
+
+    def increment(self, business_id, field='views', amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.pending[(business_id, field)] += amount
+            full = len(self.pending) >= self.flush_size
+        self._ensure_thread()
+        if full:
+            self.wakeup.set()
+
+    def _ensure_thread(self):
+        # Started on first use, and again in each forked worker process
+        thread = self.thread
+        if thread is None or not thread.is_alive() or thread.pid != os.getpid():
+            with self.lock:
+                if self.thread is thread:
+                    self.thread = threading.Thread(target=self._run, name='counter-flush', daemon=True)
+                    self.thread.pid = os.getpid()
+                    self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing buffered counters failed')
+
+    def _spool(self, timeout):
+        spool = sqlite3.connect(self.spool_path, timeout=timeout, isolation_level=None)
+        spool.execute('PRAGMA journal_mode=WAL')
+        spool.executescript(SPOOL_SCHEMA)
+        return spool
+
+    def _add(self, spool, rows):
+        spool.executemany(
+            'INSERT INTO counter_spool (business_id, field, amount) VALUES (?, ?, ?) '
+            'ON CONFLICT (business_id, field) DO UPDATE SET amount = amount + excluded.amount', rows)
+
+    def spill(self):
+        """Move buffered counts into the spool"""
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+        if not pending:
+            return
+        spool = self._spool(timeout=30)
+        try:
+            self._add(spool, [(business_id, field, amount) for (business_id, field), amount in pending.items()])
+        finally:
+            spool.close()
+
+    def drain(self):
+        """Apply spooled counts to the database; returns how many listings changed"""
+        owner = f'{os.getpid()}:{threading.get_ident()}'
+        spool = self._spool(timeout=0.1)
+        try:
+            rows = self._take(spool, owner)
+            if not rows:
+                return 0
+            # Putting counts back and releasing the lease wait like a spill does
+            spool.execute('PRAGMA busy_timeout = 30000')
+            counts = {}
+            for business_id, field, amount in rows:
+                counts.setdefault(business_id, dict.fromkeys(COUNTER_FIELDS, 0))[field] += amount
+            try:
+                with self.app.app_context():
+                    self.apply(counts)
+            except Exception:
+                # Nothing was written; the counts wait in the spool for the next attempt
+                self._add(spool, rows)
+                raise
+            finally:
+                spool.execute('DELETE FROM counter_drain WHERE id = 1 AND owner = ?', (owner,))
+            return len(counts)
+        finally:
+            spool.close()
+
+    def _take(self, spool, owner):
+        # Move the spooled counts out, leasing the spool to owner until they are
+        # applied: apply() reads popularity before writing it, so drains must not overlap
+        try:
+            spool.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError:
+            # Another worker process is taking the spool right now
+            return []
+        try:
+            now = time.time()
+            if spool.execute('SELECT 1 FROM counter_drain WHERE id = 1 AND expires_at > ?', (now,)).fetchone():
+                spool.execute('ROLLBACK')
+                return []
+            rows = spool.execute('SELECT business_id, field, amount FROM counter_spool').fetchall()
+            if rows:
+                spool.execute('DELETE FROM counter_spool')
+                spool.execute('INSERT OR REPLACE INTO counter_drain (id, owner, expires_at) VALUES (1, ?, ?)',
+                              (owner, now + DRAIN_LEASE_SECONDS))
+            spool.execute('COMMIT')
+            return rows
+        except Exception:
+            if spool.in_transaction:
+                spool.execute('ROLLBACK')
+            raise
+
+    def apply(self, counts):
+        ids = list(counts)
+        with db.engine.begin() as conn:
+            for start in range(0, len(ids), self.batch_size):
+                chunk = {business_id: counts[business_id] for business_id in ids[start:start + self.batch_size]}
+                updates = ranking.engagement_updates(conn, chunk)
+                for update in updates:
+                    for field in COUNTER_FIELDS:
+                        update[f'add_{field}'] = chunk[update['business_id']][field]
+                if updates:
+                    peer_stats.count_updates(conn, chunk)
+                    conn.execute(COUNT_UPDATE, updates)
+
+    def flush(self):
+        self.spill()
+        return self.drain()
+
+
+counters = WriteBehindCounters()
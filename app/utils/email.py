@@ -39,7 +39,7 @@ def send_listing_approval_email(business):
     send_email(
         f'[CapeBiz Connect] Your Listing "{business.name}" Has Been Approved',
         sender=current_app.config['ADMINS'][0],
-        recipients=[business.user.email],
+        recipients=[business.owner.email],
         text_body=render_template('email/listing_approved.txt', business=business),
         html_body=render_template('email/listing_approved.html', business=business)
     )
@@ -49,7 +49,7 @@ def send_renewal_reminder(business):
     send_email(
         f'[CapeBiz Connect] Renew Your Listing for "{business.name}"',
         sender=current_app.config['ADMINS'][0],
-        recipients=[business.user.email],
+        recipients=[business.owner.email],
         text_body=render_template('email/renewal_reminder.txt', business=business),
         html_body=render_template('email/renewal_reminder.html', business=business)
     )
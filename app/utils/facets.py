@@ -0,0 +1,139 @@
+import threading
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import select
+from app import db
+from app.models import Business
+from app.utils import changes
+
+FACET_FIELDS = ('category', 'town', 'is_approved', 'is_active')
+
+changes.track(Business, FACET_FIELDS)
+changes.keep_tombstones(Business)
+
+
+def facet_key(fields):
+    """(category, town) a listing is counted under, or None if it is not listed"""
+    if not Business.is_listed(fields):
+        return None
+    return fields.get('category'), fields.get('town')
+
+
+def _sorted_counts(counter):
+    return [(name, count) for name, count in
+            sorted(counter.items(), key=lambda item: (-item[1], item[0] or '')) if name and count > 0]
+
+
+class FacetEngine:
+    """Per-(category, town) counts of approved, active listings"""
+
+    def __init__(self, app=None):
+        self.counts = Counter()
+        self.keys = {}
+        self.loaded = False
+        self.lock = threading.RLock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.refresh_seconds = app.config.get('FACETS_REFRESH_SECONDS', 60)
+        self.synced_at = None
+        self.loaded = False
+
+    def load(self):
+        counts, keys = Counter(), {}
+        synced_at = datetime.utcnow()
+        with db.engine.connect() as conn:
+            rows = conn.execution_options(yield_per=5000).execute(
+                select(Business.id, Business.category, Business.town)
+                .where(Business.listed())
+            )
+            for business_id, category, town in rows:
+                keys[business_id] = (category, town)
+                counts[(category, town)] += 1
+        with self.lock:
+            self.counts, self.keys = counts, keys
+            self.synced_at = synced_at
+            self.loaded = True
+
+    def refresh(self):
+        # Fold in listings changed by other worker processes since the last sync
+        since, self.synced_at = self.synced_at, datetime.utcnow()
+        changed = changes.changed_since(Business, [getattr(Business, f) for f in FACET_FIELDS], since)
+        if changed is None:
+            return self.load()
+        rows, deleted = changed
+        with self.lock:
+            for business_id in deleted:
+                self._move(business_id, None)
+            for row in rows:
+                self._move(row[0], facet_key(dict(zip(FACET_FIELDS, row[1:]))))
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.load()
+        elif (datetime.utcnow() - self.synced_at).total_seconds() > self.refresh_seconds:
+            self.refresh()
+
+    def _move(self, business_id, key):
+        previous = self.keys.pop(business_id, None)
+        if previous is not None:
+            self.counts[previous] -= 1
+            if self.counts[previous] <= 0:
+                del self.counts[previous]
+        if key is not None:
+            self.keys[business_id] = key
+            self.counts[key] += 1
+
+    def apply(self, business_changes):
+        if not self.loaded:
+            return
+        with self.lock:
+            for change in business_changes:
+                self._move(change.id, facet_key(change.new))
+
+    def select(self, business_ids, category='', town=''):
+        """The listed ids among business_ids in category and town (blank for any), in order"""
+        self._ensure_loaded()
+        with self.lock:
+            keys = self.keys
+            return [i for i in business_ids if i in keys and (not category or keys[i][0] == category)
+                    and (not town or keys[i][1] == town)]
+
+    def categories(self):
+        """Names of categories with at least one listing"""
+        return [name for name, _ in self.facet_counts()['categories']]
+
+    def facet_counts(self, category='', town='', business_ids=None):
+        """Category and town counts for the current filters
+
+        Category counts honour the selected town and vice versa, so each
+        facet shows how many results picking that value would give. When
+        business_ids (text search matches) is given, only those are counted.
+        """
+        self._ensure_loaded()
+        categories, towns = Counter(), Counter()
+        with self.lock:
+            if business_ids is None:
+                groups = self.counts.items()
+            else:
+                groups = Counter(self.keys[i] for i in business_ids if i in self.keys).items()
+            for (group_category, group_town), count in groups:
+                if not town or group_town == town:
+                    categories[group_category] += count
+                if not category or group_category == category:
+                    towns[group_town] += count
+        return {
+            'categories': _sorted_counts(categories),
+            'towns': _sorted_counts(towns)
+        }
+
+
+facet_engine = FacetEngine()
+
+
+@changes.on_change(Business)
+def _update_facets(business_changes):
+    facet_engine.apply(business_changes)
@@ -0,0 +1,229 @@
+import math
+import threading
+from datetime import datetime
+from sqlalchemy import event, inspect, select
+from app import db
+from app.models import Business, Town
+from app.utils import changes
+from app.utils.startup import lazy_import
+
+# Imported by the first distance query rather than at startup
+np = lazy_import('numpy')
+
+GEO_FIELDS = ('latitude', 'longitude', 'is_approved')
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+changes.track(Business, GEO_FIELDS)
+changes.keep_tombstones(Business)
+
+
+def valid_point(lat, lng):
+    """True for a latitude/longitude pair on the globe (NaN and infinity fail the bounds)"""
+    return lat is not None and lng is not None and -90 <= lat <= 90 and -180 <= lng <= 180
+
+
+def haversine_km(lat, lng, latitudes, longitudes):
+    """Great-circle distances from one point to arrays of points, in km"""
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+@event.listens_for(Business, 'before_insert')
+@event.listens_for(Business, 'before_update')
+def default_coordinates(mapper, connection, business):
+    """Place listings at their town's coordinates unless given their own"""
+    state = inspect(business)
+    moved = state.attrs.town.history.has_changes()
+    placed = state.attrs.latitude.history.has_changes() or state.attrs.longitude.history.has_changes()
+    if business.latitude is not None and not (moved and not placed):
+        return
+    town = connection.execute(
+        select(Town.latitude, Town.longitude).where(Town.name == business.town)
+    ).first()
+    if town is not None and town.latitude is not None:
+        business.latitude, business.longitude = town.latitude, town.longitude
+
+
+class GeoIndex:
+    """Uniform lat/lng grid of approved listings
+
+    Radius and k-nearest queries gather candidates from the cells around
+    the point, then compute their distances in one vectorized pass.
+    """
+
+    def __init__(self, cell_degrees=0.1):
+        self.cell_degrees = cell_degrees
+        self.cells = {}
+        self.points = {}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+
+    def add(self, business_id, lat, lng):
+        with self.lock:
+            self.remove(business_id)
+            if lat is None or lng is None:
+                return
+            self.points[business_id] = (lat, lng)
+            self.cells.setdefault(self._cell(lat, lng), set()).add(business_id)
+
+    def remove(self, business_id):
+        with self.lock:
+            point = self.points.pop(business_id, None)
+            if point is None:
+                return
+            cell = self._cell(*point)
+            members = self.cells[cell]
+            members.discard(business_id)
+            if not members:
+                del self.cells[cell]
+
+    def _ring(self, lat, lng, rings):
+        """Ids in the square of cells within `rings` cells of the point"""
+        row, col = self._cell(lat, lng)
+        ids = []
+        for r in range(row - rings, row + rings + 1):
+            for c in range(col - rings, col + rings + 1):
+                ids.extend(self.cells.get((r, c), ()))
+        return ids
+
+    def _distances(self, lat, lng, ids):
+        ids = np.fromiter(ids, dtype=np.int64, count=len(ids))
+        coordinates = np.array([self.points[i] for i in ids.tolist()], dtype=np.float64).reshape(-1, 2)
+        return ids, haversine_km(lat, lng, coordinates[:, 0], coordinates[:, 1])
+
+    def _rings_for(self, lat, radius_km):
+        # Longitude degrees shrink with latitude; size the search square for
+        # that. None when the square would cover every cell (or the radius
+        # is infinite): then every indexed point is scanned
+        lng_km = KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+        rings = radius_km / (min(KM_PER_DEGREE, lng_km) * self.cell_degrees)
+        if not math.isfinite(rings) or 2 * rings + 1 > math.sqrt(len(self.cells)):
+            return None
+        return int(math.ceil(rings))
+
+    def within(self, lat, lng, radius_km, limit=None):
+        """[(business_id, distance_km)] within the radius, nearest first"""
+        with self.lock:
+            rings = self._rings_for(lat, radius_km)
+            if rings is None or (2 * rings + 1) ** 2 > len(self.cells):
+                ids = list(self.points)
+            else:
+                ids = self._ring(lat, lng, rings)
+            if not ids:
+                return []
+            ids, distances = self._distances(lat, lng, ids)
+
+        inside = distances <= radius_km
+        ids, distances = ids[inside], distances[inside]
+        order = np.lexsort((ids, distances))
+        if limit is not None:
+            order = order[:limit]
+        return list(zip(ids[order].tolist(), distances[order].tolist()))
+
+    def nearest(self, lat, lng, k):
+        """The k listings closest to the point, nearest first"""
+        with self.lock:
+            if not self.points:
+                return []
+            if len(self.points) <= k:
+                # Every point is among the k nearest
+                return self.within(lat, lng, math.inf, limit=k)
+            # Grow the search square until it holds k candidates, then widen
+            # it to the circle through its corners so nothing closer is missed
+            rings = 0
+            while True:
+                ids = self._ring(lat, lng, rings)
+                if len(ids) >= k or (2 * rings + 1) ** 2 > len(self.cells) * 4:
+                    break
+                rings = rings * 2 + 1
+        if len(ids) < k:
+            return self.within(lat, lng, math.inf, limit=k)
+        reach_km = (rings + 1) * self.cell_degrees * KM_PER_DEGREE * math.sqrt(2)
+        return self.within(lat, lng, reach_km, limit=k)
+
+
+class GeoSearch:
+    """Radius and nearest-neighbour search over listing coordinates"""
+
+    def __init__(self, app=None):
+        self.index = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cell_degrees = app.config.get('GEO_CELL_DEGREES', 0.1)
+        self.refresh_seconds = app.config.get('GEO_REFRESH_SECONDS', 60)
+        self.synced_at = None
+        self.index = None
+
+    def load(self):
+        index = GeoIndex(self.cell_degrees)
+        synced_at = datetime.utcnow()
+        with db.engine.connect() as conn:
+            rows = conn.execution_options(yield_per=5000).execute(
+                select(Business.id, Business.latitude, Business.longitude)
+                .where(Business.is_approved == True, Business.latitude.isnot(None))
+            )
+            for business_id, lat, lng in rows:
+                index.add(business_id, lat, lng)
+        self.index, self.synced_at = index, synced_at
+
+    def refresh(self):
+        # Fold in listings changed by other worker processes since the last sync
+        since, self.synced_at = self.synced_at, datetime.utcnow()
+        changed = changes.changed_since(
+            Business, [Business.latitude, Business.longitude, Business.is_approved], since)
+        if changed is None:
+            return self.load()
+        rows, deleted = changed
+        for business_id in deleted:
+            self.index.remove(business_id)
+        for business_id, lat, lng, approved in rows:
+            if approved:
+                self.index.add(business_id, lat, lng)
+            else:
+                self.index.remove(business_id)
+
+    def _ensure_loaded(self):
+        if self.index is None:
+            with self.lock:
+                if self.index is None:
+                    self.load()
+        elif (datetime.utcnow() - self.synced_at).total_seconds() > self.refresh_seconds:
+            self.refresh()
+        return self.index
+
+    def within(self, lat, lng, radius_km, limit=None):
+        return self._ensure_loaded().within(lat, lng, radius_km, limit)
+
+    def nearest(self, lat, lng, k):
+        return self._ensure_loaded().nearest(lat, lng, k)
+
+    def apply(self, business_changes):
+        if self.index is None:
+            return
+        for change in business_changes:
+            fields = change.new
+            if fields and fields.get('is_approved'):
+                self.index.add(change.id, fields.get('latitude'), fields.get('longitude'))
+            else:
+                self.index.remove(change.id)
+
+
+geo_search = GeoSearch()
+
+
+@changes.on_change(Business)
+def _update_geo_index(business_changes):
+    geo_search.apply(business_changes)
@@ -0,0 +1,149 @@
+from flask import current_app, render_template, stream_template
+from app.models import Business
+from app.utils.pagination import Page, after, clamp_page_size, decode_cursor
+from app.utils.facets import facet_engine
+from app.utils.geo import geo_search, valid_point
+from app.utils.ranking import RELEVANCE_WEIGHT
+from app.utils.search import search_engine
+from app.utils.search_cache import cache_key, cache_tags, search_cache
+
+# Listing order: materialized rank_score (see app.utils.ranking), newest first
+RANKING = (Business.rank_score, Business.id)
+
+
+def page_size(value=None):
+    return clamp_page_size(value,
+                           current_app.config['LISTINGS_PER_PAGE'],
+                           current_app.config['LISTINGS_MAX_PER_PAGE'])
+
+
+def find_listings(q='', category='', town='', cursor=None, per_page=None,
+                  lat=None, lng=None, radius=None):
+    """One keyset-paginated page of listed businesses matching the filters
+
+    With lat/lng, only listings within radius km are returned; a point off
+    the globe is ignored, and a missing or non-positive radius means
+    GEO_DEFAULT_RADIUS_KM. Text and distance matches add up to
+    RELEVANCE_WEIGHT to a listing's rank_score.
+    """
+    per_page = page_size(per_page)
+
+    # The same predicate as the facet counts, so a facet count matches its results
+    listings = Business.query.filter(Business.listed())
+    if category:
+        listings = listings.filter_by(category=category)
+    if town:
+        listings = listings.filter_by(town=town)
+
+    nearby = None
+    if valid_point(lat, lng):
+        if radius is None or not radius > 0:
+            radius = current_app.config['GEO_DEFAULT_RADIUS_KM']
+        radius = min(radius, current_app.config['GEO_MAX_RADIUS_KM'])
+        # Every listing in range, nearest first; filters apply before any cap
+        nearby = dict(geo_search.within(lat, lng, radius))
+
+    # Ranked results are the top SEARCH_MAX_RESULTS after the filters; facet
+    # counts use every match, since they count the other categories/towns too
+    max_results = current_app.config['SEARCH_MAX_RESULTS']
+    if q:
+        relevance = dict(search_engine.search(q, max_results, category=category, town=town,
+                                              ids=nearby.keys() if nearby is not None else None))
+        best = max(relevance.values(), default=0)
+        relevance = {i: score / best if best > 0 else 1.0 for i, score in relevance.items()}
+        match_ids = search_engine.matches(q)
+        if nearby is not None:
+            match_ids = match_ids & nearby.keys()
+    elif nearby is not None:
+        # Closer is better: the searched point scores 1, the radius edge 0
+        relevance = {i: 1 - nearby[i] / radius
+                     for i in facet_engine.select(nearby, category, town)[:max_results]}
+        match_ids = nearby.keys()
+    else:
+        return Page(_keyset_rows(listings, cursor, per_page), per_page)
+
+    page = Page(_ranked_rows(listings, relevance, cursor, per_page), per_page)
+    page.match_ids = match_ids
+    page.distances = {i: nearby[i] for i in relevance} if nearby is not None else {}
+    return page
+
+
+def _keyset_rows(listings, cursor, per_page):
+    key = decode_cursor(cursor, len(RANKING))
+    rows = listings
+    if key is not None:
+        rows = rows.filter(after(RANKING, key))
+    rows = rows.order_by(*[column.desc() for column in RANKING]).limit(per_page + 1)
+    for business in rows:
+        yield (business.rank_score, business.id), business
+
+
+def _ranked_rows(listings, relevance, cursor, per_page):
+    # Relevance depends on the query, so matches are ordered here; they
+    # are bounded (SEARCH_MAX_RESULTS, after the filters) and only
+    # lightweight (score, id) tuples are sorted
+    if not relevance:
+        return
+    candidates = listings.with_entities(Business.id, Business.rank_score) \
+        .filter(Business.id.in_(relevance)) \
+        .all()
+    keys = sorted(((round((rank_score or 0) + RELEVANCE_WEIGHT * relevance[business_id], 6), business_id)
+                   for business_id, rank_score in candidates), reverse=True)
+
+    key = decode_cursor(cursor, 2)
+    if key is not None:
+        keys = [k for k in keys if k < key]
+    keys = keys[:per_page + 1]
+
+    businesses = {b.id: b for b in Business.query.filter(Business.id.in_([k[-1] for k in keys]))}
+    for k in keys:
+        if k[-1] in businesses:
+            yield k, businesses[k[-1]]
+
+
+def search_listings(q='', category='', town='', cursor=None, per_page=None,
+                    lat=None, lng=None, radius=None):
+    """A page of listings plus facet counts, served from the search cache
+
+    Returns (page, facets). Pages big enough to be streamed bypass the
+    cache, since caching needs the whole page up front.
+    """
+    per_page = page_size(per_page)
+    if valid_point(lat, lng):
+        # ~100m precision keeps nearby "near me" searches on one cache entry
+        lat, lng = round(lat, 3), round(lng, 3)
+    else:
+        lat = lng = None
+    params = dict(q=q, category=category, town=town, cursor=cursor, per_page=per_page,
+                  lat=lat, lng=lng, radius=radius)
+
+    if per_page >= current_app.config['LISTINGS_STREAM_THRESHOLD']:
+        page = find_listings(**params)
+        return page, facet_engine.facet_counts(category, town, page.match_ids)
+
+    key = cache_key(**params)
+    cached = search_cache.get(key)
+    if cached is None:
+        page = find_listings(**params).load()
+        ids = [business.id for business in page]
+        cached = {
+            'ids': ids,
+            'next_cursor': page.next_cursor,
+            'distances': {i: page.distances[i] for i in ids if i in page.distances},
+            'facets': facet_engine.facet_counts(category, town, page.match_ids)
+        }
+        search_cache.set(key, cached, cache_tags(category, town))
+        return page, cached['facets']
+
+    businesses = {b.id: b for b in Business.query.filter(Business.id.in_(cached['ids']))}
+    page = Page.from_items([businesses[i] for i in cached['ids'] if i in businesses],
+                           per_page, cached['next_cursor'])
+    page.distances = cached['distances']
+    return page, cached['facets']
+
+
+def render_listings(template, page, **context):
+    """Render a page of listings, streaming it when the page is large"""
+    if page.per_page >= current_app.config['LISTINGS_STREAM_THRESHOLD']:
+        return stream_template(template, businesses=page, **context)
+    return render_template(template, businesses=page.load(), **context)
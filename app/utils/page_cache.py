@@ -0,0 +1,161 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import func
+from app import db
+from app.models import Business
+
+CachedPage = namedtuple('CachedPage', ['token', 'body', 'mimetype', 'etag', 'last_modified'])
+
+# What a page shows, as of when: token changes whenever the page could,
+# last_modified is the newest updated_at behind it (for Last-Modified)
+Version = namedtuple('Version', ['token', 'last_modified'])
+
+
+def listings_version(**filters):
+    """Version of the approved listings matching filters
+
+    The newest updated_at catches edits and additions, the count catches
+    deletions and the sum of rank_score catches reordering, which ranking
+    recomputes and counter flushes write without touching updated_at.
+    Each version is reused for PAGE_CACHE_VERSION_SECONDS, so a busy page
+    runs the aggregate once in that time rather than on every hit.
+    """
+    def query():
+        newest, count, ranks = db.session.query(
+            func.max(Business.updated_at), func.count(Business.id), func.sum(Business.rank_score)
+        ).filter_by(is_approved=True, **filters).one()
+        return Version(f'{newest.isoformat() if newest else ""}/{count}/{ranks!r}', newest)
+    return page_cache.remembered(('listings', tuple(sorted(filters.items()))), query)
+
+
+def combine(*versions):
+    """One version for a page built from several pieces of data"""
+    dates = [v.last_modified for v in versions if v.last_modified is not None]
+    return Version('|'.join(v.token for v in versions), max(dates) if dates else None)
+
+
+def row_version(row):
+    return Version(f'{type(row).__name__}:{row.id}:{row.updated_at.isoformat() if row.updated_at else ""}',
+                   row.updated_at)
+
+
+class PageCache:
+    """Rendered public pages and fragments, reused until their data changes
+
+    Whole pages are cached only for anonymous visitors, who all see the
+    same HTML. Responses carry a strong ETag (a hash of the body) and
+    Last-Modified, so repeat visitors and crawlers get a 304 after one
+    version query, without rendering anything.
+    """
+
+    def __init__(self, app=None):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_entries = 512
+        self.max_age = 60
+        self.versions = {}
+        self.version_seconds = 5
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('PAGE_CACHE_MAX_ENTRIES', 512)
+        self.max_age = app.config.get('PAGE_CACHE_MAX_AGE', 60)
+        self.version_seconds = app.config.get('PAGE_CACHE_VERSION_SECONDS', 5)
+        self.versions = {}
+        self.enabled = app.config.get('PAGE_CACHE_ENABLED', True)
+        app.jinja_env.globals['cached_fragment'] = self.cached_fragment
+
+    def _get(self, key, token):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.token != token:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def remembered(self, key, compute):
+        """compute(), reused for version_seconds"""
+        now = time.monotonic()
+        with self.lock:
+            cached = self.versions.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        value = compute()
+        with self.lock:
+            if len(self.versions) >= self.max_entries:
+                # Keys come from URLs, so keep the table bounded
+                self.versions.clear()
+            self.versions[key] = (now + self.version_seconds, value)
+        return value
+
+    def cacheable(self):
+        return self.enabled and request.method in ('GET', 'HEAD') \
+            and not current_user.is_authenticated and '_flashes' not in session
+
+    def serve(self, version, render):
+        """Response for the current request, rendering only if version is new"""
+        if not self.cacheable():
+            return render()
+
+        key = ('page', request.endpoint, tuple(sorted(request.view_args.items())),
+               tuple(sorted(request.args.items(multi=True))))
+        entry = self._get(key, version.token)
+        if entry is None:
+            response = make_response(render())
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            body = response.get_data()
+            entry = self._set(key, CachedPage(version.token, body, response.mimetype,
+                                              hashlib.sha1(body).hexdigest(), version.last_modified))
+
+        response = current_app.response_class(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        if entry.last_modified is not None:
+            response.last_modified = entry.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        response.vary.add('Cookie')
+        return response.make_conditional(request)
+
+    def cached_fragment(self, name, token, caller):
+        """Jinja call block rendered once per token, for anonymous and logged-in visitors
+
+            {% call cached_fragment('featured', fragment_token) %}...{% endcall %}
+        """
+        if not self.enabled:
+            return caller()
+        key = ('fragment', name)
+        entry = self._get(key, token)
+        if entry is None:
+            entry = self._set(key, CachedPage(token, str(caller()), None, None, None))
+        return Markup(entry.body)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+page_cache = PageCache()
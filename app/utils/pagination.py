@@ -0,0 +1,100 @@
+import base64
+import json
+import math
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(key):
+    """Opaque, URL-safe cursor for a sort key tuple"""
+    if key is None:
+        return None
+    raw = json.dumps(list(key), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """Sort key tuple from a cursor, or None if missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(key, list) or len(key) != length:
+        return None
+    # Sort keys are scores and ids; anything else (strings, bools, NaN that
+    # json.loads accepts) would fail or misorder when compared with them
+    if not all(type(value) in (int, float) and math.isfinite(value) for value in key):
+        return None
+    return tuple(key)
+
+
+def clamp_page_size(value, default, maximum):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(value, maximum))
+
+
+def after(columns, key):
+    """WHERE clause selecting rows after key for a descending sort on columns"""
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [columns[j] == key[j] for j in range(i)]
+        clauses.append(and_(*equal, column < key[i]))
+    return or_(*clauses)
+
+
+class Page:
+    """One page of results, consumed lazily so it can be streamed
+
+    rows yields (key, item) pairs in sort order; at most per_page + 1 are
+    read, the extra one only to learn whether another page exists.
+    """
+
+    def __init__(self, rows, per_page):
+        self._rows = iter(rows)
+        self.per_page = per_page
+        self.items = None
+        self.next_cursor = None
+        # Ids of every text or radius search match (None when just browsing)
+        self.match_ids = None
+        # Business id -> km from the searched point, for "near me" searches
+        self.distances = {}
+
+    def __iter__(self):
+        if self.items is not None:
+            return iter(self.items)
+        return self._consume()
+
+    def _consume(self):
+        items = []
+        last_key = None
+        for key, item in self._rows:
+            if len(items) == self.per_page:
+                self.next_cursor = encode_cursor(last_key)
+                break
+            items.append(item)
+            last_key = key
+            yield item
+        self.items = items
+
+    @classmethod
+    def from_items(cls, items, per_page, next_cursor):
+        """An already materialized page (e.g. rebuilt from cached ids)"""
+        page = cls((), per_page)
+        page.items = list(items)
+        page.next_cursor = next_cursor
+        return page
+
+    def load(self):
+        """Materialize the page (for JSON responses and non-streamed templates)"""
+        for _ in self:
+            pass
+        return self
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
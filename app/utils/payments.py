@@ -1,4 +1,3 @@
-import requests
 from flask import current_app, url_for
 import hashlib
 import urllib.parse
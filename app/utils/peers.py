@@ -0,0 +1,208 @@
+import math
+from collections import Counter
+from sqlalchemy import delete, select, tuple_
+from app import db
+from app.models import Business, PeerGroup, PeerSketchBucket
+from app.utils import changes
+from app.utils.analytics import upsert_counts
+
+PEER_FIELDS = ('category', 'town', 'is_approved', 'views', 'clicks')
+METRICS = ('views', 'clicks')
+
+# Bucket b > 0 of a sketch holds values in [GAMMA ** (b - 1), GAMMA ** b)
+# and bucket 0 holds zero, so a percentile is off by at most one bucket
+# (~20% of the value) whatever the size of the group
+GAMMA = 1.2
+_LOG_GAMMA = math.log(GAMMA)
+
+changes.track(Business, PEER_FIELDS)
+
+
+def bucket_of(value):
+    if not value or value < 1:
+        return 0
+    return 1 + int(math.log(value) / _LOG_GAMMA)
+
+
+def membership(fields):
+    """(category, town, views, clicks) a listing counts as in its peer group, or None"""
+    if not fields or not fields.get('is_approved') or not fields.get('category') or not fields.get('town'):
+        return None
+    return fields['category'], fields['town'], fields.get('views') or 0, fields.get('clicks') or 0
+
+
+def percentile(sketch, value, listings):
+    """Share of a group (0-100) below value, from its [(bucket, listings)] sketch"""
+    if not listings:
+        return None
+    bucket = bucket_of(value)
+    below = sum(count for b, count in sketch if b < bucket)
+    same = sum(count for b, count in sketch if b == bucket)
+    return round(min(100.0, (below + same / 2) / listings * 100), 1)
+
+
+class PeerDelta:
+    """Changes to peer groups and sketch buckets, written as additive upserts"""
+
+    def __init__(self):
+        self.groups = {}
+        self.buckets = Counter()
+
+    def add(self, member, sign=1):
+        if member is None:
+            return
+        category, town, views, clicks = member
+        totals = self.groups.setdefault((category, town), [0, 0, 0])
+        totals[0] += sign
+        totals[1] += sign * views
+        totals[2] += sign * clicks
+        self.buckets[(category, town, 'views', bucket_of(views))] += sign
+        self.buckets[(category, town, 'clicks', bucket_of(clicks))] += sign
+
+    def move(self, old, new):
+        if old != new:
+            self.add(old, -1)
+            self.add(new)
+
+    def write(self, conn):
+        groups = [{'category': category, 'town': town, 'listings': listings,
+                   'views_sum': views, 'clicks_sum': clicks}
+                  for (category, town), (listings, views, clicks) in self.groups.items()
+                  if listings or views or clicks]
+        buckets = [{'category': category, 'town': town, 'metric': metric, 'bucket': bucket, 'listings': listings}
+                   for (category, town, metric, bucket), listings in self.buckets.items() if listings]
+        if not groups and not buckets:
+            return
+        upsert_counts(conn, PeerGroup.__table__, ('category', 'town'), groups)
+        upsert_counts(conn, PeerSketchBucket.__table__, ('category', 'town', 'metric', 'bucket'), buckets)
+        conn.execute(delete(PeerSketchBucket.__table__).where(PeerSketchBucket.__table__.c.listings <= 0))
+        conn.execute(delete(PeerGroup.__table__).where(PeerGroup.__table__.c.listings <= 0))
+
+
+class PeerStats:
+    """Per (category, town) listing counts, sums and percentile sketches
+
+    Kept current from committed Business changes and from the batched
+    counter updates, so comparing listings with their peers reads their
+    group rows and a bounded number of sketch buckets per group, however
+    many listings share a category and town. The peer_stats_rebuild job
+    recomputes them nightly, correcting any drift (a deleted listing,
+    for one, leaves with the counts its last snapshot held).
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PEER_STATS_ENABLED', True)
+
+    def apply(self, business_changes):
+        delta = PeerDelta()
+        with db.engine.begin() as conn:
+            current = self._current_counts(conn, [change.id for change in business_changes if change.new])
+            for change in business_changes:
+                old, new = change.old, change.new
+                counts = current.get(change.id)
+                if counts is not None:
+                    # Counts move through bulk UPDATEs the ORM never sees
+                    # (count_updates), so a snapshot's views/clicks can be
+                    # stale: take them from the row, less what this change wrote
+                    new = dict(new, **counts)
+                    if old:
+                        old = dict(old, **{metric: counts[metric] - ((change.new.get(metric) or 0) -
+                                                                     (old.get(metric) or 0))
+                                           for metric in METRICS})
+                delta.move(membership(old), membership(new))
+            delta.write(conn)
+
+    def _current_counts(self, conn, ids):
+        # {id: {'views', 'clicks'}} as committed, locked until conn's transaction ends
+        current = {}
+        for start in range(0, len(ids), 500):
+            for row in conn.execute(
+                    select(Business.id, *[getattr(Business, metric) for metric in METRICS])
+                    .where(Business.id.in_(ids[start:start + 500])).with_for_update()):
+                current[row.id] = {metric: getattr(row, metric) or 0 for metric in METRICS}
+        return current
+
+    def count_updates(self, conn, counts):
+        """Move listings gaining counts to their new buckets, in the caller's transaction
+
+        counts maps business id -> {'views': n, 'clicks': n, ...}.
+        """
+        if not self.enabled:
+            return
+        delta = PeerDelta()
+        rows = conn.execute(
+            select(Business.id, *[getattr(Business, name) for name in PEER_FIELDS])
+            .where(Business.id.in_(counts), Business.is_approved == True).with_for_update()
+        ).all()
+        for row in rows:
+            old = row._asdict()
+            new = dict(old, **{metric: (old[metric] or 0) + counts[row.id].get(metric, 0) for metric in METRICS})
+            delta.move(membership(old), membership(new))
+        delta.write(conn)
+
+    def rebuild(self):
+        """Recompute every group from the businesses table; returns the number of groups"""
+        delta = PeerDelta()
+        with db.engine.begin() as conn:
+            conn.execute(delete(PeerSketchBucket.__table__))
+            conn.execute(delete(PeerGroup.__table__))
+            rows = conn.execute(
+                select(*[getattr(Business, name) for name in PEER_FIELDS]).where(Business.is_approved == True))
+            for row in rows:
+                delta.add(membership(row._asdict()))
+            delta.write(conn)
+        return len(delta.groups)
+
+    def compare_many(self, businesses):
+        """{business id: standing among its peers} in two queries however many listings
+
+        Each standing holds the group size, mean views and clicks,
+        performance_vs_avg and views/clicks percentiles (0-100, ties
+        counted as half).
+        """
+        pairs = {(business.category, business.town) for business in businesses}
+        if not pairs:
+            return {}
+        groups = {(group.category, group.town): group for group in
+                  PeerGroup.query.filter(tuple_(PeerGroup.category, PeerGroup.town).in_(pairs))}
+        sketches = {}
+        buckets = PeerSketchBucket.__table__
+        for category, town, metric, bucket, listings in db.session.execute(
+                select(buckets.c.category, buckets.c.town, buckets.c.metric, buckets.c.bucket, buckets.c.listings)
+                .where(tuple_(buckets.c.category, buckets.c.town).in_(pairs))):
+            sketches.setdefault((category, town, metric), []).append((bucket, listings))
+
+        standings = {}
+        for business in businesses:
+            key = (business.category, business.town)
+            group = groups.get(key)
+            listings = group.listings if group else 0
+            mean_views = group.mean_views if group else 0
+            views = business.views or 0
+            standings[business.id] = {
+                'peers': listings,
+                'mean_views': mean_views,
+                'mean_clicks': group.mean_clicks if group else 0,
+                'performance_vs_avg': (views - mean_views) / mean_views * 100 if mean_views > 0 else 0,
+                'views_percentile': percentile(sketches.get(key + ('views',), ()), views, listings),
+                'clicks_percentile': percentile(sketches.get(key + ('clicks',), ()), business.clicks or 0, listings)
+            }
+        return standings
+
+    def compare(self, business):
+        """How a listing stands among approved listings in its category and town"""
+        return self.compare_many([business])[business.id]
+
+
+peer_stats = PeerStats()
+
+
+@changes.on_change(Business)
+def _update_peer_stats(business_changes):
+    if peer_stats.enabled:
+        peer_stats.apply(business_changes)
@@ -0,0 +1,146 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, select
+from app import db
+from app.models import Business, Payment, User
+from app.utils import changes
+
+BUSINESS_FIELDS = ('is_active', 'is_approved', 'created_at')
+PAYMENT_FIELDS = ('payment_status', 'amount', 'created_at')
+USER_FIELDS = ('created_at',)
+REVENUE_DAYS = 30
+
+changes.track(Business, BUSINESS_FIELDS)
+changes.track(Payment, PAYMENT_FIELDS)
+changes.track(User, USER_FIELDS)
+
+
+def _flag(fields, name):
+    return 1 if fields and fields.get(name) else 0
+
+
+def _day(moment):
+    return moment.date() if moment else None
+
+
+class PlatformMetrics:
+    """Platform totals kept in memory, adjusted by committed writes
+
+    Counts move with every Business, User and Payment change committed
+    in this process; the whole snapshot is recounted from the database
+    once it is older than PLATFORM_METRICS_MAX_AGE seconds (which also
+    picks up writes from other processes) and whenever the day changes.
+    Completed revenue is held per day, so the 30-day total ages out
+    without a query.
+    """
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PLATFORM_METRICS_ENABLED', True)
+        self.max_age = app.config.get('PLATFORM_METRICS_MAX_AGE', 300)
+        self.loaded_at = None
+
+    def _stale(self):
+        return (self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+                or self.today != datetime.utcnow().date())
+
+    def reconcile(self):
+        """Recount everything from the database"""
+        today = datetime.utcnow().date()
+        start = datetime.combine(today, datetime.min.time())
+        businesses = db.session.execute(select(
+            func.count(),
+            func.sum(case((Business.is_active == True, 1), else_=0)),
+            func.sum(case((Business.is_approved == True, 1), else_=0)),
+            func.sum(case((Business.created_at >= start, 1), else_=0))
+        )).one()
+        users = db.session.execute(select(
+            func.count(), func.sum(case((User.created_at >= start, 1), else_=0))
+        )).one()
+        completed = Payment.payment_status == 'completed'
+        total_revenue = db.session.execute(select(func.sum(Payment.amount)).where(completed)).scalar()
+        day = func.date(Payment.created_at)
+        revenue = {}
+        for paid_on, amount in db.session.execute(
+                select(day, func.sum(Payment.amount))
+                .where(completed, Payment.created_at >= start - timedelta(days=REVENUE_DAYS - 1))
+                .group_by(day)):
+            paid_on = paid_on if not isinstance(paid_on, str) else datetime.strptime(paid_on, '%Y-%m-%d').date()
+            revenue[paid_on] = amount or 0
+        with self.lock:
+            self.today = today
+            self.counts = {
+                'total_businesses': businesses[0],
+                'active_businesses': businesses[1] or 0,
+                'approved_businesses': businesses[2] or 0,
+                'businesses_added_today': businesses[3] or 0,
+                'total_users': users[0],
+                'users_registered_today': users[1] or 0,
+                'total_revenue': total_revenue or 0
+            }
+            self.daily_revenue = revenue
+            self.loaded_at = time.monotonic()
+
+    def snapshot(self):
+        """Current metrics, at most PLATFORM_METRICS_MAX_AGE seconds behind other processes"""
+        if not self.enabled or self._stale():
+            self.reconcile()
+        with self.lock:
+            metrics = dict(self.counts)
+            oldest = self.today - timedelta(days=REVENUE_DAYS - 1)
+            metrics['monthly_revenue'] = sum(amount for day, amount in self.daily_revenue.items() if day >= oldest)
+        return metrics
+
+    def _add(self, name, amount):
+        self.counts[name] += amount
+
+    def apply(self, model, model_changes):
+        if not self.enabled or self.loaded_at is None:
+            return
+        with self.lock:
+            for change in model_changes:
+                old, new = change.old, change.new
+                if model is Business:
+                    self._add('total_businesses', (new is not None) - (old is not None))
+                    self._add('active_businesses', _flag(new, 'is_active') - _flag(old, 'is_active'))
+                    self._add('approved_businesses', _flag(new, 'is_approved') - _flag(old, 'is_approved'))
+                    self._add('businesses_added_today', self._today(new) - self._today(old))
+                elif model is User:
+                    self._add('total_users', (new is not None) - (old is not None))
+                    self._add('users_registered_today', self._today(new) - self._today(old))
+                else:
+                    for fields, sign in ((old, -1), (new, 1)):
+                        if fields and fields.get('payment_status') == 'completed':
+                            amount = (fields.get('amount') or 0) * sign
+                            self._add('total_revenue', amount)
+                            day = _day(fields.get('created_at'))
+                            if day is not None:
+                                self.daily_revenue[day] = self.daily_revenue.get(day, 0) + amount
+
+    def _today(self, fields):
+        return 1 if fields and _day(fields.get('created_at')) == self.today else 0
+
+
+platform_metrics = PlatformMetrics()
+
+
+@changes.on_change(Business)
+def _count_businesses(business_changes):
+    platform_metrics.apply(Business, business_changes)
+
+
+@changes.on_change(User)
+def _count_users(user_changes):
+    platform_metrics.apply(User, user_changes)
+
+
+@changes.on_change(Payment)
+def _count_payments(payment_changes):
+    platform_metrics.apply(Payment, payment_changes)
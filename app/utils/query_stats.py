@@ -0,0 +1,145 @@
+import functools
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.utils.agent_metrics import agent_metrics, outcome_of, task_label
+
+logger = logging.getLogger(__name__)
+
+# Collectors active in the current request/task; nested ones (a task run
+# inside a request) all see the query
+_active = ContextVar('query_stats', default=())
+
+_IN_LIST = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """SQL with IN-lists collapsed, so the same query with other ids matches"""
+    return _SPACES.sub(' ', _IN_LIST.sub('(?)', statement)).strip()
+
+
+class QueryStats:
+    """Queries, DB time and repeated statement shapes for one unit of work"""
+
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold):
+        """[(shape, count)] run at least threshold times: likely N+1 loads"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def report(self, threshold):
+        repeated = self.repeated(threshold)
+        logger.log(logging.WARNING if repeated else logging.DEBUG,
+                   '%s: %d queries, %.1f ms in the database', self.label, self.count, self.seconds * 1000)
+        for shape, count in repeated:
+            logger.warning('Possible N+1 in %s: %d x %s', self.label, count, shape[:300])
+
+
+@contextmanager
+def collect(label):
+    """Count the queries run inside the block"""
+    stats = QueryStats(label)
+    token = _active.set(_active.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    if _active.get():
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    collectors = _active.get()
+    if not collectors or not conn.info.get('query_started'):
+        return
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    for stats in collectors:
+        stats.add(statement, elapsed)
+
+
+def instrument_task(process_task):
+    """Decorator for agents' process_task: logs the queries each task runs
+    and records its latency, DB time and outcome in agent_metrics
+    """
+    @functools.wraps(process_task)
+    def wrapper(self, task_data, *args, **kwargs):
+        if not query_stats.enabled and not agent_metrics.enabled:
+            return process_task(self, task_data, *args, **kwargs)
+        started = time.perf_counter()
+        outcome = 'exception'
+        with collect(f"{self.name} {task_data.get('task', '')}") as stats:
+            try:
+                result = process_task(self, task_data, *args, **kwargs)
+                outcome = outcome_of(result)
+                return result
+            finally:
+                agent_metrics.observe(type(self).__name__.lower(), task_label(self, task_data),
+                                      time.perf_counter() - started, stats.seconds, outcome)
+                if query_stats.enabled:
+                    stats.report(query_stats.threshold)
+    return wrapper
+
+
+class QueryStatsExtension:
+    """Per-request query counts, logged and (in debug) sent as X-DB-* headers"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.threshold = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('QUERY_STATS_ENABLED', True)
+        self.threshold = app.config.get('QUERY_N_PLUS_ONE_THRESHOLD', 5)
+        self.headers = app.config.get('QUERY_STATS_HEADERS', app.debug)
+        if not self.enabled:
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    def _start(self):
+        context = collect(f'{request.method} {request.path}')
+        g.query_stats = context.__enter__()
+        g.query_stats_context = context
+
+    def _finish(self, response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+        stats.report(self.threshold)
+        if self.headers or current_app.debug:
+            response.headers['X-DB-Query-Count'] = str(stats.count)
+            response.headers['X-DB-Time-Ms'] = f'{stats.seconds * 1000:.1f}'
+            response.headers['X-DB-Repeated-Queries'] = str(len(stats.repeated(self.threshold)))
+        return response
+
+    def _teardown(self, exc):
+        context = g.pop('query_stats_context', None)
+        if context is not None:
+            context.__exit__(None, None, None)
+
+
+query_stats = QueryStatsExtension()
@@ -0,0 +1,164 @@
+import math
+from datetime import datetime
+from sqlalchemy import bindparam, event, inspect, select
+from app import db
+from app.models import Business
+from app.utils import changes
+from config import Config
+
+# Signals that feed a listing's rank_score
+SIGNAL_FIELDS = ('is_featured', 'subscription_tier', 'is_verified')
+ENGAGEMENT_WEIGHTS = {'views': 1, 'clicks': 3, 'shares': 5}
+RANK_FIELDS = SIGNAL_FIELDS + tuple(ENGAGEMENT_WEIGHTS)
+
+# Subscription tiers ranked from cheapest to most expensive plan
+TIER_RANK = {
+    code: rank for rank, code in enumerate(
+        sorted(Config.SUBSCRIPTION_PLANS, key=lambda code: Config.SUBSCRIPTION_PLANS[code]['price'])
+    )
+}
+
+# Scores are in log2 units of popularity: a boost is worth as much as
+# 2**FEATURED_WEIGHT times the recent engagement, each tier step 2**TIER_WEIGHT
+FEATURED_WEIGHT = 6.0
+TIER_WEIGHT = 1.0
+VERIFIED_WEIGHT = 1.0
+# How much a perfect text or distance match adds on search pages
+RELEVANCE_WEIGHT = 8.0
+
+EPOCH = datetime(2024, 1, 1)
+
+changes.track(Business, RANK_FIELDS)
+
+
+def log2_add(a, b):
+    """log2(2**a + 2**b) without overflow"""
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def engagement(fields):
+    return sum((fields.get(name) or 0) * weight for name, weight in ENGAGEMENT_WEIGHTS.items())
+
+
+class RankingEngine:
+    """Materialized rank_score per listing
+
+    Popularity decays with a half-life without rewriting old rows: an
+    interaction at time t is worth 2**(t / half_life), kept in log2 space
+    as Business.popularity. Comparing those sums compares decayed
+    popularity exactly, so scores stay consistent between batch runs.
+    """
+
+    def __init__(self, app=None):
+        self.half_life_days = 14
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.half_life_days = app.config.get('RANKING_HALF_LIFE_DAYS', 14)
+
+    def clock(self, when=None):
+        """Half-lives elapsed since EPOCH"""
+        elapsed = ((when or datetime.utcnow()) - EPOCH).total_seconds()
+        return elapsed / (self.half_life_days * 86400)
+
+    def add_engagement(self, popularity, amount, when=None):
+        if amount <= 0:
+            return popularity
+        return log2_add(popularity, math.log2(amount) + self.clock(when))
+
+    def initial_popularity(self, fields):
+        # A new listing counts as one interaction when it is created, so it
+        # gets a fresh start; existing engagement is credited to that moment
+        return math.log2(1 + engagement(fields)) + self.clock(fields.get('created_at'))
+
+    def score(self, fields, popularity):
+        tier = TIER_RANK.get(fields.get('subscription_tier') or 'free', 0)
+        return (FEATURED_WEIGHT * bool(fields.get('is_featured'))
+                + TIER_WEIGHT * tier
+                + VERIFIED_WEIGHT * bool(fields.get('is_verified'))
+                + popularity)
+
+    def engagement_updates(self, conn, counts):
+        """New popularity and rank_score for listings gaining counts
+
+        counts maps business id -> {'views': n, 'clicks': n, 'shares': n}.
+        Returns [{'business_id', 'new_popularity', 'new_score'}] for the
+        listings that exist.
+        """
+        rows = conn.execute(
+            select(Business.id, Business.created_at, Business.popularity,
+                   *[getattr(Business, name) for name in RANK_FIELDS])
+            .where(Business.id.in_(counts))
+        ).all()
+        updates = []
+        for row in rows:
+            fields = row._asdict()
+            popularity = fields['popularity']
+            if popularity is None:
+                popularity = self.initial_popularity(fields)
+            popularity = self.add_engagement(popularity, engagement(counts[row.id]))
+            updates.append({'business_id': row.id, 'new_popularity': popularity,
+                            'new_score': self.score(fields, popularity)})
+        return updates
+
+    def recompute(self, chunk_size=1000):
+        """Rescore every listing; returns how many scores changed"""
+        columns = [Business.id, Business.created_at, Business.popularity, Business.rank_score] + \
+            [getattr(Business, name) for name in RANK_FIELDS]
+        statement = Business.__table__.update() \
+            .where(Business.id == bindparam('business_id')) \
+            .values(popularity=bindparam('new_popularity'), rank_score=bindparam('new_score'),
+                    updated_at=Business.updated_at)
+        changed, last_id = 0, 0
+        with db.engine.begin() as conn:
+            while True:
+                # Keyset chunks, so no cursor stays open across the writes
+                chunk = conn.execute(
+                    select(*columns).where(Business.id > last_id).order_by(Business.id).limit(chunk_size)
+                ).all()
+                if not chunk:
+                    break
+                last_id = chunk[-1].id
+                batch = []
+                for row in chunk:
+                    fields = row._asdict()
+                    popularity = fields['popularity']
+                    if popularity is None:
+                        popularity = self.initial_popularity(fields)
+                    score = self.score(fields, popularity)
+                    if fields['popularity'] is None or fields['rank_score'] is None \
+                            or abs(fields['rank_score'] - score) > 1e-9:
+                        batch.append({'business_id': row.id, 'new_popularity': popularity,
+                                      'new_score': score})
+                if batch:
+                    conn.execute(statement, batch)
+                    changed += len(batch)
+        return changed
+
+
+ranking = RankingEngine()
+
+
+@event.listens_for(Business, 'before_insert')
+@event.listens_for(Business, 'before_update')
+def update_rank_score(mapper, connection, business):
+    """Rescore a listing in the same flush that changes its signals"""
+    state = inspect(business)
+    fields = {name: getattr(business, name) for name in RANK_FIELDS}
+    if business.popularity is None or state.key is None:
+        fields['created_at'] = business.created_at
+        business.popularity = ranking.initial_popularity(fields)
+    else:
+        if not any(state.attrs[name].history.has_changes() for name in RANK_FIELDS):
+            return
+        gained = 0
+        for name, weight in ENGAGEMENT_WEIGHTS.items():
+            history = state.attrs[name].history
+            if history.added and history.deleted:
+                gained += ((history.added[0] or 0) - (history.deleted[0] or 0)) * weight
+        business.popularity = ranking.add_engagement(business.popularity, gained)
+    business.rank_score = ranking.score(fields, business.popularity)
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.models import SubscriptionPlan, Town
+from app.utils import changes
+from config import Config
+
+TOWN_FIELDS = ('id', 'name', 'region', 'description', 'latitude', 'longitude', 'updated_at')
+PLAN_FIELDS = ('id', 'name', 'code', 'price', 'duration_days', 'features', 'is_active')
+
+TownInfo = namedtuple('TownInfo', TOWN_FIELDS)
+PlanInfo = namedtuple('PlanInfo', PLAN_FIELDS)
+
+# An immutable view of the reference tables; version increases on every reload
+Snapshot = namedtuple('Snapshot', ['version', 'towns', 'towns_by_name', 'plans',
+                                   'plans_by_code', 'plans_by_id'])
+
+changes.track(Town, TOWN_FIELDS[1:6])
+changes.track(SubscriptionPlan, PLAN_FIELDS[1:])
+
+
+def configured_plans():
+    """Plans as defined in Config.SUBSCRIPTION_PLANS, cheapest first"""
+    plans = [PlanInfo(None, settings['name'], code, settings['price'], settings['duration_days'],
+                      ', '.join(settings['features']), True)
+             for code, settings in Config.SUBSCRIPTION_PLANS.items()]
+    return sorted(plans, key=lambda plan: plan.price)
+
+
+class ReferenceRegistry:
+    """Towns and subscription plans, loaded once per process
+
+    Readers get an immutable Snapshot. Commits that touch either table
+    drop it at once; writes from other processes (e.g. flask init-db) are
+    noticed by a cheap row count/updated_at check every few seconds.
+    """
+
+    def __init__(self, app=None):
+        self.snapshot = None
+        self.version = 0
+        self.watermark = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.check_seconds = app.config.get('REFERENCE_CHECK_SECONDS', 30)
+        self.snapshot = None
+
+    def _watermark(self, conn):
+        return tuple(conn.execute(select(func.count(), func.max(model.updated_at))).one()
+                     for model in (Town, SubscriptionPlan))
+
+    def load(self):
+        with db.engine.connect() as conn:
+            watermark = self._watermark(conn)
+            towns = tuple(TownInfo(*row) for row in conn.execute(
+                select(*[getattr(Town, f) for f in TOWN_FIELDS]).order_by(Town.name)))
+            plans = tuple(PlanInfo(*row) for row in conn.execute(
+                select(*[getattr(SubscriptionPlan, f) for f in PLAN_FIELDS])
+                .order_by(SubscriptionPlan.price, SubscriptionPlan.id)))
+        if not plans:
+            # Not seeded yet (flask init-db); the configured plans still apply
+            plans = tuple(configured_plans())
+        self.version += 1
+        self.snapshot = Snapshot(
+            self.version, towns,
+            MappingProxyType({town.name: town for town in towns}),
+            plans,
+            MappingProxyType({plan.code: plan for plan in plans}),
+            MappingProxyType({plan.id: plan for plan in plans if plan.id is not None})
+        )
+        self.watermark, self.checked_at = watermark, time.monotonic()
+
+    def _changed_elsewhere(self):
+        self.checked_at = time.monotonic()
+        try:
+            with db.engine.connect() as conn:
+                return self._watermark(conn) != self.watermark
+        except SQLAlchemyError:
+            return False
+
+    def current(self):
+        """The latest Snapshot"""
+        snapshot = self.snapshot
+        if snapshot is not None and time.monotonic() - self.checked_at > self.check_seconds \
+                and self._changed_elsewhere():
+            snapshot = self.snapshot = None
+        if snapshot is None:
+            with self.lock:
+                if self.snapshot is None:
+                    self.load()
+                snapshot = self.snapshot
+        return snapshot
+
+    def invalidate(self):
+        self.snapshot = None
+
+    @property
+    def towns(self):
+        return self.current().towns
+
+    def town(self, name):
+        return self.current().towns_by_name.get(name)
+
+    def active_plans(self):
+        return [plan for plan in self.current().plans if plan.is_active]
+
+    def plan(self, code=None, plan_id=None):
+        snapshot = self.current()
+        if plan_id is not None:
+            return snapshot.plans_by_id.get(plan_id)
+        return snapshot.plans_by_code.get(code)
+
+
+reference_data = ReferenceRegistry()
+
+
+@changes.on_change(Town)
+@changes.on_change(SubscriptionPlan)
+def _invalidate_reference_data(reference_changes):
+    reference_data.invalidate()
@@ -0,0 +1,212 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from app import db
+from app.models import Business, Payment, User
+from app.utils.startup import lazy_import
+
+# Only processes that build a report pay for importing pandas
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+REPORT_TYPES = ('weekly', 'monthly')
+TOP_N = 5
+
+
+def period_bounds(report_type, day=None):
+    """(previous start, start, end) of the last complete week or month before day"""
+    day = day or datetime.utcnow().date()
+    if report_type == 'weekly':
+        end = day - timedelta(days=day.weekday())
+        start = end - timedelta(days=7)
+        previous = start - timedelta(days=7)
+    elif report_type == 'monthly':
+        end = day.replace(day=1)
+        start = (end - timedelta(days=1)).replace(day=1)
+        previous = (start - timedelta(days=1)).replace(day=1)
+    else:
+        raise ValueError(f'Unknown report type {report_type!r}')
+    return tuple(datetime.combine(d, datetime.min.time()) for d in (previous, start, end))
+
+
+def read_frame(statement, columns, chunk_size):
+    """Rows of a query as a DataFrame, fetched in chunks from a server-side cursor"""
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(statement)
+        chunks = [pd.DataFrame.from_records(rows, columns=columns) for rows in result.partitions()]
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def growth(current, previous):
+    return round((current - previous) / previous * 100, 1) if previous else None
+
+
+def top(series, n=TOP_N):
+    return [{'name': name, 'count': int(count)} for name, count in series.value_counts().head(n).items()]
+
+
+def _trend(label, change, period):
+    if change is None:
+        return None
+    return f"{label} {'up' if change >= 0 else 'down'} {abs(change):.1f}% compared to the previous {period}"
+
+
+def build_report(report_type, day=None, chunk_size=5000):
+    """Weekly or monthly platform report from the database, computed with pandas"""
+    previous, start, end = period_bounds(report_type, day)
+    period = 'week' if report_type == 'weekly' else 'month'
+
+    # One streamed query per table covers this period and the previous one
+    payments = read_frame(
+        select(Payment.created_at, Payment.amount, Payment.payment_type, Payment.user_id,
+               func.coalesce(Business.subscription_tier, 'none'))
+        .outerjoin(Business, Business.id == Payment.item_id)
+        .where(Payment.payment_status == 'completed', Payment.created_at >= previous, Payment.created_at < end),
+        ['created_at', 'amount', 'payment_type', 'user_id', 'tier'], chunk_size)
+    businesses = read_frame(
+        select(Business.created_at, Business.category, Business.town)
+        .where(Business.created_at >= previous, Business.created_at < end),
+        ['created_at', 'category', 'town'], chunk_size)
+    users = read_frame(
+        select(User.created_at).where(User.created_at >= previous, User.created_at < end),
+        ['created_at'], chunk_size)
+    earlier_users = db.session.execute(select(func.count()).where(User.created_at < previous)).scalar()
+
+    current_payments = payments[pd.to_datetime(payments['created_at']) >= start]
+    revenue = float(current_payments['amount'].sum())
+    previous_revenue = float(payments['amount'].sum()) - revenue
+    current_businesses = businesses[pd.to_datetime(businesses['created_at']) >= start]
+    new_businesses = len(current_businesses)
+    user_created = pd.to_datetime(users['created_at'])
+    new_users = int((user_created >= start).sum())
+    previous_users = int(((user_created >= previous) & (user_created < start)).sum())
+    total_users = earlier_users + len(users)
+    paying_users = int(current_payments['user_id'].nunique())
+
+    by_tier = current_payments.groupby('tier')['amount'].sum().sort_values(ascending=False)
+    by_type = current_payments.groupby(current_payments['payment_type'].fillna('other'))['amount'].sum() \
+        .sort_values(ascending=False)
+    daily = current_payments.groupby(pd.to_datetime(current_payments['created_at']).dt.date)['amount'].sum()
+    top_categories = top(current_businesses['category'])
+    top_towns = top(current_businesses['town'])
+
+    revenue_growth = growth(revenue, previous_revenue)
+    business_growth = growth(new_businesses, len(businesses) - new_businesses)
+    user_growth = growth(new_users, previous_users)
+    insights = [
+        _trend('Revenue', revenue_growth, period),
+        _trend('New listings', business_growth, period),
+        _trend('User registrations', user_growth, period),
+        f"Most popular category: {top_categories[0]['name']}" if top_categories else None,
+        f"Top town for new listings: {top_towns[0]['name']}" if top_towns else None,
+        f"Highest-earning tier: {by_tier.index[0]} (R{by_tier.iloc[0]:.2f})" if len(by_tier) else None
+    ]
+
+    return {
+        "status": "success",
+        "report_type": report_type,
+        "date": datetime.utcnow().date().isoformat(),
+        "period_start": start.date().isoformat(),
+        "period_end": (end - timedelta(days=1)).date().isoformat(),
+        "metrics": {
+            "new_businesses": new_businesses,
+            "new_users": new_users,
+            "total_users": total_users,
+            "revenue": round(revenue, 2),
+            "previous_revenue": round(previous_revenue, 2),
+            "revenue_growth": revenue_growth,
+            "business_growth": business_growth,
+            "user_growth": user_growth,
+            "payments": len(current_payments),
+            "paying_users": paying_users,
+            "average_revenue_per_user": round(revenue / total_users, 2) if total_users else 0,
+            "average_revenue_per_paying_user": round(revenue / paying_users, 2) if paying_users else 0,
+            "revenue_by_tier": {tier: round(float(amount), 2) for tier, amount in by_tier.items()},
+            "revenue_by_type": {kind: round(float(amount), 2) for kind, amount in by_type.items()},
+            "daily_revenue": {day.isoformat(): round(float(amount), 2) for day, amount in daily.items()},
+            "top_categories": top_categories,
+            "top_towns": top_towns
+        },
+        "insights": [insight for insight in insights if insight]
+    }
+
+
+class ReportBuilder:
+    """Reports built on a background thread and cached per period
+
+    A finished week or month does not change, so a report is built once
+    per period (and again after REPORTS_CACHE_SECONDS, to pick up late
+    refunds); callers that do not wait get a pending status meanwhile.
+    """
+
+    def __init__(self, app=None):
+        self.cache = OrderedDict()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.cache_seconds = app.config.get('REPORTS_CACHE_SECONDS', 3600)
+        self.max_entries = app.config.get('REPORTS_MAX_ENTRIES', 24)
+        self.chunk_size = app.config.get('REPORTS_CHUNK_SIZE', 5000)
+        self.cache.clear()
+        self.jobs.clear()
+
+    def _executor(self):
+        # Threads do not survive a fork, so each worker process gets its own
+        if self.executor is None or self.pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reports')
+            self.pid = os.getpid()
+            self.jobs.clear()
+        return self.executor
+
+    def _build(self, key, report_type, day):
+        try:
+            with self.app.app_context():
+                report = build_report(report_type, day, self.chunk_size)
+            with self.lock:
+                self.cache[key] = (time.monotonic(), report)
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+            return report
+        except Exception:
+            logger.exception('Building the %s report failed', report_type)
+            raise
+        finally:
+            with self.lock:
+                self.jobs.pop(key, None)
+
+    def get(self, report_type, day=None, wait=False):
+        """The report for the last complete period before day; builds it in the background if needed"""
+        key = (report_type, period_bounds(report_type, day)[1])
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < self.cache_seconds:
+                return cached[1]
+            job = self.jobs.get(key)
+            if job is None:
+                job = self._executor().submit(self._build, key, report_type, day)
+                self.jobs[key] = job
+        if wait:
+            return job.result()
+        if cached is not None:
+            # Serve the previous build while the refresh runs
+            return cached[1]
+        return {"status": "pending", "report_type": report_type,
+                "period_start": key[1].date().isoformat()}
+
+
+reports = ReportBuilder()
@@ -0,0 +1,382 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import JobRun, ScheduledJob
+from app.utils import changes
+
+logger = logging.getLogger(__name__)
+
+# (lowest, highest) value of each cron field
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+MAX_DUE = 10000  # occurrences looked at when catching up
+
+
+def _parse_field(text, lowest, highest):
+    values = set()
+    for part in text.split(','):
+        spec, _, step = part.partition('/')
+        if spec == '*':
+            start, end = lowest, highest
+        elif '-' in spec:
+            start, end = (int(value) for value in spec.split('-', 1))
+        else:
+            start = int(spec)
+            end = highest if step else start
+        step = int(step) if step else 1
+        if not lowest <= start <= end <= highest or step < 1:
+            raise ValueError(f'{part!r} is out of range {lowest}-{highest}')
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+class Cron:
+    """A five-field cron schedule (minute hour day-of-month month day-of-week), in UTC
+
+    Fields take *, numbers, a-b ranges, lists and /steps; Sunday is 0 (or
+    7). As in cron, a day matches either day field when both are set.
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Expected 5 cron fields in {expression!r}')
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(field, lowest, highest) for field, (lowest, highest) in zip(fields, CRON_FIELDS))
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        in_days = day.day in self.days
+        in_weekdays = (day.isoweekday() % 7) in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, moment):
+        """First matching minute strictly after moment"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = moment.date()
+        for _ in range(366 * 8):
+            if self._day_matches(day):
+                same_day = day == moment.date()
+                for hour in self.hours:
+                    if same_day and hour < moment.hour:
+                        continue
+                    for minute in self.minutes:
+                        if same_day and hour == moment.hour and minute < moment.minute:
+                            continue
+                        return datetime(day.year, day.month, day.day, hour, minute)
+            day += timedelta(days=1)
+        raise ValueError(f'{self.expression!r} never matches')
+
+
+class JobRunContext:
+    """What a job gets: the occurrence it runs for, its time budget and progress
+
+    A job processes its work in chunks of chunk_size while time_left()
+    allows; if it stops with work left it sets `more` and keeps its
+    position in `cursor`, and the scheduler resumes the same occurrence
+    (with that cursor) on its next pass.
+    """
+
+    def __init__(self, job, scheduled_for, previous, cursor, max_seconds, chunk_size):
+        self.job = job
+        self.scheduled_for = scheduled_for
+        self.previous = previous  # the last occurrence completed, or None
+        self.cursor = cursor
+        self.chunk_size = chunk_size
+        self.deadline = time.monotonic() + max_seconds
+        self.items = 0
+        self.more = False
+
+    def time_left(self):
+        return self.deadline - time.monotonic() > 0
+
+
+class Job:
+    def __init__(self, name, schedule, func, catch_up, max_seconds):
+        self.name = name
+        self.schedule = Cron(schedule)
+        self.func = func
+        self.catch_up = catch_up
+        self.max_seconds = max_seconds
+
+
+class Scheduler:
+    """Runs periodic jobs on cron schedules in whichever process gets there first
+
+    Each app process runs a scheduler thread (started by its first
+    request, or in the foreground by `flask scheduler`). Every
+    SCHEDULER_TICK_SECONDS it looks for due jobs; a job runs only in the
+    process holding its lock row in scheduled_jobs, so one process runs
+    each occurrence however many are up. After downtime a job runs the
+    latest catch_up missed occurrences, oldest first, and skips the rest.
+    Each run is recorded in job_runs with its status, items and duration.
+    """
+
+    def __init__(self, app=None):
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('SCHEDULER_ENABLED', True)
+        self.tick_seconds = app.config.get('SCHEDULER_TICK_SECONDS', 30)
+        self.chunk_size = app.config.get('SCHEDULER_CHUNK_SIZE', 200)
+        self.history_days = app.config.get('SCHEDULER_HISTORY_DAYS', 30)
+        self.thread = None
+        self.pid = None
+        self.pruned_at = 0
+        if self.enabled:
+            app.before_request(self._ensure_thread)
+
+    def job(self, name, schedule, catch_up=1, max_seconds=60):
+        """Decorator registering func(run) as a job on a cron schedule"""
+        def decorator(func):
+            self.jobs[name] = Job(name, schedule, func, catch_up, max_seconds)
+            return func
+        return decorator
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each worker process starts its own
+        if self.pid == os.getpid() and self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid != os.getpid() or self.thread is None or not self.thread.is_alive():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run_forever, name='scheduler', daemon=True)
+                self.thread.start()
+
+    def run_forever(self, stop=None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception('Scheduler pass failed')
+            stop.wait(self.tick_seconds)
+
+    def run_pending(self):
+        """Run every job that is due (one occurrence each); returns a summary of each run"""
+        runs = []
+        with self.app.app_context():
+            try:
+                states = {state.name: state for state in ScheduledJob.query}
+                now = datetime.utcnow()
+                for job in self.jobs.values():
+                    state = states.get(job.name) or self._register(job, now)
+                    if state is not None and state.next_run_at <= now:
+                        run = self._run_due(job, now)
+                        if run is not None:
+                            runs.append(run)
+                if time.monotonic() - self.pruned_at > 3600:
+                    self.pruned_at = time.monotonic()
+                    db.session.execute(delete(JobRun).where(
+                        JobRun.started_at < now - timedelta(days=self.history_days)))
+                    db.session.commit()
+            finally:
+                db.session.remove()
+        return runs
+
+    def _register(self, job, now):
+        # A new job starts with its next occurrence; nothing before it is "missed"
+        try:
+            db.session.add(ScheduledJob(name=job.name, next_run_at=job.schedule.next_after(now)))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+        return None
+
+    def _acquire(self, job, owner, now):
+        result = db.session.execute(
+            update(ScheduledJob)
+            .where(ScheduledJob.name == job.name,
+                   or_(ScheduledJob.lock_owner.is_(None), ScheduledJob.lock_expires_at < now,
+                       ScheduledJob.lock_owner == owner))
+            .values(lock_owner=owner, lock_expires_at=now + timedelta(seconds=job.max_seconds * 2 + 60)))
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _run_due(self, job, now):
+        owner = f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+        if not self._acquire(job, owner, now):
+            return None
+        try:
+            state = ScheduledJob.query.filter_by(name=job.name).populate_existing().one()
+            if state.next_run_at > now:
+                return None  # another process ran it meanwhile
+            cursor = json.loads(state.cursor) if state.cursor else None
+            if cursor is None:
+                # Catch up on at most the last catch_up missed occurrences
+                due = [state.next_run_at]
+                while len(due) < MAX_DUE:
+                    following = job.schedule.next_after(due[-1])
+                    if following > now:
+                        break
+                    due.append(following)
+                if len(due) > job.catch_up:
+                    logger.warning('Job %s skipped %d missed runs before %s',
+                                   job.name, len(due) - job.catch_up, due[-job.catch_up])
+                    state.next_run_at = due[-job.catch_up]
+            return self._execute(job, state, cursor, owner)
+        finally:
+            db.session.execute(update(ScheduledJob)
+                               .where(ScheduledJob.name == job.name, ScheduledJob.lock_owner == owner)
+                               .values(lock_owner=None, lock_expires_at=None))
+            db.session.commit()
+
+    def _execute(self, job, state, cursor, owner):
+        scheduled_for = state.next_run_at
+        record = JobRun(job=job.name, scheduled_for=scheduled_for, started_at=datetime.utcnow(), worker=owner)
+        db.session.add(record)
+        db.session.commit()
+        run_id = record.id
+
+        run = JobRunContext(job.name, scheduled_for, state.last_scheduled_for, cursor,
+                            job.max_seconds, self.chunk_size)
+        started = time.perf_counter()
+        result, error = None, None
+        try:
+            result = job.func(run)
+            status = 'partial' if run.more else 'done'
+        except Exception as exc:
+            logger.exception('Job %s for %s failed', job.name, scheduled_for)
+            db.session.rollback()
+            status, error = 'failed', repr(exc)
+
+        state = ScheduledJob.query.filter_by(name=job.name).one()
+        if status == 'partial':
+            state.cursor = json.dumps(run.cursor if run.cursor is not None else {}, default=str)
+        else:
+            # A failed occurrence is not retried; the next one runs on schedule
+            state.cursor = None
+            state.next_run_at = job.schedule.next_after(scheduled_for)
+            if status == 'done':
+                state.last_scheduled_for = scheduled_for
+        summary = {'job': job.name, 'scheduled_for': scheduled_for, 'status': status, 'items': run.items,
+                   'duration_seconds': round(time.perf_counter() - started, 3), 'error': error}
+        record = db.session.get(JobRun, run_id)
+        record.status = status
+        record.items = run.items
+        record.error = error
+        record.result = json.dumps(result, default=str) if result is not None else None
+        record.finished_at = datetime.utcnow()
+        record.duration_seconds = summary['duration_seconds']
+        db.session.commit()
+        logger.info('Job %s for %s: %s, %d items in %.2fs', job.name, scheduled_for, status,
+                    run.items, summary['duration_seconds'])
+        return summary
+
+    def status(self):
+        """[(job, schedule, state row or None, latest run or None)] for every job"""
+        states = {state.name: state for state in ScheduledJob.query}
+        rows = []
+        for name, job in sorted(self.jobs.items()):
+            latest = JobRun.query.filter_by(job=name).order_by(JobRun.id.desc()).first()
+            rows.append((job, states.get(name), latest))
+        return rows
+
+
+scheduler = Scheduler()
+
+
+@scheduler.job('boost_expiry', '*/15 * * * *', max_seconds=120)
+def expire_boosts(run):
+    """Unfeature listings whose paid boost has ended"""
+    from app.utils.agents import agents
+    expired = []
+    while run.time_left():
+        result = agents.dispatch('accountant', {'task': 'expire_boosts', 'limit': run.chunk_size,
+                                                'now': run.scheduled_for.isoformat()})
+        expired += result['business_ids']
+        run.items += result['expired']
+        if result['expired'] < run.chunk_size:
+            return {'expired': expired}
+    run.more = True
+    return {'expired': expired}
+
+
+@scheduler.job('subscription_renewals', '0 8 * * *', max_seconds=300)
+def remind_renewals(run):
+    """Remind owners whose paid subscription expires within 3 days, once each
+
+    Each day covers the subscriptions that came within 3 days of expiry
+    since the previous completed run; listings record the expiry they were
+    reminded of, so a day a failed run covered again is not reminded twice.
+    """
+    from app.utils.agents import agents
+    window_end = run.scheduled_for + timedelta(days=3)
+    window_start = (run.previous or run.scheduled_for - timedelta(days=1)) + timedelta(days=3)
+    cursor = run.cursor or {'after_id': 0}
+    while run.time_left():
+        result = agents.dispatch('accountant', {
+            'task': 'subscription_renewal', 'expiring_after': window_start.isoformat(),
+            'expiring_before': window_end.isoformat(), 'after_id': cursor['after_id'], 'limit': run.chunk_size})
+        run.items += result['reminded']
+        if result['reminded'] < run.chunk_size:
+            return {'reminded': run.items}
+        cursor['after_id'] = result['last_id']
+    run.cursor = cursor
+    run.more = True
+    return {'reminded': run.items}
+
+
+@scheduler.job('daily_report', '15 0 * * *')
+def daily_report(run):
+    """The Analyst's daily report, kept in the run history"""
+    from app.utils.agents import agents
+    report = agents.dispatch('analyst', {'task': 'generate_report', 'report_type': 'daily'})
+    run.items = 1
+    return report
+
+
+@scheduler.job('weekly_report', '30 0 * * 1', catch_up=4, max_seconds=600)
+def weekly_report(run):
+    """Last week's report, built ahead of the first request for it"""
+    from app.utils.reports import reports
+    report = reports.get('weekly', day=run.scheduled_for.date(), wait=True)
+    run.items = 1
+    return report
+
+
+@scheduler.job('monthly_report', '45 0 1 * *', catch_up=3, max_seconds=600)
+def monthly_report(run):
+    """Last month's report, built ahead of the first request for it"""
+    from app.utils.reports import reports
+    report = reports.get('monthly', day=run.scheduled_for.date(), wait=True)
+    run.items = 1
+    return report
+
+
+@scheduler.job('tombstone_prune', '30 3 * * *')
+def prune_tombstones(run):
+    """Forget deleted rows older than changes.TOMBSTONE_DAYS; indexes synced before then reload"""
+    run.items = changes.prune_tombstones(run.scheduled_for - timedelta(days=changes.TOMBSTONE_DAYS))
+    return {'pruned': run.items}
+
+
+@scheduler.job('peer_stats_rebuild', '0 4 * * *', max_seconds=600)
+def rebuild_peer_stats(run):
+    """Recompute peer statistics from the businesses table, correcting any drift"""
+    from app.utils.peers import peer_stats
+    if not peer_stats.enabled:
+        return None
+    run.items = peer_stats.rebuild()
+    return {'groups': run.items}
+
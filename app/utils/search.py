@@ -0,0 +1,390 @@
+import heapq
+import logging
+import math
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from datetime import datetime
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.models import Business
+from app.utils import changes
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FIELDS = ('name', 'description', 'category', 'town', 'tags')
+
+# Relative importance of each field when scoring a match
+FIELD_WEIGHTS = {
+    'name': 4.0,
+    'tags': 3.0,
+    'category': 2.0,
+    'town': 2.0,
+    'description': 1.0
+}
+
+# Fields searches can be filtered on, applied before the result limit
+FILTER_FIELDS = ('category', 'town')
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+changes.track(Business, SEARCH_FIELDS + ('is_approved',))
+changes.keep_tombstones(Business)
+
+
+def tokenize(value):
+    """Split text into lowercase, accent-free search tokens"""
+    if not value:
+        return []
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    return TOKEN_RE.findall(value.lower())
+
+
+def is_searchable(fields):
+    """Only approved listings are visible in search"""
+    return bool(fields and fields.get('is_approved'))
+
+
+def _in_filter(values, category, town):
+    doc_category, doc_town = values
+    return (not category or doc_category == category) and (not town or doc_town == town)
+
+
+class InvertedIndex:
+    """In-process tokenized inverted index with BM25 ranking"""
+
+    k1 = 1.2
+    b = 0.75
+    prefix_penalty = 0.8
+    max_expansions = 64
+
+    def __init__(self, field_weights=None):
+        self.field_weights = field_weights or FIELD_WEIGHTS
+        self.postings = {}
+        self.doc_terms = {}
+        self.doc_length = {}
+        self.doc_filters = {}
+        self.total_length = 0.0
+        self.vocabulary = []
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def add(self, doc_id, fields):
+        terms = {}
+        for field, weight in self.field_weights.items():
+            for token in tokenize(fields.get(field)):
+                terms[token] = terms.get(token, 0.0) + weight
+
+        with self.lock:
+            self._remove(doc_id)
+            for term, frequency in terms.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = {}
+                    insort(self.vocabulary, term)
+                postings[doc_id] = frequency
+            length = sum(terms.values())
+            self.doc_terms[doc_id] = terms
+            self.doc_length[doc_id] = length
+            self.doc_filters[doc_id] = tuple(fields.get(field) for field in FILTER_FIELDS)
+            self.total_length += length
+
+    def remove(self, doc_id):
+        with self.lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self.total_length -= self.doc_length.pop(doc_id)
+        del self.doc_filters[doc_id]
+        for term in terms:
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+                del self.vocabulary[bisect_left(self.vocabulary, term)]
+
+    def expand(self, prefix):
+        """Vocabulary terms starting with prefix, exact match first"""
+        start = bisect_left(self.vocabulary, prefix)
+        terms = []
+        for term in self.vocabulary[start:start + self.max_expansions]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def matches(self, query):
+        """Ids of every document matching query, unscored"""
+        tokens = tokenize(query)
+        if not tokens:
+            return set()
+        with self.lock:
+            ids = None
+            for token in tokens:
+                token_ids = set()
+                for term in self.expand(token):
+                    token_ids.update(self.postings[term])
+                ids = token_ids if ids is None else ids & token_ids
+                if not ids:
+                    break
+        return ids
+
+    def search(self, query, limit, category='', town=''):
+        """Top limit (doc_id, score) matches in category and town (blank for any); all if limit is None"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        with self.lock:
+            total_docs = len(self.doc_terms)
+            if not total_docs:
+                return []
+            average_length = self.total_length / total_docs
+
+            # Every query token must match (as a word or word prefix)
+            scores = None
+            for token in tokens:
+                token_scores = {}
+                for term in self.expand(token):
+                    postings = self.postings[term]
+                    frequency = len(postings)
+                    idf = math.log(1 + (total_docs - frequency + 0.5) / (frequency + 0.5))
+                    if term != token:
+                        idf *= self.prefix_penalty
+                    for doc_id, tf in postings.items():
+                        norm = self.k1 * (1 - self.b + self.b * self.doc_length[doc_id] / average_length)
+                        score = idf * tf * (self.k1 + 1) / (tf + norm)
+                        if score > token_scores.get(doc_id, 0.0):
+                            token_scores[doc_id] = score
+
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_id: scores[doc_id] + score
+                              for doc_id, score in token_scores.items() if doc_id in scores}
+                if not scores:
+                    return []
+
+            if category or town:
+                scores = {doc_id: score for doc_id, score in scores.items()
+                          if _in_filter(self.doc_filters[doc_id], category, town)}
+
+        if limit is None:
+            return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+class MemoryBackend:
+    name = 'memory'
+
+    def __init__(self):
+        self.index = InvertedIndex()
+        self.loaded = False
+        self.synced_at = None
+
+    def load(self):
+        index = InvertedIndex()
+        self.synced_at = datetime.utcnow()
+        columns = [getattr(Business, f) for f in SEARCH_FIELDS]
+        # Own connection: this may run from an after_commit hook where the
+        # request session cannot emit SQL
+        with db.engine.connect() as conn:
+            rows = conn.execution_options(yield_per=2000).execute(
+                select(Business.id, *columns).where(Business.is_approved == True)
+            )
+            for row in rows:
+                index.add(row[0], dict(zip(SEARCH_FIELDS, row[1:])))
+        self.index = index
+        self.loaded = True
+
+    def refresh(self):
+        # Pick up listings written by other worker processes since the last sync
+        since, self.synced_at = self.synced_at, datetime.utcnow()
+        columns = [getattr(Business, f) for f in SEARCH_FIELDS]
+        changed = changes.changed_since(Business, [Business.is_approved, *columns], since)
+        if changed is None:
+            return self.load()
+        rows, deleted = changed
+        for business_id in deleted:
+            self.index.remove(business_id)
+        for row in rows:
+            if row[1]:
+                self.index.add(row[0], dict(zip(SEARCH_FIELDS, row[2:])))
+            else:
+                self.index.remove(row[0])
+
+    def apply(self, business_changes):
+        if not self.loaded:
+            return
+        for change in business_changes:
+            if is_searchable(change.new):
+                self.index.add(change.id, change.new)
+            else:
+                self.index.remove(change.id)
+
+    def search(self, query, limit, category='', town=''):
+        return self.index.search(query, limit, category, town)
+
+    def matches(self, query):
+        return self.index.matches(query)
+
+
+class FTS5Backend:
+    """SQLite FTS5 table shared by every worker process using the database"""
+    name = 'fts5'
+    table = 'business_fts'
+
+    # bm25() column weights, in SEARCH_FIELDS order
+    weights = ', '.join(str(FIELD_WEIGHTS[f]) for f in SEARCH_FIELDS)
+
+    def __init__(self):
+        self.loaded = False
+
+    def load(self):
+        columns = ', '.join(SEARCH_FIELDS)
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                f"{columns}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            ))
+            indexed = conn.execute(text(f"SELECT count(*) FROM {self.table}")).scalar()
+            if not indexed:
+                conn.execute(text(
+                    f"INSERT INTO {self.table} (rowid, {columns}) "
+                    f"SELECT id, {columns} FROM businesses WHERE is_approved = 1"
+                ))
+        self.loaded = True
+
+    def refresh(self):
+        pass
+
+    def apply(self, business_changes):
+        if not self.loaded:
+            return
+        columns = ', '.join(SEARCH_FIELDS)
+        placeholders = ', '.join(f':{f}' for f in SEARCH_FIELDS)
+        with db.engine.begin() as conn:
+            conn.execute(text(f"DELETE FROM {self.table} WHERE rowid = :id"),
+                         [{'id': change.id} for change in business_changes])
+            rows = [dict(change.new, id=change.id) for change in business_changes
+                    if is_searchable(change.new)]
+            if rows:
+                conn.execute(text(f"INSERT INTO {self.table} (rowid, {columns}) "
+                                  f"VALUES (:id, {placeholders})"), rows)
+
+    def _match(self, tokens):
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def matches(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return set()
+        rows = db.session.execute(text(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH :match"),
+                                  {'match': self._match(tokens)})
+        return {row[0] for row in rows}
+
+    def search(self, query, limit, category='', town=''):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        match = self._match(tokens)
+        # Filters join the listing row, so they apply before the LIMIT
+        filters = ''.join(f" AND b.{field} = :{field}" for field, value
+                          in (('category', category), ('town', town)) if value)
+        rows = db.session.execute(text(
+            f"SELECT {self.table}.rowid, bm25({self.table}, {self.weights}) AS rank "
+            f"FROM {self.table} JOIN businesses AS b ON b.id = {self.table}.rowid "
+            f"WHERE {self.table} MATCH :match{filters} "
+            f"ORDER BY rank, {self.table}.rowid LIMIT :limit"
+        ), {'match': match, 'limit': -1 if limit is None else limit, 'category': category, 'town': town})
+        # bm25() is lower-is-better; flip it so callers always sort descending
+        return [(row[0], -row[1]) for row in rows]
+
+
+class SearchEngine:
+    """Full-text search over approved business listings"""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend_name = app.config.get('SEARCH_BACKEND', 'auto')
+        self.max_results = app.config.get('SEARCH_MAX_RESULTS', 500)
+        self.refresh_seconds = app.config.get('SEARCH_REFRESH_SECONDS', 60)
+        self.refreshed_at = datetime.utcnow()
+        self.backend = None
+
+    def _choose_backend(self):
+        name = self.backend_name
+        if name == 'auto':
+            name = 'fts5' if db.engine.dialect.name == 'sqlite' else 'memory'
+        if name == 'fts5':
+            backend = FTS5Backend()
+            try:
+                backend.load()
+                return backend
+            except OperationalError:
+                logger.warning('SQLite FTS5 unavailable, using in-process search index')
+        backend = MemoryBackend()
+        backend.load()
+        return backend
+
+    def _ensure_backend(self):
+        if self.backend is None:
+            with self.lock:
+                if self.backend is None:
+                    self.backend = self._choose_backend()
+        elif (datetime.utcnow() - self.refreshed_at).total_seconds() > self.refresh_seconds:
+            self.refreshed_at = datetime.utcnow()
+            self.backend.refresh()
+        return self.backend
+
+    def search(self, query, limit=None, category='', town='', ids=None):
+        """Ranked [(business_id, score), ...] for a free-text query
+
+        category, town and ids (a set of allowed business ids) restrict
+        the matches before the top limit (SEARCH_MAX_RESULTS by default)
+        are taken, so a filtered search is not cut down to whatever made
+        the unfiltered top results.
+        """
+        limit = limit or self.max_results
+        backend = self._ensure_backend()
+        if ids is None:
+            return backend.search(query, limit, category, town)
+        return [match for match in backend.search(query, None, category, town) if match[0] in ids][:limit]
+
+    def matches(self, query):
+        """Ids of every listing matching query, uncapped and unscored (for facet counts)"""
+        return self._ensure_backend().matches(query)
+
+    def apply(self, business_changes):
+        # The FTS5 table is shared between processes, so every writer must
+        # keep it current even if it has not served a search yet
+        self._ensure_backend().apply(business_changes)
+
+    def rebuild(self):
+        with self.lock:
+            if isinstance(self.backend, FTS5Backend):
+                with db.engine.begin() as conn:
+                    conn.execute(text(f"DELETE FROM {FTS5Backend.table}"))
+            self.backend = self._choose_backend()
+        return len(self.backend.index) if isinstance(self.backend, MemoryBackend) else None
+
+
+search_engine = SearchEngine()
+
+
+@changes.on_change(Business)
+def _update_search_index(business_changes):
+    search_engine.apply(business_changes)
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from app.models import Business
+from app.utils import changes
+from app.utils.search import tokenize
+
+# Fields that can change which listings a search returns, or their order
+RESULT_FIELDS = ('name', 'description', 'category', 'town', 'tags', 'is_approved',
+                 'is_active', 'is_featured', 'is_verified', 'subscription_tier',
+                 'latitude', 'longitude')
+
+changes.track(Business, RESULT_FIELDS)
+
+
+def cache_key(q='', category='', town='', cursor=None, per_page=None,
+              lat=None, lng=None, radius=None):
+    """Normalized search parameters; equivalent searches share one entry"""
+    return (' '.join(tokenize(q)), category or '', town or '', cursor or '', per_page,
+            lat, lng, radius)
+
+
+def cache_tags(category, town):
+    """Which business changes can affect a search with these filters"""
+    if category and town:
+        return {('category-town', category, town)}
+    if town:
+        return {('town', town)}
+    if category:
+        return {('category', category)}
+    return {('all',)}
+
+
+def affected_tags(fields):
+    category, town = fields.get('category'), fields.get('town')
+    return {('category-town', category, town), ('town', town), ('category', category), ('all',)}
+
+
+class SearchCache:
+    """Bounded LRU cache of search results with TTL and tag invalidation
+
+    Entries are tagged with the category/town filters of their search, so
+    a change to a listing only drops the entries that could include it.
+    """
+
+    def __init__(self, app=None):
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.max_entries = 1024
+        self.ttl = 300
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('SEARCH_CACHE_MAX_ENTRIES', 1024)
+        self.ttl = app.config.get('SEARCH_CACHE_TTL', 300)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, tags):
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, value, tags)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, _, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def invalidate(self, business_changes):
+        tags = set()
+        for change in business_changes:
+            if change.old and change.new and \
+                    all(change.old.get(f) == change.new.get(f) for f in RESULT_FIELDS):
+                continue
+            for fields in (change.old, change.new):
+                if fields:
+                    tags |= affected_tags(fields)
+        with self.lock:
+            for tag in tags:
+                for key in list(self.tags.get(tag, ())):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions
+            }
+
+
+search_cache = SearchCache()
+
+
+@changes.on_change(Business)
+def _invalidate_search_cache(business_changes):
+    search_cache.invalidate(business_changes)
@@ -0,0 +1,117 @@
+import importlib
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# Run in a fresh interpreter by measure(): import the app, build it, and
+# print how long each took along with the create_app phase timings
+_PROBE = """
+import json, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+print(json.dumps({'import_seconds': imported - started, 'create_app_seconds': created - imported,
+                  'phases': app.extensions['startup_profile'].phases}))
+"""
+
+
+class LazyModule:
+    """Stand-in for a heavy module, imported on first attribute access
+
+    Lets `pd = lazy_import('pandas')` sit at the top of a module without
+    every process paying for pandas at startup, only the ones that use it.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = self.__dict__['_module'] = importlib.import_module(self._name)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f'<lazy module {self._name!r} ({state})>'
+
+
+def lazy_import(name):
+    """The module if something already imported it, otherwise a LazyModule"""
+    return sys.modules.get(name) or LazyModule(name)
+
+
+class StartupProfile:
+    """Wall time of each create_app phase, kept in app.extensions['startup_profile']"""
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.phases = []
+
+    def mark(self, phase):
+        """Close the phase that ended now (it began at the previous mark)"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    @property
+    def seconds(self):
+        return self.last - self.started
+
+
+def summarize_importtime(log, top=15):
+    """Slowest imports in `python -X importtime` output
+
+    Returns (total seconds, [(module, self seconds, cumulative seconds)])
+    with the top imports by cumulative time; the total is the sum of
+    every module's own time.
+    """
+    imports = []
+    for line in log.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|', 2)
+        imports.append((module.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    total = sum(self_seconds for _, self_seconds, _ in imports)
+    imports.sort(key=lambda item: item[2], reverse=True)
+    return total, imports[:top]
+
+
+def measure(root, runs=3, top=15):
+    """Cold-start timings of the app, from `runs` fresh interpreters
+
+    Each run imports the app under -X importtime and calls create_app();
+    the median of each figure is reported, with the slowest imports and
+    the create_app phases of the median run.
+    """
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE], cwd=root,
+                                 capture_output=True, text=True)
+        wall = time.perf_counter() - started
+        if process.returncode:
+            error = '\n'.join(line for line in process.stderr.splitlines() if not line.startswith('import time:'))
+            raise RuntimeError(f'The app failed to start:\n{error}')
+        probe = json.loads(process.stdout.strip().splitlines()[-1])
+        import_total, slowest = summarize_importtime(process.stderr, top)
+        samples.append(dict(probe, wall_seconds=wall, import_total_seconds=import_total, slowest_imports=slowest))
+
+    samples.sort(key=lambda sample: sample['import_seconds'] + sample['create_app_seconds'])
+    result = dict(samples[len(samples) // 2])
+    for key in ('import_seconds', 'create_app_seconds', 'wall_seconds', 'import_total_seconds'):
+        result[key] = statistics.median(sample[key] for sample in samples)
+    result['startup_seconds'] = result['import_seconds'] + result['create_app_seconds']
+    result['runs'] = runs
+    return result
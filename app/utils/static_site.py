@@ -0,0 +1,231 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from sqlalchemy import select
+from flask import url_for
+from app import db
+from app.models import Business, Town
+from app.utils import changes
+
+logger = logging.getLogger(__name__)
+
+# Fields shown on the pre-rendered pages; other changes (e.g. view counts) are ignored
+PAGE_FIELDS = ('name', 'description', 'category', 'town', 'address', 'email', 'phone',
+               'website', 'facebook', 'twitter', 'instagram', 'logo', 'cover_image', 'gallery',
+               'operating_hours', 'services', 'tags', 'is_approved', 'is_active', 'is_featured',
+               'is_verified', 'subscription_tier')
+TOWN_PAGE_FIELDS = ('name', 'region', 'description')
+
+changes.track(Business, PAGE_FIELDS)
+changes.track(Town, TOWN_PAGE_FIELDS)
+
+
+def page_url(page):
+    """URL of a page: ('index',), ('town', name), ('category', name) or ('business', id)"""
+    if page[0] == 'index':
+        return url_for('main.index')
+    if page[0] == 'town':
+        return url_for('main.town_page', town_name=page[1])
+    if page[0] == 'category':
+        return url_for('main.category_page', category_name=page[1])
+    return url_for('main.business_page', business_id=page[1])
+
+
+def page_path(root, page):
+    """File the web server maps the page's URL to, e.g. town/George/index.html"""
+    if page[0] == 'index':
+        return os.path.join(root, 'index.html')
+    return os.path.join(root, page[0], str(page[1]), 'index.html')
+
+
+def affected_pages(change, business_pages):
+    """Pages whose HTML can differ after a committed Business change"""
+    if change.old and change.new and \
+            all(change.old.get(f) == change.new.get(f) for f in PAGE_FIELDS):
+        return set()
+    pages = {('index',)}
+    for fields in (change.old, change.new):
+        if fields:
+            if fields.get('town'):
+                pages.add(('town', fields['town']))
+            if fields.get('category'):
+                pages.add(('category', fields['category']))
+    if business_pages and change.new and change.new.get('is_approved'):
+        pages.add(('business', change.id))
+    return pages
+
+
+def render_page(client, root, page, url):
+    """Write one page's HTML; pages that no longer exist are removed"""
+    path = page_path(root, page)
+    response = client.get(url)
+    if response.status_code != 200:
+        if response.status_code != 404:
+            logger.warning('Static page %s not rendered: HTTP %d', url, response.status_code)
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(partial, 'wb') as f:
+        f.write(response.get_data())
+    os.replace(partial, path)
+    return True
+
+
+_worker_app = None
+
+
+def _init_worker(config):
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app(type('StaticBuildConfig', (), config))
+
+
+def _render_chunk(root, pages):
+    client = _worker_app.test_client()
+    return sum(render_page(client, root, page, url) for page, url in pages)
+
+
+class StaticSite:
+    """Pre-rendered HTML of public pages, for the web server to serve directly
+
+    A full build renders every town and category page (and optionally
+    every business page) across a process pool. Afterwards, committed
+    changes regenerate only the pages they affect, on a thread pool.
+    """
+
+    def __init__(self, app=None):
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.flushing = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.root = app.config.get('STATIC_SITE_DIR')
+        self.workers = app.config.get('STATIC_SITE_WORKERS') or os.cpu_count() or 1
+        self.business_pages = app.config.get('STATIC_SITE_BUSINESS_PAGES', False)
+        self.incremental = app.config.get('STATIC_SITE_INCREMENTAL', False)
+        self.delay = app.config.get('STATIC_SITE_DELAY_SECONDS', 2)
+
+    def all_pages(self, business_pages=None):
+        if business_pages is None:
+            business_pages = self.business_pages
+        pages = [('index',)]
+        with db.engine.connect() as conn:
+            pages += [('town', name) for (name,) in conn.execute(select(Town.name).order_by(Town.name))]
+            pages += [('category', name) for (name,) in conn.execute(
+                select(Business.category).where(Business.is_approved == True).distinct()
+                .order_by(Business.category))]
+            if business_pages:
+                pages += [('business', business_id) for (business_id,) in conn.execute(
+                    select(Business.id).where(Business.is_approved == True).order_by(Business.id))]
+        return pages
+
+    def _urls(self, pages):
+        with self.app.test_request_context():
+            return [(page, page_url(page)) for page in pages]
+
+    def build(self, business_pages=None, workers=None, chunk_size=200):
+        """Render every page into a fresh directory and swap it in
+
+        Returns {'pages', 'written', 'seconds', 'pages_per_second'}; pages
+        that failed to render count towards pages but not written or the rate.
+        """
+        started = time.perf_counter()
+        workers = workers or self.workers
+        pages = self._urls(self.all_pages(business_pages))
+        staging, previous = f'{self.root}.building', f'{self.root}.previous'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        chunks = [pages[i:i + chunk_size] for i in range(0, len(pages), chunk_size)]
+        if workers > 1:
+            # Each worker process runs its own app, configured like this one
+            config = {key: value for key, value in self.app.config.items() if key.isupper()}
+            config.update(SUGGEST_WARM_ON_STARTUP=False, PAGE_CACHE_ENABLED=False,
+                          STATIC_SITE_INCREMENTAL=False, COUNTERS_ENABLED=False)
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(config,)) as pool:
+                written = sum(pool.map(_render_chunk, [staging] * len(chunks), chunks))
+        else:
+            client = self.app.test_client()
+            written = sum(render_page(client, staging, page, url) for page, url in pages)
+
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.exists(self.root):
+            os.replace(self.root, previous)
+        os.replace(staging, self.root)
+        shutil.rmtree(previous, ignore_errors=True)
+
+        seconds = time.perf_counter() - started
+        return {'pages': len(pages), 'written': written, 'seconds': round(seconds, 2),
+                'pages_per_second': round(written / seconds, 1) if seconds else None}
+
+    def regenerate(self, pages):
+        """Re-render the given pages in place on a thread pool"""
+        pages = self._urls(pages)
+        with ThreadPoolExecutor(min(self.workers, len(pages)) or 1) as pool:
+            return sum(pool.map(lambda item: render_page(self.app.test_client(), self.root, *item), pages))
+
+    def queue(self, pages):
+        # Changes often come in bursts (e.g. an owner saving a form twice),
+        # so pages are collected for a moment and rendered once
+        with self.lock:
+            self.pending |= pages
+            if self.flushing or not self.pending:
+                return
+            self.flushing = True
+        timer = threading.Timer(self.delay, self._flush)
+        timer.daemon = True
+        timer.start()
+
+    def _flush(self):
+        with self.lock:
+            pages, self.pending = self.pending, set()
+            self.flushing = False
+        try:
+            with self.app.app_context():
+                self.regenerate(sorted(pages, key=str))
+        except Exception:
+            logger.exception('Static page regeneration failed')
+
+    def apply_business(self, business_changes):
+        if not self.incremental or not os.path.isdir(self.root or ''):
+            return
+        pages = set()
+        for change in business_changes:
+            pages |= affected_pages(change, self.business_pages)
+            if not (change.new and change.new.get('is_approved')):
+                path = page_path(self.root, ('business', change.id))
+                if os.path.exists(path):
+                    os.remove(path)
+        if pages:
+            self.queue(pages)
+
+    def apply_town(self, town_changes):
+        if not self.incremental or not os.path.isdir(self.root or ''):
+            return
+        pages = set()
+        for change in town_changes:
+            for fields in (change.old, change.new):
+                if fields:
+                    pages.add(('town', fields['name']))
+        self.queue(pages)
+
+
+static_site = StaticSite()
+
+
+@changes.on_change(Business)
+def _regenerate_business_pages(business_changes):
+    static_site.apply_business(business_changes)
+
+
+@changes.on_change(Town)
+def _regenerate_town_pages(town_changes):
+    static_site.apply_town(town_changes)
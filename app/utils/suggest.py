@@ -0,0 +1,342 @@
+import heapq
+import logging
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict, namedtuple
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.models import Business, Town
+from app.utils import changes
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_FIELDS = ('name', 'category', 'town', 'tags', 'views',
+                  'is_featured', 'is_approved', 'is_active')
+
+# Featured (boosted) listings outrank ones with this many times their views
+FEATURED_BOOST = 5
+
+Suggestion = namedtuple('Suggestion', ['kind', 'value', 'label', 'weight'])
+
+changes.track(Business, SUGGEST_FIELDS)
+changes.track(Town, ('name',))
+
+
+def normalize(value):
+    """Lowercase, accent-free text with single spaces between words"""
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(c for c in value if not unicodedata.combining(c)).replace("'", '')
+    return ' '.join(re.findall(r'\w+', value.lower()))
+
+
+def split_tags(tags):
+    return [tag.strip() for tag in (tags or '').split(',') if tag.strip()]
+
+
+def business_weight(fields):
+    weight = (fields.get('views') or 0) + 1
+    return weight * FEATURED_BOOST if fields.get('is_featured') else weight
+
+
+class SuggestIndex:
+    """Sorted prefix array of names, categories, towns and tags
+
+    Every word start of a label is a key, so 'kitchen' finds
+    "Mama's Kitchen". Weights live outside the sorted array, so view and
+    boost changes never reorder it. The heaviest entries per prefix are
+    kept in a top-k table that writes update in place; short prefixes,
+    whose ranges are largest, are precomputed when the index is built.
+    """
+
+    max_limit = 20
+    warm_prefix_length = 3
+    cache_size = 20000
+
+    def __init__(self):
+        self.keys = []
+        self.entry_terms = {}
+        self.labels = {}
+        self.weights = {}
+        self.businesses = {}
+        self.towns = set()
+        # prefix -> [entries heaviest first, complete]; complete means the
+        # list holds every entry under the prefix, not just the top k
+        self.top = OrderedDict()
+        self.lock = threading.RLock()
+        # While bulk loading, keys are appended and sorted once at the end
+        self.bulk = False
+
+    def _terms(self, label):
+        words = normalize(label).split(' ')
+        return sorted({' '.join(words[i:]) for i in range(len(words)) if words[i]})
+
+    def _prefixes(self, entry):
+        prefixes = set()
+        for term in self.entry_terms.get(entry, ()):
+            prefixes.update(term[:end] for end in range(1, len(term) + 1))
+        return prefixes
+
+    def _rank(self, entry):
+        return self.weights[entry], self.labels[entry]
+
+    def _update_top(self, entry, previous_weight):
+        # Keep cached top-k lists exact; when an entry that may have been
+        # displaced shrinks or disappears, drop the list to be rebuilt
+        weight = self.weights.get(entry)
+        for prefix in self._prefixes(entry):
+            cached = self.top.get(prefix)
+            if cached is None:
+                continue
+            entries, complete = cached
+            if entry in entries:
+                if weight is None:
+                    if complete:
+                        entries.remove(entry)
+                    else:
+                        del self.top[prefix]
+                    continue
+                if weight < previous_weight and not complete:
+                    del self.top[prefix]
+                    continue
+                entries.remove(entry)
+            elif weight is None:
+                continue
+            elif not complete and self._rank(entry) <= self._rank(entries[-1]):
+                continue
+            entries.append(entry)
+            entries.sort(key=self._rank, reverse=True)
+            if len(entries) > self.max_limit:
+                del entries[self.max_limit:]
+                cached[1] = False
+
+    def _set_entry(self, entry, label, weight):
+        previous_weight = self.weights.get(entry)
+        if entry not in self.entry_terms:
+            terms = self._terms(label)
+            self.entry_terms[entry] = terms
+            for term in terms:
+                if self.bulk:
+                    self.keys.append((term, entry))
+                else:
+                    insort(self.keys, (term, entry))
+        self.labels[entry] = label
+        self.weights[entry] = weight
+        if not self.bulk:
+            self._update_top(entry, previous_weight)
+
+    def _drop_entry(self, entry):
+        previous_weight = self.weights.pop(entry, None)
+        self._update_top(entry, previous_weight)
+        for term in self.entry_terms.pop(entry, ()):
+            position = bisect_left(self.keys, (term, entry))
+            if position < len(self.keys) and self.keys[position] == (term, entry):
+                del self.keys[position]
+        self.labels.pop(entry, None)
+
+    def _adjust(self, entry, label, delta):
+        weight = self.weights.get(entry, 0) + delta
+        if weight > 0 or (entry[0] == 'town' and entry[1] in self.towns):
+            self._set_entry(entry, label, max(weight, 0))
+        else:
+            self._drop_entry(entry)
+
+    def _groups(self, fields):
+        groups = {}
+        if fields.get('category'):
+            groups[('category', fields['category'])] = fields['category']
+        if fields.get('town'):
+            groups[('town', fields['town'])] = fields['town']
+        for tag in split_tags(fields.get('tags')):
+            groups[('tag', tag.lower())] = tag
+        return groups
+
+    def set_business(self, business_id, fields):
+        with self.lock:
+            if not Business.is_listed(fields):
+                self.remove_business(business_id)
+                return
+            entry = ('business', business_id)
+            label = fields.get('name') or ''
+            if entry in self.labels and self.labels[entry] != label:
+                self._drop_entry(entry)
+            weight = business_weight(fields)
+            groups = self._groups(fields)
+            previous_weight, previous_groups = self.businesses.get(business_id, (0, {}))
+            self.businesses[business_id] = (weight, groups)
+            self._set_entry(entry, label, weight)
+
+            # Categories, towns and tags weigh as much as their listings together
+            deltas = {group: -previous_weight for group in previous_groups}
+            for group in groups:
+                deltas[group] = deltas.get(group, 0) + weight
+            for group, delta in deltas.items():
+                if delta:
+                    self._adjust(group, groups.get(group) or previous_groups[group], delta)
+
+    def remove_business(self, business_id):
+        with self.lock:
+            previous = self.businesses.pop(business_id, None)
+            if previous is None:
+                return
+            weight, groups = previous
+            self._drop_entry(('business', business_id))
+            for group, label in groups.items():
+                self._adjust(group, label, -weight)
+
+    def set_town(self, name):
+        with self.lock:
+            self.towns.add(name)
+            entry = ('town', name)
+            self._set_entry(entry, name, self.weights.get(entry, 0))
+
+    def remove_town(self, name):
+        with self.lock:
+            self.towns.discard(name)
+            self._adjust(('town', name), name, 0)
+
+    def finish_bulk(self):
+        """Sort the key array and precompute top-k lists for short prefixes"""
+        self.keys.sort()
+        self.bulk = False
+        top = {}
+        for entry in sorted(self.weights, key=self._rank, reverse=True):
+            prefixes = set()
+            for term in self.entry_terms[entry]:
+                prefixes.update(term[:end] for end in range(1, min(len(term), self.warm_prefix_length) + 1))
+            for prefix in prefixes:
+                entries = top.setdefault(prefix, [])
+                if len(entries) <= self.max_limit:
+                    entries.append(entry)
+        for prefix, entries in top.items():
+            complete = len(entries) <= self.max_limit
+            self.top[prefix] = [entries[:self.max_limit], complete]
+
+    def suggest(self, prefix, limit=8):
+        prefix = normalize(prefix)
+        limit = min(limit, self.max_limit)
+        if not prefix:
+            return []
+        with self.lock:
+            cached = self.top.get(prefix)
+            if cached is None:
+                start = bisect_left(self.keys, (prefix,))
+                end = bisect_left(self.keys, (prefix + '\uffff',), start)
+                entries = {entry for _, entry in self.keys[start:end]}
+                top = heapq.nlargest(self.max_limit + 1, entries, key=self._rank)
+                cached = self.top[prefix] = [top[:self.max_limit], len(top) <= self.max_limit]
+                if len(self.top) > self.cache_size:
+                    self.top.popitem(last=False)
+            return [Suggestion(entry[0], entry[1], self.labels[entry], self.weights[entry])
+                    for entry in cached[0][:limit]]
+
+
+class Suggester:
+    """Typeahead suggestions served from memory, without touching the database"""
+
+    def __init__(self, app=None):
+        self.index = SuggestIndex()
+        self.built_at = None
+        self.rebuilding = False
+        # Changes committed while a rebuild runs, replayed onto the new index
+        self.replay = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.rebuild_seconds = app.config.get('SUGGEST_REBUILD_SECONDS', 600)
+        self.built_at = None
+        if app.config.get('SUGGEST_WARM_ON_STARTUP', True):
+            with app.app_context():
+                try:
+                    self.build()
+                except SQLAlchemyError:
+                    # Tables not created yet (e.g. before flask init-db)
+                    logger.info('Suggest index not built at startup', exc_info=True)
+
+    def build(self):
+        index = SuggestIndex()
+        index.bulk = True
+        with db.engine.connect() as conn:
+            for (name,) in conn.execute(select(Town.name)):
+                index.set_town(name)
+            rows = conn.execution_options(yield_per=5000).execute(
+                select(Business.id, *[getattr(Business, f) for f in SUGGEST_FIELDS])
+                .where(Business.is_approved == True)
+            )
+            for row in rows:
+                index.set_business(row[0], dict(zip(SUGGEST_FIELDS, row[1:])))
+        index.finish_bulk()
+        with self.index.lock:
+            replay, self.replay = self.replay, []
+            for apply, change in replay:
+                apply(index, change)
+            self.index = index
+        self.built_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        # Picks up view counts and writes from other worker processes
+        def run():
+            try:
+                with self.app.app_context():
+                    self.build()
+            except Exception:
+                logger.exception('Suggest index rebuild failed')
+            finally:
+                self.rebuilding = False
+
+        self.rebuilding = True
+        threading.Thread(target=run, daemon=True).start()
+
+    def suggest(self, prefix, limit=8):
+        if self.built_at is None:
+            self.build()
+        elif not self.rebuilding and time.monotonic() - self.built_at > self.rebuild_seconds:
+            self._rebuild_in_background()
+        return self.index.suggest(prefix, limit)
+
+    def _apply(self, apply, batch):
+        if self.built_at is None:
+            return
+        with self.index.lock:
+            for change in batch:
+                apply(self.index, change)
+                if self.rebuilding:
+                    self.replay.append((apply, change))
+
+    def apply_business(self, business_changes):
+        self._apply(_apply_business_change, business_changes)
+
+    def apply_town(self, town_changes):
+        self._apply(_apply_town_change, town_changes)
+
+
+def _apply_business_change(index, change):
+    if change.new is None:
+        index.remove_business(change.id)
+    else:
+        index.set_business(change.id, change.new)
+
+
+def _apply_town_change(index, change):
+    if change.old:
+        index.remove_town(change.old['name'])
+    if change.new:
+        index.set_town(change.new['name'])
+
+
+suggester = Suggester()
+
+
+@changes.on_change(Business)
+def _update_business_suggestions(business_changes):
+    suggester.apply_business(business_changes)
+
+
+@changes.on_change(Town)
+def _update_town_suggestions(town_changes):
+    suggester.apply_town(town_changes)
@@ -0,0 +1,264 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from app.utils.agent_metrics import agent_metrics, task_label
+from app.utils.agents import AGENTS, agents
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_HIGH = 0, 5, 10
+
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    agent TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    user_id INTEGER,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS ix_tasks_ready ON tasks (status, priority DESC, id);
+"""
+
+# Atomically take the most urgent ready tasks, and any whose worker died
+# with attempts left
+CLAIM = """
+UPDATE tasks SET status = 'running', attempts = attempts + 1, worker = ?, started_at = ?
+WHERE id IN (
+    SELECT id FROM tasks
+    WHERE (status = 'queued' AND run_after <= ?)
+       OR (status = 'running' AND started_at < ? AND attempts < max_attempts)
+    ORDER BY priority DESC, id LIMIT ?
+)
+RETURNING id, agent, payload, attempts, max_attempts, run_after
+"""
+
+# Tasks that hung or killed their worker on their last attempt
+EXPIRE = """
+UPDATE tasks SET status = 'failed', error = 'Timed out on its last attempt', finished_at = ?
+WHERE status = 'running' AND started_at < ? AND attempts >= max_attempts
+"""
+
+
+class TaskQueue:
+    """Persistent queue of AI agent tasks, run by a pool of workers
+
+    Tasks live in a SQLite file on the host, so they survive restarts and
+    need no broker. Workers claim the most urgent ready tasks (priority,
+    then age, up to TASK_BATCH_SIZE) with one atomic UPDATE, so any number
+    of threads and processes can share the queue, and hand each agent's
+    share to the agent registry as one batch. A task that raises is retried with
+    exponential backoff up to its max_attempts; one whose worker dies is
+    taken again after TASK_TIMEOUT_SECONDS, or marked failed if that was
+    its last attempt. Results are kept for
+    TASK_RESULT_TTL seconds for result() to poll.
+
+    With TASK_WORKER_MODE = 'thread' each app process runs TASK_WORKERS
+    worker threads, started on the first enqueue; with 'process' the
+    workers are separate processes started by `flask task-worker`.
+    """
+
+    def __init__(self, app=None):
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.path = app.config.get('TASK_QUEUE_PATH')
+        self.mode = app.config.get('TASK_WORKER_MODE', 'thread')
+        self.workers = app.config.get('TASK_WORKERS', 2)
+        self.max_attempts = app.config.get('TASK_MAX_ATTEMPTS', 3)
+        self.retry_seconds = app.config.get('TASK_RETRY_SECONDS', 10)
+        self.timeout = app.config.get('TASK_TIMEOUT_SECONDS', 300)
+        self.poll_seconds = app.config.get('TASK_POLL_SECONDS', 1)
+        self.result_ttl = app.config.get('TASK_RESULT_TTL', 86400)
+        self.batch_size = app.config.get('TASK_BATCH_SIZE', 20)
+        self.threads = []
+        self.pid = None
+        self.pruned_at = 0
+        self.schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self.schema_ready:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(QUEUE_SCHEMA)
+            self.schema_ready = True
+        return conn
+
+    def enqueue(self, agent, task_data, priority=PRIORITY_NORMAL, max_attempts=None, delay=0, user_id=None):
+        """Queue agent.process_task(task_data); returns the task id to poll"""
+        if agent not in AGENTS:
+            raise ValueError(f'Unknown agent {agent!r}')
+        now = time.time()
+        conn = self._connect()
+        try:
+            task_id = conn.execute(
+                'INSERT INTO tasks (agent, payload, priority, max_attempts, run_after, user_id, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (agent, json.dumps(task_data), priority, max_attempts or self.max_attempts,
+                 now + delay, user_id, now)
+            ).lastrowid
+        finally:
+            conn.close()
+        if self.mode == 'thread':
+            self._ensure_threads()
+        self.wakeup.set()
+        return task_id
+
+    def enqueue_many(self, agent, payloads, priority=PRIORITY_NORMAL, max_attempts=None, delay=0):
+        """Queue one task per payload in a single transaction; returns how many were queued"""
+        if agent not in AGENTS:
+            raise ValueError(f'Unknown agent {agent!r}')
+        now = time.time()
+        rows = [(agent, json.dumps(task_data), priority, max_attempts or self.max_attempts, now + delay, now)
+                for task_data in payloads]
+        if not rows:
+            return 0
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('BEGIN')
+                conn.executemany(
+                    'INSERT INTO tasks (agent, payload, priority, max_attempts, run_after, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        finally:
+            conn.close()
+        if self.mode == 'thread':
+            self._ensure_threads()
+        self.wakeup.set()
+        return len(rows)
+
+    def result(self, task_id):
+        """{'id', 'agent', 'status', 'attempts', 'result', 'error', 'user_id'} or None"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT id, agent, status, attempts, result, error, user_id FROM tasks WHERE id = ?', (task_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        task = dict(zip(('id', 'agent', 'status', 'attempts', 'result', 'error', 'user_id'), row))
+        task['result'] = json.loads(task['result']) if task['result'] else None
+        return task
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+        finally:
+            conn.close()
+
+    def _ensure_threads(self):
+        # Started on first use, and again in each forked worker process
+        if self.pid == os.getpid() and all(thread.is_alive() for thread in self.threads):
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.threads = []
+                self.pid = os.getpid()
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, name=f'task-worker-{len(self.threads)}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def claim(self, conn, worker):
+        now = time.time()
+        conn.execute(EXPIRE, (now, now - self.timeout))
+        return sorted(conn.execute(CLAIM, (worker, now, now, now - self.timeout, self.batch_size)).fetchall())
+
+    def run_batch(self, conn, worker):
+        """Claim and run ready tasks; False when none is ready"""
+        claimed = self.claim(conn, worker)
+        if not claimed:
+            return False
+        now = time.time()
+        by_agent = {}
+        for task in claimed:
+            by_agent.setdefault(task[1], []).append(task)
+        for agent, tasks in by_agent.items():
+            payloads = [json.loads(task[2]) for task in tasks]
+            try:
+                for task, task_data in zip(tasks, payloads):
+                    agent_metrics.observe_wait(agent, task_label(agents.get(agent), task_data), now - task[5])
+                with self.app.app_context():
+                    results = agents.dispatch_many(agent, payloads)
+            except Exception as exc:
+                # The agent could not be created, so none of them ran
+                results = [exc] * len(tasks)
+            # Failed tasks come back as their exceptions; only those are retried,
+            # so tasks that succeeded alongside them never run twice
+            for task, result in zip(tasks, results):
+                if isinstance(result, Exception):
+                    self._failed(conn, task, result)
+                else:
+                    self._done(conn, task, result)
+        return True
+
+    def _done(self, conn, task, result):
+        conn.execute("UPDATE tasks SET status = 'done', result = ?, error = NULL, finished_at = ? WHERE id = ?",
+                     (json.dumps(result, default=str), time.time(), task[0]))
+
+    def _failed(self, conn, task, exc):
+        task_id, agent, _, attempts, max_attempts, _ = task
+        logger.error('Task %d (%s) failed on attempt %d', task_id, agent, attempts, exc_info=exc)
+        error = repr(exc)
+        if attempts < max_attempts:
+            conn.execute("UPDATE tasks SET status = 'queued', error = ?, run_after = ? WHERE id = ?",
+                         (error, time.time() + self.retry_seconds * 2 ** (attempts - 1), task_id))
+        else:
+            conn.execute("UPDATE tasks SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                         (error, time.time(), task_id))
+
+    def prune(self, conn):
+        conn.execute("DELETE FROM tasks WHERE status IN ('done', 'failed') AND finished_at < ?",
+                     (time.time() - self.result_ttl,))
+
+    def work(self, stop=None):
+        """Worker loop: run ready tasks, then wait for an enqueue or the poll interval"""
+        worker = f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+        conn = self._connect()
+        try:
+            while stop is None or not stop.is_set():
+                try:
+                    while self.run_batch(conn, worker):
+                        pass
+                    if time.monotonic() - self.pruned_at > 3600:
+                        self.pruned_at = time.monotonic()
+                        self.prune(conn)
+                except Exception:
+                    logger.exception('Task worker %s failed', worker)
+                self.wakeup.wait(self.poll_seconds)
+                self.wakeup.clear()
+        finally:
+            conn.close()
+
+
+def _worker_process(config):
+    # Entry point of each `flask task-worker` process
+    from app import create_app
+    app = create_app(type('TaskWorkerConfig', (), config))
+    task_queue.work()
+
+
+task_queue = TaskQueue()
@@ -39,30 +39,148 @@ class Config:
     # AI configuration
     AI_LOG_FILE = os.path.join(basedir, 'ai_activity.log')
     
+    # SQL instrumentation: per-request/per-task query counts and N+1 warnings
+    QUERY_STATS_ENABLED = True
+    QUERY_N_PLUS_ONE_THRESHOLD = 5  # same statement this many times in one request
+    QUERY_STATS_HEADERS = False  # X-DB-* response headers; always on in debug mode
+    
+    # Search configuration
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or 'auto'  # auto, fts5 or memory
+    SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS') or 500)
+    SEARCH_REFRESH_SECONDS = 60
+    SEARCH_CACHE_MAX_ENTRIES = 1024
+    SEARCH_CACHE_TTL = 300  # seconds; bounds staleness from other workers' writes
+    
+    # Listing pages (keyset pagination)
+    LISTINGS_PER_PAGE = int(os.environ.get('LISTINGS_PER_PAGE') or 20)
+    LISTINGS_MAX_PER_PAGE = 200
+    LISTINGS_STREAM_THRESHOLD = 50  # stream pages at least this large
+    FACETS_REFRESH_SECONDS = 60
+    
+    # Listing ranking (see app.utils.ranking)
+    RANKING_HALF_LIFE_DAYS = 14  # popularity halves every two weeks
+    
+    # Rendered public pages (anonymous visitors) and fragments
+    PAGE_CACHE_ENABLED = True
+    PAGE_CACHE_MAX_ENTRIES = 512
+    PAGE_CACHE_MAX_AGE = 60  # seconds browsers may reuse a page before revalidating
+    PAGE_CACHE_VERSION_SECONDS = 5  # seconds a page's data version is reused before re-querying
+    
+    # Write-behind view/click/share counters
+    COUNTERS_ENABLED = True
+    COUNTERS_SPOOL_PATH = os.environ.get('COUNTERS_SPOOL_PATH') or os.path.join(basedir, 'counters_spool.db')
+    COUNTERS_FLUSH_SECONDS = 5  # at most this long of counts is lost on a crash
+    COUNTERS_FLUSH_SIZE = 1000  # flush early once this many listings have counts
+    COUNTERS_BATCH_SIZE = 500
+    
+    # Category/town peer statistics for owner dashboards (app.utils.peers)
+    PEER_STATS_ENABLED = True
+    
+    # Platform totals for reports, recounted at most this often (seconds)
+    PLATFORM_METRICS_ENABLED = True
+    PLATFORM_METRICS_MAX_AGE = 300
+    
+    # Weekly/monthly reports (app.utils.reports)
+    REPORTS_CACHE_SECONDS = 3600
+    REPORTS_MAX_ENTRIES = 24
+    REPORTS_CHUNK_SIZE = 5000  # rows fetched per round trip
+    
+    # Background AI agent tasks (app.utils.tasks)
+    TASK_QUEUE_PATH = os.environ.get('TASK_QUEUE_PATH') or os.path.join(basedir, 'task_queue.db')
+    TASK_WORKER_MODE = os.environ.get('TASK_WORKER_MODE') or 'thread'  # or 'process': run flask task-worker
+    TASK_WORKERS = int(os.environ.get('TASK_WORKERS') or 2)
+    TASK_MAX_ATTEMPTS = 3
+    TASK_RETRY_SECONDS = 10  # doubled after each failed attempt
+    TASK_TIMEOUT_SECONDS = 300  # a running task is retried after this long
+    TASK_POLL_SECONDS = 1
+    TASK_RESULT_TTL = 86400
+    TASK_BATCH_SIZE = 20  # tasks claimed at once; an agent's share is dispatched as one batch
+    # AI team agents created in create_app (True for all); the others load on first use
+    AGENTS_WARM_ON_STARTUP = ('accountant', 'analyst', 'concierge', 'curator', 'sentinel')
+    AGENT_METRICS_ENABLED = True  # per-agent latency histograms, served at /metrics
+    # /metrics, /api/search/cache-stats and /api/beacon-stats require "Authorization: Bearer <token>";
+    # unset, they are served only in debug mode
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # Periodic jobs: boost expiry, renewal reminders, reports (app.utils.scheduler)
+    SCHEDULER_ENABLED = True  # run due jobs from a thread in each app process (one process per job, by lock)
+    SCHEDULER_TICK_SECONDS = 30
+    SCHEDULER_CHUNK_SIZE = 200  # rows per chunk; a job stops at its time budget and resumes next tick
+    SCHEDULER_HISTORY_DAYS = 30  # job_runs kept this long
+    
+    # Analytics events and their hourly/daily rollups (app.utils.analytics)
+    ANALYTICS_ENABLED = True
+    ANALYTICS_FLUSH_SECONDS = 5
+    ANALYTICS_FLUSH_SIZE = 1000
+    ANALYTICS_ROLLUP_SECONDS = 300  # how often finished hours are compacted
+    ANALYTICS_HOURLY_RETENTION_DAYS = 14
+    ANALYTICS_DAILY_RETENTION_DAYS = 400
+    ANALYTICS_COMPACT_CHUNK = 5000
+    
+    # Listing beacons (POST /api/business/<id>/view, /click or /share)
+    BEACON_ENABLED = True
+    BEACON_QUEUE_SIZE = 10000  # beacons beyond this are dropped, not queued
+    BEACON_BATCH_SIZE = 500
+    
+    # Pre-rendered static site (flask build-static-site)
+    STATIC_SITE_DIR = os.environ.get('STATIC_SITE_DIR') or os.path.join(basedir, 'static_site')
+    STATIC_SITE_WORKERS = None  # defaults to the number of CPUs
+    STATIC_SITE_BUSINESS_PAGES = False
+    STATIC_SITE_INCREMENTAL = True  # regenerate affected pages after each change, once built
+    STATIC_SITE_DELAY_SECONDS = 2
+    
+    # Towns and subscription plans cached per process (app.utils.reference)
+    REFERENCE_CHECK_SECONDS = 30  # how often to look for changes from other processes
+    
+    # Search box typeahead
+    SUGGEST_WARM_ON_STARTUP = True
+    SUGGEST_REBUILD_SECONDS = 600
+    
+    # "Near me" search
+    GEO_CELL_DEGREES = 0.1  # grid cell size, roughly 10km
+    GEO_DEFAULT_RADIUS_KM = 25
+    GEO_MAX_RADIUS_KM = 500
+    GEO_REFRESH_SECONDS = 60
+    
+    # Cold-start budget enforced by tests/test_startup.py and `flask startup-profile --check`
+    STARTUP_BUDGET_SECONDS = float(os.environ.get('STARTUP_BUDGET_SECONDS') or 1.5)  # import app + create_app()
+    IMPORT_BUDGET_SECONDS = float(os.environ.get('IMPORT_BUDGET_SECONDS') or 1.5)  # all module imports, under -X importtime
+    
     # Platform settings
     PLATFORM_NAME = 'CapeBiz Connect'
     PLATFORM_DOMAIN = os.environ.get('PLATFORM_DOMAIN') or 'localhost:5000'
     SUPPORT_EMAIL = 'support@capebizconnect.co.za'
     
-    # Subscription plans
+    # Subscription plans; the subscription_plans table is seeded and kept in
+    # step with these by flask init-db
     SUBSCRIPTION_PLANS = {
         'free': {
+            'name': 'Free',
+            'duration_days': 36500,
             'price': 0,
             'features': ['Basic listing', '1 photo', 'Contact information']
         },
         'starter': {
+            'name': 'Starter',
+            'duration_days': 30,
             'price': 199,
             'features': ['5 photos', 'Website link', 'Social media links', 'Basic analytics']
         },
         'professional': {
+            'name': 'Professional',
+            'duration_days': 30,
             'price': 499,
             'features': ['10 photos', 'SEO optimization', 'Featured placement', 'Advanced analytics']
         },
         'premium': {
+            'name': 'Premium',
+            'duration_days': 30,
             'price': 999,
             'features': ['20 photos', 'Video showcase', 'Priority support', 'Detailed reports', 'Monthly boost credit']
         },
         'enterprise': {
+            'name': 'Enterprise',
+            'duration_days': 30,
             'price': 1599,
             'features': ['Unlimited photos', 'Video showcase', 'Dedicated support', 'Custom analytics', 'API access']
         }
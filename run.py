@@ -2,6 +2,7 @@ from app import create_app
 from app.models import User, Business, Town, SubscriptionPlan
 from app import db
 import os
+import click
 
 app = create_app()
 
@@ -22,18 +23,18 @@ def init_db():
     
     # Create default towns
     towns = [
-        {'name': 'Cape Town', 'region': 'City of Cape Town', 'description': 'The legislative capital of South Africa'},
-        {'name': 'Stellenbosch', 'region': 'Winelands', 'description': 'Famous for its vineyards and Cape Dutch architecture'},
-        {'name': 'Franschhoek', 'region': 'Winelands', 'description': 'Picturesque valley known for French-inspired cuisine and wines'},
-        {'name': 'Paarl', 'region': 'Winelands', 'description': 'Known for its pearl-like granite rocks and wine production'},
-        {'name': 'Worcester', 'region': 'Breede Valley', 'description': 'Largest town in the Breede River Valley'},
-        {'name': 'Hermanus', 'region': 'Overberg', 'description': 'Popular whale watching destination'},
-        {'name': 'George', 'region': 'Garden Route', 'description': 'The capital of the Garden Route'},
-        {'name': 'Knysna', 'region': 'Garden Route', 'description': 'Known for its forests and lagoon'},
-        {'name': 'Plettenberg Bay', 'region': 'Garden Route', 'description': 'Upscale beach resort town'},
-        {'name': 'Mossel Bay', 'region': 'Garden Route', 'description': 'Historical town with beautiful beaches'},
-        {'name': 'Oudtshoorn', 'region': 'Little Karoo', 'description': 'Ostrich capital of the world'},
-        {'name': 'Swellendam', 'region': 'Overberg', 'description': 'Third oldest town in South Africa'}
+        {'name': 'Cape Town', 'region': 'City of Cape Town', 'description': 'The legislative capital of South Africa', 'latitude': -33.9249, 'longitude': 18.4241},
+        {'name': 'Stellenbosch', 'region': 'Winelands', 'description': 'Famous for its vineyards and Cape Dutch architecture', 'latitude': -33.9321, 'longitude': 18.8602},
+        {'name': 'Franschhoek', 'region': 'Winelands', 'description': 'Picturesque valley known for French-inspired cuisine and wines', 'latitude': -33.9133, 'longitude': 19.1169},
+        {'name': 'Paarl', 'region': 'Winelands', 'description': 'Known for its pearl-like granite rocks and wine production', 'latitude': -33.7342, 'longitude': 18.9621},
+        {'name': 'Worcester', 'region': 'Breede Valley', 'description': 'Largest town in the Breede River Valley', 'latitude': -33.6465, 'longitude': 19.4485},
+        {'name': 'Hermanus', 'region': 'Overberg', 'description': 'Popular whale watching destination', 'latitude': -34.4187, 'longitude': 19.2345},
+        {'name': 'George', 'region': 'Garden Route', 'description': 'The capital of the Garden Route', 'latitude': -33.963, 'longitude': 22.4617},
+        {'name': 'Knysna', 'region': 'Garden Route', 'description': 'Known for its forests and lagoon', 'latitude': -34.0363, 'longitude': 23.0471},
+        {'name': 'Plettenberg Bay', 'region': 'Garden Route', 'description': 'Upscale beach resort town', 'latitude': -34.0527, 'longitude': 23.3716},
+        {'name': 'Mossel Bay', 'region': 'Garden Route', 'description': 'Historical town with beautiful beaches', 'latitude': -34.1831, 'longitude': 22.146},
+        {'name': 'Oudtshoorn', 'region': 'Little Karoo', 'description': 'Ostrich capital of the world', 'latitude': -33.5907, 'longitude': 22.2014},
+        {'name': 'Swellendam', 'region': 'Overberg', 'description': 'Third oldest town in South Africa', 'latitude': -34.0226, 'longitude': 20.4417}
     ]
     
     for town_data in towns:
@@ -41,24 +42,191 @@ def init_db():
         if not town:
             town = Town(**town_data)
             db.session.add(town)
+        elif town.latitude is None:
+            town.latitude = town_data['latitude']
+            town.longitude = town_data['longitude']
     
-    # Create subscription plans
-    plans = [
-        {'name': 'Free', 'code': 'free', 'price': 0, 'duration_days': 36500, 'features': 'Basic listing, 1 photo, Contact information'},
-        {'name': 'Starter', 'code': 'starter', 'price': 199, 'duration_days': 30, 'features': '5 photos, Website link, Social media links, Basic analytics'},
-        {'name': 'Professional', 'code': 'professional', 'price': 499, 'duration_days': 30, 'features': '10 photos, SEO optimization, Featured placement, Advanced analytics'},
-        {'name': 'Premium', 'code': 'premium', 'price': 999, 'duration_days': 30, 'features': '20 photos, Video showcase, Priority support, Detailed reports, Monthly boost credit'},
-        {'name': 'Enterprise', 'code': 'enterprise', 'price': 1599, 'duration_days': 30, 'features': 'Unlimited photos, Video showcase, Dedicated support, Custom analytics, API access'}
-    ]
+    # Place listings without coordinates at their town
+    db.session.flush()
+    for town in Town.query.filter(Town.latitude.isnot(None)):
+        Business.query.filter(Business.town == town.name, Business.latitude.is_(None)) \
+            .update({'latitude': town.latitude, 'longitude': town.longitude}, synchronize_session=False)
     
-    for plan_data in plans:
-        plan = SubscriptionPlan.query.filter_by(code=plan_data['code']).first()
+    # Subscription plans, kept in step with Config.SUBSCRIPTION_PLANS
+    for code, settings in app.config['SUBSCRIPTION_PLANS'].items():
+        plan = SubscriptionPlan.query.filter_by(code=code).first()
         if not plan:
-            plan = SubscriptionPlan(**plan_data)
+            plan = SubscriptionPlan(code=code)
             db.session.add(plan)
+        plan.name = settings['name']
+        plan.price = settings['price']
+        plan.duration_days = settings['duration_days']
+        plan.features = ', '.join(settings['features'])
+        plan.is_active = True
+    
+    # Plans no longer offered stay for existing payments, but are retired
+    SubscriptionPlan.query.filter(SubscriptionPlan.code.notin_(app.config['SUBSCRIPTION_PLANS'])) \
+        .update({'is_active': False}, synchronize_session=False)
     
     db.session.commit()
+    
+    # Score listings created before rank_score existed
+    from app.utils.ranking import ranking
+    ranking.recompute()
+    
+    from app.utils.peers import peer_stats
+    peer_stats.rebuild()
     print("Database initialized with default data.")
 
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index():
+    """Rebuild the full-text search index from the businesses table"""
+    from app.utils.search import search_engine
+    indexed = search_engine.rebuild()
+    print(f"Search index rebuilt ({search_engine.backend.name} backend"
+          + (f", {indexed} listings)." if indexed is not None else ")."))
+
+@app.cli.command("recompute-rankings")
+def recompute_rankings():
+    """Rescore every listing's rank_score (run periodically, e.g. from cron)"""
+    from app.utils.ranking import ranking
+    changed = ranking.recompute()
+    print(f"Rankings recomputed ({changed} listings changed).")
+
+@app.cli.command("task-worker")
+@click.option('--processes', type=int, help='Worker processes (default: TASK_WORKERS)')
+def task_worker(processes):
+    """Run background AI agent tasks until interrupted"""
+    import multiprocessing
+    from app.utils.tasks import _worker_process, task_queue
+    processes = processes or app.config['TASK_WORKERS']
+    if processes == 1:
+        task_queue.work()
+        return
+    config = {key: value for key, value in app.config.items() if key.isupper()}
+    config.update(TASK_WORKER_MODE='process')
+    workers = [multiprocessing.Process(target=_worker_process, args=(config,), name=f'task-worker-{i}')
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    print(f"Started {processes} task workers on {app.config['TASK_QUEUE_PATH']}.")
+    for worker in workers:
+        worker.join()
+
+@app.cli.command("rebuild-peer-stats")
+def rebuild_peer_stats():
+    """Recompute category/town peer statistics from the businesses table"""
+    from app.utils.peers import peer_stats
+    groups = peer_stats.rebuild()
+    print(f"Peer statistics rebuilt ({groups} groups).")
+
+@app.cli.command("build-static-site")
+@click.option('--business-pages', is_flag=True, help='Also pre-render every business page')
+@click.option('--workers', type=int, help='Rendering processes (default: one per CPU)')
+def build_static_site(business_pages, workers):
+    """Pre-render public pages into STATIC_SITE_DIR for the web server"""
+    from app.utils.static_site import static_site
+    report = static_site.build(business_pages=business_pages or None, workers=workers)
+    print(f"Rendered {report['written']} of {report['pages']} pages in {report['seconds']}s "
+          f"({report['pages_per_second']} pages/s) into {static_site.root}.")
+
+@app.cli.command("flush-counters")
+def flush_counters():
+    """Apply spooled view/click/share counts to the database now"""
+    from app.utils.counters import counters
+    changed = counters.flush()
+    print(f"Counters flushed ({changed} listings updated).")
+
+@app.cli.command("analytics-compact")
+def analytics_compact():
+    """Write buffered analytics events and roll finished hours up now"""
+    from app.utils.analytics import analytics
+    analytics.flush()
+    compacted = analytics.compact()
+    print(f"Analytics compacted ({compacted} events rolled up).")
+
+@app.cli.group("curator")
+def curator_cli():
+    """Curator AI maintenance"""
+
+@curator_cli.command("recategorize")
+@click.option('--batch-size', default=5000, show_default=True, help='Listings per streamed batch and UPDATE')
+@click.option('--workers', type=int, help='Matching processes (default: one per CPU)')
+def curator_recategorize(batch_size, workers):
+    """Re-run keyword categorization over every listing"""
+    from app.utils.agents import agents
+    report = agents.get('curator').recategorize_all(batch_size=batch_size, workers=workers)
+    print(f"Recategorized {report['businesses']} listings in {report['seconds']}s "
+          f"({report['changed']} changed category).")
+
+@curator_cli.command("review")
+@click.option('--chunk-size', default=1000, show_default=True, help='Listings per chunk, UPDATE and checkpoint')
+@click.option('--workers', type=int, help='Scoring processes (default: one per CPU)')
+@click.option('--restart', is_flag=True, help='Start over instead of resuming an interrupted review')
+def curator_review(chunk_size, workers, restart):
+    """Re-review every unapproved listing, approving those that now qualify"""
+    from app.utils.agents import agents
+    
+    def progress(report):
+        print(f"  {report['reviewed']}/{report['total']} reviewed, {report['approved']} approved "
+              f"(up to id {report['after_id']}, {report['seconds']}s)")
+    
+    report = agents.get('curator').review_pending(chunk_size=chunk_size, workers=workers,
+                                                  resume=not restart, progress=progress)
+    print(f"{'Resumed review' if report['resumed'] else 'Review'} done: {report['reviewed']} listings, "
+          f"{report['approved']} approved and queued for notification, in {report['seconds']}s.")
+    for issue, count in sorted(report['issues'].items(), key=lambda item: item[1], reverse=True):
+        print(f"  {count:8}  {issue}")
+
+@app.cli.command("scheduler")
+@click.option('--once', is_flag=True, help='Run the jobs that are due now and exit (e.g. from cron)')
+def run_scheduler(once):
+    """Run periodic jobs (boost expiry, renewal reminders, reports) in the foreground"""
+    from app.utils.scheduler import scheduler
+    if once:
+        for run in scheduler.run_pending():
+            print(f"{run['job']} ({run['scheduled_for']:%Y-%m-%d %H:%M}): {run['status']}, "
+                  f"{run['items']} items in {run['duration_seconds']}s")
+        return
+    print(f"Scheduler running {len(scheduler.jobs)} jobs; checking every {scheduler.tick_seconds}s.")
+    scheduler.run_forever()
+
+@app.cli.command("jobs")
+def list_jobs():
+    """Show each scheduled job with its next run and last result"""
+    from app.utils.scheduler import scheduler
+    for job, state, latest in scheduler.status():
+        next_run = f"{state.next_run_at:%Y-%m-%d %H:%M}" if state else 'not registered yet'
+        last = f"{latest.status} for {latest.scheduled_for:%Y-%m-%d %H:%M}, {latest.items} items " \
+               f"in {latest.duration_seconds}s" if latest else 'never run'
+        print(f"{job.name:24} {job.schedule.expression:16} next {next_run:18} last {last}")
+
+@app.cli.command("startup-profile")
+@click.option('--runs', default=3, show_default=True, help='Fresh interpreters to time (the median is reported)')
+@click.option('--top', default=15, show_default=True, help='Slowest imports to list')
+@click.option('--check', is_flag=True, help='Exit non-zero if startup exceeds STARTUP_BUDGET_SECONDS or IMPORT_BUDGET_SECONDS')
+def startup_profile(runs, top, check):
+    """Time a cold start: slowest imports (python -X importtime) and each create_app phase"""
+    from app.utils.startup import measure
+    profile = measure(os.path.dirname(os.path.abspath(__file__)), runs=runs, top=top)
+    print("Slowest imports (cumulative / self seconds):")
+    for module, self_seconds, cumulative in profile['slowest_imports']:
+        print(f"  {cumulative:8.3f} {self_seconds:8.3f}  {module}")
+    print("create_app phases (seconds):")
+    for phase, seconds in sorted(profile['phases'], key=lambda item: item[1], reverse=True):
+        print(f"  {seconds:8.3f}  {phase}")
+    print(f"Importing app {profile['import_seconds']:.3f}s, create_app() {profile['create_app_seconds']:.3f}s, "
+          f"startup {profile['startup_seconds']:.3f}s; all imports {profile['import_total_seconds']:.3f}s "
+          f"(median of {runs} runs).")
+    if check:
+        over = []
+        if profile['startup_seconds'] > app.config['STARTUP_BUDGET_SECONDS']:
+            over.append(f"startup {profile['startup_seconds']:.3f}s > {app.config['STARTUP_BUDGET_SECONDS']}s")
+        if profile['import_total_seconds'] > app.config['IMPORT_BUDGET_SECONDS']:
+            over.append(f"imports {profile['import_total_seconds']:.3f}s > {app.config['IMPORT_BUDGET_SECONDS']}s")
+        if over:
+            raise click.ClickException(f"Startup over budget: {'; '.join(over)}")
+        print("Startup within budget.")
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,36 @@
+"""Cold-start budget: fails when importing the app or create_app() gets slower
+
+Budgets come from STARTUP_BUDGET_SECONDS and IMPORT_BUDGET_SECONDS in
+config.py (overridable through the environment, e.g. on slower CI hosts).
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.utils.startup import measure
+from config import Config
+
+
+@pytest.fixture(scope='module')
+def profile():
+    return measure(ROOT, runs=3)
+
+
+def _slowest(profile):
+    return ', '.join(f'{module} {cumulative:.3f}s' for module, _, cumulative in profile['slowest_imports'][:5])
+
+
+def test_startup_within_budget(profile):
+    assert profile['startup_seconds'] <= Config.STARTUP_BUDGET_SECONDS, (
+        f"import app + create_app() took {profile['startup_seconds']:.3f}s "
+        f"(budget {Config.STARTUP_BUDGET_SECONDS}s); phases: {profile['phases']}")
+
+
+def test_imports_within_budget(profile):
+    assert profile['import_total_seconds'] <= Config.IMPORT_BUDGET_SECONDS, (
+        f"imports took {profile['import_total_seconds']:.3f}s "
+        f"(budget {Config.IMPORT_BUDGET_SECONDS}s); slowest: {_slowest(profile)}")